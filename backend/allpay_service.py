@@ -13,6 +13,7 @@ from typing import Optional, Dict, Any
 from sqlalchemy.orm import Session
 
 from models import User, Subscription
+import entitlements
 
 
 def utc_now():
@@ -215,6 +216,7 @@ def process_allpay_payment(
         existing.allpay_payment_id = webhook_data.get('payment_id')
         if not existing.allpay_recurring_id and webhook_data.get('recurring_id'):
             existing.allpay_recurring_id = webhook_data.get('recurring_id')
+        entitlements.refresh_user(db, existing.user_id)
         db.commit()
         return {
             'success': True,
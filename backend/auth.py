@@ -6,17 +6,24 @@
 
 import os
 import json
+import time
+import asyncio
 import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import text
 from sqlalchemy.orm import Session
 from models import User
-from database import get_db
+import entitlements
+from database import get_db, register_notify_handler, notify_listener_alive
 from encryption import encrypt_for_storage, hash_for_lookup, decrypt, encrypt
+from ttl_cache import TTLCache
 
 # הגדרות JWT
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
@@ -24,12 +31,98 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 ימים
 
 # הגדרות הצפנת סיסמאות
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# hashes with a different cost factor are re-hashed on the next successful login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt רץ ב-thread pool ייעודי ומוגבל כדי לא לחסום את ה-event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Requests waiting beyond the busy workers; more than this gets a fast 503
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "16"))
+
+_password_executor: Optional[ThreadPoolExecutor] = None
+_password_pending = 0
+_password_metrics = {
+    'completed': 0,
+    'rejected': 0,
+    'upgraded': 0,
+}
 
 # Security scheme
 security = HTTPBearer()
 security_optional = HTTPBearer(auto_error=False)
 
+# Cache של משתמשים מאומתים: sha256(token) -> {user_id, email, username}
+# תוקף הרשומה לא עולה על תוקף ה-token עצמו (exp)
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "300"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+# ביטול רשומות בשאר ה-workers (PostgreSQL NOTIFY, נשלח ב-commit)
+PRINCIPALS_CHANNEL = "principals_revoked"
+
+# user_id -> token hashes (for invalidation on account deletion)
+_tokens_by_user: Dict[str, set] = {}
+_tokens_lock = threading.Lock()
+
+def _forget_token(token_key: str, principal: dict) -> None:
+    with _tokens_lock:
+        keys = _tokens_by_user.get(principal["user_id"])
+        if keys is not None:
+            keys.discard(token_key)
+            if not keys:
+                del _tokens_by_user[principal["user_id"]]
+
+_principals = TTLCache(
+    maxsize=PRINCIPAL_CACHE_MAX_ENTRIES,
+    ttl=PRINCIPAL_CACHE_TTL_SECONDS,
+    on_evict=_forget_token
+)
+
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def _cache_principal(token_key: str, principal: dict, expires_at: Optional[float]) -> None:
+    """שומר משתמש מאומת ב-cache עד ל-exp של ה-token לכל היותר"""
+    ttl = PRINCIPAL_CACHE_TTL_SECONDS
+    if expires_at is not None:
+        ttl = min(ttl, float(expires_at) - time.time())
+    if ttl <= 0:
+        return
+    _principals.set(token_key, principal, ttl=ttl)
+    with _tokens_lock:
+        _tokens_by_user.setdefault(principal["user_id"], set()).add(token_key)
+
+def _drop_user_principals(user_id: str) -> None:
+    with _tokens_lock:
+        token_keys = _tokens_by_user.pop(user_id, set())
+    for token_key in token_keys:
+        _principals.pop(token_key)
+
+def invalidate_user_principals(user_id: str, db: Optional[Session] = None) -> None:
+    """
+    מוחק מה-cache את כל ה-tokens של משתמש (למשל במחיקת חשבון).
+    עם db - גם בשאר ה-workers, כשהטרנזקציה של הקורא עושה commit. לקרוא לפני ה-commit.
+    """
+    _drop_user_principals(user_id)
+    if db is None or db.get_bind().dialect.name != 'postgresql':
+        return
+    # נשלח גם ל-listener של ה-worker הזה, וכך מכסה בקשה שאימתה את המשתמש מחדש לפני ה-commit
+    db.execute(text("SELECT pg_notify(:channel, :payload)"),
+               {"channel": PRINCIPALS_CHANNEL, "payload": user_id})
+
+def _on_principals_revoked(user_ids) -> None:
+    for user_id in user_ids:
+        _drop_user_principals(user_id)
+
+# ביטולים שנשלחו בזמן שה-listener היה מנותק אבדו - מוחקים את כל ה-cache
+register_notify_handler(PRINCIPALS_CHANNEL, _on_principals_revoked, _principals.clear)
+
+def get_principal_cache_metrics() -> Dict[str, Any]:
+    """מדדי ה-cache של המשתמשים המאומתים"""
+    return {
+        **_principals.stats(),
+        'listener_alive': notify_listener_alive(),
+    }
+
 def hash_password(password: str) -> str:
     """מצפין סיסמה"""
     # bcrypt has a 72-byte limit - encode and check
@@ -51,6 +144,60 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         plain_password = password_bytes[:72].decode('utf-8', errors='ignore')
     return pwd_context.verify(plain_password, hashed_password)
 
+def _get_password_executor() -> ThreadPoolExecutor:
+    global _password_executor
+    if _password_executor is None:
+        _password_executor = ThreadPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS,
+            thread_name_prefix="password"
+        )
+    return _password_executor
+
+async def run_password_work(fn, *args):
+    """
+    מריץ עבודת bcrypt ב-thread pool הייעודי.
+    כשהתור מלא מחזיר 503 מיד במקום לצבור המתנה.
+    """
+    global _password_pending
+    if _password_pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+        _password_metrics['rejected'] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="השרת עמוס כרגע, נסו שוב בעוד מספר שניות",
+            headers={"Retry-After": "2"}
+        )
+    _password_pending += 1
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(_get_password_executor(), fn, *args)
+        _password_metrics['completed'] += 1
+        return result
+    finally:
+        _password_pending -= 1
+
+def verify_and_update_password(plain_password: str, hashed_password: str):
+    """בודק סיסמה ומחזיר (תקין, hash חדש אם צריך לעדכן את ה-cost factor)"""
+    password_bytes = plain_password.encode('utf-8')
+    if len(password_bytes) > 72:
+        plain_password = password_bytes[:72].decode('utf-8', errors='ignore')
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+def shutdown_password_executor() -> None:
+    """Release the password worker threads (call on application shutdown)"""
+    global _password_executor
+    if _password_executor is not None:
+        _password_executor.shutdown(wait=False)
+        _password_executor = None
+
+def get_password_pool_metrics() -> Dict[str, Any]:
+    """מדדי ה-thread pool של bcrypt"""
+    return {
+        **_password_metrics,
+        'workers': PASSWORD_HASH_WORKERS,
+        'max_queue': PASSWORD_HASH_MAX_QUEUE,
+        'pending': _password_pending,
+        'rounds': BCRYPT_ROUNDS,
+    }
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """יוצר JWT token"""
     to_encode = data.copy()
@@ -62,33 +209,51 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def is_own_token(token: str) -> bool:
+    """
+    בודק לפי ה-header (בלי אימות חתימה) אם זה JWT שלנו (HS256, בלי kid)
+    או Firebase ID token (RS256 עם kid)
+    """
+    try:
+        header = jwt.get_unverified_header(token)
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Token לא תקין או פג תוקף")
+    return header.get("alg") == ALGORITHM and not header.get("kid")
+
 def verify_token(credentials: HTTPAuthorizationCredentials, db: Session) -> dict:
     """בודק ומחזיר את נתוני המשתמש מה-token תוך שימוש בבסיס הנתונים"""
     token = credentials.credentials
     
-    # ניסיון אימות Firebase token קודם
-    try:
-        from firebase_config import verify_firebase_token
+    # משתמש שכבר אומת עם אותו token - בלי SQL ובלי פענוח
+    token_key = _token_key(token)
+    principal = _principals.get(token_key)
+    if principal is not None:
+        return dict(principal)
+    
+    if not is_own_token(token):
+        # Firebase token - אימות מול המפתחות הציבוריים השמורים
+        try:
+            from firebase_config import verify_firebase_token
+        except ImportError:
+            raise HTTPException(status_code=401, detail="Token לא תקין או פג תוקף")
         firebase_user = verify_firebase_token(token)
-        # אם זה Firebase token, נחפש את המשתמש בבסיס הנתונים
+        # נחפש את המשתמש בבסיס הנתונים
         email = firebase_user.get("email")
+        user = None
         if email:
             email_hash = hash_for_lookup(email)
             user = db.query(User).filter(User.email_hash == email_hash).first()
-            if user:
-                return {
-                    "user_id": user.id,
-                    "email": email,
-                    "username": decrypt(user.username_encrypted)
-                }
-    except (ImportError, HTTPException):
-        # Firebase לא מוגדר או token לא תקין - ננסה JWT
-        pass
-    except Exception as e:
-        print(f"Firebase token verification error in verify_token: {e}")
-        pass
+        if not user:
+            raise HTTPException(status_code=401, detail="משתמש לא נמצא")
+        principal = {
+            "user_id": user.id,
+            "email": email,
+            "username": decrypt(user.username_encrypted)
+        }
+        _cache_principal(token_key, principal, firebase_user.get("exp"))
+        return dict(principal)
     
-    # ניסיון אימות JWT token
+    # JWT token שלנו
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
@@ -100,11 +265,13 @@ def verify_token(credentials: HTTPAuthorizationCredentials, db: Session) -> dict
         if not user:
             raise HTTPException(status_code=401, detail="משתמש לא נמצא")
             
-        return {
+        principal = {
             "user_id": user_id, 
             "email": decrypt(user.email_encrypted),
             "username": decrypt(user.username_encrypted)
         }
+        _cache_principal(token_key, principal, payload.get("exp"))
+        return dict(principal)
     except JWTError:
         raise HTTPException(status_code=401, detail="Token לא תקין או פג תוקף")
 
@@ -128,7 +295,7 @@ def get_current_user_optional(
     except:
         return None
 
-def register_user(username: str, email: str, password: str, db: Session) -> dict:
+async def register_user(username: str, email: str, password: str, db: Session) -> dict:
     """רושם משתמש חדש בבסיס הנתונים"""
     # Debug: Log password info (DO NOT log actual password in production!)
     print(f"🔍 [AUTH] register_user called:")
@@ -150,7 +317,7 @@ def register_user(username: str, email: str, password: str, db: Session) -> dict
     
     # יצירת מזהה ייחודי
     user_id = hashlib.sha256(f"{username}{email}{datetime.now()}".encode()).hexdigest()[:16]
-    hashed_password = hash_password(password)
+    hashed_password = await run_password_work(hash_password, password)
     
     new_user = User(
         id=user_id,
@@ -165,6 +332,7 @@ def register_user(username: str, email: str, password: str, db: Session) -> dict
     
     try:
         db.add(new_user)
+        entitlements.refresh_user(db, new_user.id)
         db.commit()
         db.refresh(new_user)
         return {"user_id": user_id, "username": username, "email": email}
@@ -172,7 +340,7 @@ def register_user(username: str, email: str, password: str, db: Session) -> dict
         db.rollback()
         raise HTTPException(status_code=500, detail=f"שגיאה בשמירת המשתמש: {str(e)}")
 
-def authenticate_user(username: str, password: str, db: Session) -> Optional[dict]:
+async def authenticate_user(username: str, password: str, db: Session) -> Optional[dict]:
     """מאמת משתמש עם שם משתמש/אימייל וסיסמה"""
     # נרמול וחיפוש לפי האש
     username_hash = hash_for_lookup(username)
@@ -187,7 +355,17 @@ def authenticate_user(username: str, password: str, db: Session) -> Optional[dic
     if not user or not user.password_hash:
         return None
         
-    if verify_password(password, user.password_hash):
+    valid, new_hash = await run_password_work(verify_and_update_password, password, user.password_hash)
+    if valid:
+        if new_hash:
+            # שדרוג ה-cost factor לערך המוגדר (BCRYPT_ROUNDS)
+            user.password_hash = new_hash
+            try:
+                db.commit()
+                _password_metrics['upgraded'] += 1
+            except Exception as e:
+                db.rollback()
+                print(f"⚠️ [AUTH] Error upgrading password hash: {e}")
         return {
             "user_id": user.id,
             "username": decrypt(user.username_encrypted),
@@ -233,6 +411,7 @@ def create_or_get_google_user(google_user_info: dict, db: Session) -> dict:
     
     try:
         db.add(new_user)
+        entitlements.refresh_user(db, new_user.id)
         db.commit()
         db.refresh(new_user)
         return {
@@ -285,6 +464,7 @@ def create_or_get_firebase_user(firebase_user_info: dict, db: Session) -> dict:
     
     try:
         db.add(new_user)
+        entitlements.refresh_user(db, new_user.id)
         db.commit()
         db.refresh(new_user)
         return {
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Backfill and check the daily admin metrics rollup (daily_metrics)
+Run this from the backend directory (safe to run while the app is serving):
+    python3 backfill_metrics.py [--days 90] [--from 2024-01-01]
+    python3 backfill_metrics.py --check [--days 30]
+
+Backfill recomputes one row per UTC day, each in its own transaction, so it
+can be stopped and re-run. Snapshots of past days that were never rolled up
+are reconstructed where the data allows (premium/trial counts stay empty).
+--check compares the stored rows with the live tables and exits with status
+1 if anything differs.
+"""
+
+import sys
+import argparse
+from datetime import date, timedelta
+from database import SessionLocal
+from metrics_rollup import backfill, check_consistency, utc_today
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill or check the daily metrics rollup")
+    parser.add_argument("--days", type=int, default=None, help="Number of days up to today (default: 90, 30 with --check)")
+    parser.add_argument("--from", dest="start", type=date.fromisoformat, default=None, help="First day to backfill (YYYY-MM-DD)")
+    parser.add_argument("--check", action="store_true", help="Only compare stored rows with the live aggregates")
+    args = parser.parse_args()
+
+    today = utc_today()
+    db = SessionLocal()
+    try:
+        if args.check:
+            days = args.days or 30
+            print(f"🔵 [METRICS] Checking the last {days} days against the live tables...")
+            mismatches = check_consistency(db, days)
+            for mismatch in mismatches:
+                print(f"   ⚠️ {mismatch['day']} {mismatch['field']}: stored={mismatch['stored']} live={mismatch['live']}")
+            if mismatches:
+                print(f"❌ [METRICS] {len(mismatches)} mismatches (re-run without --check to recompute those days)")
+                sys.exit(1)
+            print("✅ [METRICS] Rollup matches the live aggregates")
+            return
+
+        start = args.start or today - timedelta(days=(args.days or 90) - 1)
+        print(f"🔵 [METRICS] Backfilling {start} .. {today}...")
+        written = backfill(db, start, today)
+        print(f"✅ [METRICS] Done: {written} days rolled up")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ [METRICS] Failed: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for token verification in get_current_user
+Run this from the backend directory:
+    python3 bench_auth.py
+
+No database or network needed: a throwaway RSA key stands in for Google's
+Firebase certificates, and the warm case is served from the principal cache.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+import firebase_admin
+import firebase_admin.auth
+from firebase_admin import credentials
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import jwt
+
+os.environ.setdefault("FIREBASE_PROJECT_ID", "bench-project")
+
+import auth
+import firebase_config
+
+ITERATIONS = 2000
+PROJECT_ID = firebase_config.FIREBASE_PROJECT_ID or "bench-project"
+firebase_config.FIREBASE_PROJECT_ID = PROJECT_ID
+
+
+def bench(label: str, fn, iterations: int = ITERATIONS) -> None:
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<55} {elapsed / iterations * 1e6:>10.1f} µs/op")
+
+
+def make_firebase_token() -> str:
+    """Sign a Firebase-shaped ID token and install its certificate in the key cache"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "bench")])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now).not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    firebase_config._public_keys = {"bench-kid": cert.public_bytes(serialization.Encoding.PEM).decode()}
+    firebase_config._keys_expire_at = time.time() + 3600
+
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ).decode()
+    claims = {
+        "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+        "aud": PROJECT_ID,
+        "sub": "bench-uid",
+        "email": "bench@example.com",
+        "iat": int(time.time()),
+        "exp": int(time.time()) + 3600,
+    }
+    return jwt.encode(claims, private_pem, algorithm="RS256", headers={"kid": "bench-kid"})
+
+
+def init_bench_firebase_app() -> None:
+    """Initialize firebase_admin with a throwaway service account (no network calls are made)"""
+    if firebase_admin._apps:
+        return
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    firebase_admin.initialize_app(credentials.Certificate({
+        "type": "service_account",
+        "project_id": PROJECT_ID,
+        "private_key": key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        ).decode(),
+        "client_email": f"bench@{PROJECT_ID}.iam.gserviceaccount.com",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }))
+
+
+def legacy_own_token(token: str) -> None:
+    """Previous order: firebase_admin verification first, fall back to our JWT"""
+    try:
+        firebase_admin.auth.verify_id_token(token)
+    except Exception:
+        pass
+    jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+
+
+def routed_own_token(token: str) -> None:
+    if auth.is_own_token(token):
+        jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGORITHM])
+
+
+def routed_firebase_token(token: str) -> None:
+    if not auth.is_own_token(token):
+        firebase_config.verify_firebase_token(token)
+
+
+if __name__ == "__main__":
+    init_bench_firebase_app()
+    own_token = auth.create_access_token(data={"sub": "bench-user", "email": "bench@example.com"})
+    firebase_token = make_firebase_token()
+
+    print(f"🔵 {ITERATIONS} iterations per case\n")
+    bench("own JWT, legacy (Firebase attempt first)", lambda: legacy_own_token(own_token))
+    bench("own JWT, routed by header", lambda: routed_own_token(own_token))
+    bench("Firebase ID token, routed, cached public keys", lambda: routed_firebase_token(firebase_token))
+
+    # Warm get_current_user: identity comes from the principal cache
+    principal = {"user_id": "bench-user", "email": "bench@example.com", "username": "bench"}
+    for token in (own_token, firebase_token):
+        auth._cache_principal(auth._token_key(token), principal, time.time() + 3600)
+    for label, token in (("own JWT", own_token), ("Firebase ID token", firebase_token)):
+        bearer = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+        bench(f"get_current_user warm, {label}", lambda: auth.get_current_user(bearer, db=None))
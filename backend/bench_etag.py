@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Polling workload with and without conditional GET (If-None-Match)
+Run this from the backend directory against a development database:
+    python3 bench_etag.py [polls] [change_every]
+
+Creates a throwaway user with contacts and reminders, then replays the app's
+polling pattern (contacts, reminders, usage status, subscription status) -
+once always downloading the full responses, once revalidating with the last
+ETag - with a contact edit every `change_every` polls. Reports bytes sent
+and server CPU time. The user is deleted at the end.
+"""
+
+import io
+import sys
+import time
+import uuid
+import contextlib
+
+from fastapi.testclient import TestClient
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+    from database import init_db
+    init_db()
+    from encryption import init_encryption
+    init_encryption()
+
+ENDPOINTS = ["/api/contacts", "/api/reminders", "/api/usage/status", "/api/subscription/status"]
+CONTACTS = 50
+REMINDERS = 20
+
+
+def setup(client: TestClient) -> tuple:
+    name = f"bench{uuid.uuid4().hex[:8]}"
+    with contextlib.redirect_stdout(io.StringIO()):
+        r = client.post("/api/auth/register", json={"username": name, "email": f"{name}@example.com", "password": "bench-password"})
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+        contact_ids = [
+            client.post("/api/contacts", json={"name": f"איש קשר {i}"}, headers=headers).json()["id"]
+            for i in range(CONTACTS)
+        ]
+        for contact_id in contact_ids[:REMINDERS]:
+            client.post("/api/reminders", json={"contact_id": contact_id, "reminder_type": "daily", "specific_time": "09:00"}, headers=headers)
+    return headers, contact_ids
+
+
+def replay(client: TestClient, headers: dict, contact_ids: list, polls: int, change_every: int, conditional: bool) -> dict:
+    etags = {}
+    sent_bytes = 0
+    not_modified = 0
+    cpu = 0.0
+    for poll in range(polls):
+        if change_every and poll and poll % change_every == 0:
+            with contextlib.redirect_stdout(io.StringIO()):
+                client.put(f"/api/contacts/{contact_ids[0]}", json={"name": f"שינוי {poll}"}, headers=headers)
+        for endpoint in ENDPOINTS:
+            request_headers = dict(headers)
+            if conditional and endpoint in etags:
+                request_headers["If-None-Match"] = etags[endpoint]
+            start = time.process_time()
+            with contextlib.redirect_stdout(io.StringIO()):
+                r = client.get(endpoint, headers=request_headers)
+            cpu += time.process_time() - start
+            sent_bytes += len(r.content)
+            if r.status_code == 304:
+                not_modified += 1
+            elif "etag" in r.headers:
+                etags[endpoint] = r.headers["etag"]
+    return {"bytes": sent_bytes, "cpu": cpu, "not_modified": not_modified, "requests": polls * len(ENDPOINTS)}
+
+
+if __name__ == "__main__":
+    polls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    change_every = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    client = TestClient(main.app)
+    headers, contact_ids = setup(client)
+    try:
+        print(f"🔵 {polls} polls x {len(ENDPOINTS)} endpoints, {CONTACTS} contacts, {REMINDERS} reminders, "
+              f"a contact edit every {change_every} polls\n")
+        full = replay(client, headers, contact_ids, polls, change_every, conditional=False)
+        conditional = replay(client, headers, contact_ids, polls, change_every, conditional=True)
+        for label, result in (("always full", full), ("If-None-Match", conditional)):
+            print(f"  {label:<14} {result['bytes'] / 1024:9.1f} KiB  CPU {result['cpu']:6.2f}s "
+                  f"({result['cpu'] / result['requests'] * 1000:.2f} ms/request)  "
+                  f"304: {result['not_modified']}/{result['requests']}")
+        print(f"\n  saved: {(1 - conditional['bytes'] / full['bytes']) * 100:.1f}% bytes, "
+              f"{(1 - conditional['cpu'] / full['cpu']) * 100:.1f}% CPU")
+    finally:
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.delete("/api/account", headers=headers)
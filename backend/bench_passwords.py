@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark for password hashing under a login storm
+Run this from the backend directory:
+    python3 bench_passwords.py [concurrent_logins]
+
+Compares bcrypt verification inline on the event loop (the old handlers)
+with the bounded password pool: login throughput, and how late a
+lightweight "unrelated request" coroutine gets scheduled meanwhile.
+No database needed.
+"""
+
+import sys
+import time
+import asyncio
+import statistics
+
+from fastapi import HTTPException
+
+import auth
+
+PROBE_INTERVAL = 0.01  # Seconds between probes of an unrelated endpoint
+
+
+async def probe(stop: asyncio.Event, lags: list) -> None:
+    """Stands in for an unrelated request: measures event loop scheduling delay"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+
+async def login_inline(password: str, hashed: str) -> None:
+    auth.verify_and_update_password(password, hashed)
+
+
+async def login_pooled(password: str, hashed: str) -> None:
+    await auth.run_password_work(auth.verify_and_update_password, password, hashed)
+
+
+async def storm(login, logins: int, password: str, hashed: str) -> None:
+    stop = asyncio.Event()
+    lags = []
+    probe_task = asyncio.create_task(probe(stop, lags))
+    await asyncio.sleep(0)
+
+    async def one():
+        try:
+            await login(password, hashed)
+            return True
+        except HTTPException:
+            return False
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe_task
+
+    ok = sum(results)
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    print(f"  logins ok/rejected: {ok}/{logins - ok} in {elapsed:.2f}s ({ok / elapsed:.1f} logins/s)")
+    print(f"  unrelated request delay: p50 {statistics.median(lags_ms):.1f} ms, "
+          f"max {lags_ms[-1]:.1f} ms ({len(lags)} probes)")
+
+
+if __name__ == "__main__":
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    password = "correct horse battery staple"
+    hashed = auth.hash_password(password)
+
+    print(f"🔵 {logins} concurrent logins, bcrypt rounds={auth.BCRYPT_ROUNDS}, "
+          f"pool workers={auth.PASSWORD_HASH_WORKERS}, max queue={auth.PASSWORD_HASH_MAX_QUEUE}\n")
+    print("Inline on the event loop:")
+    asyncio.run(storm(login_inline, logins, password, hashed))
+    print("Bounded password pool:")
+    asyncio.run(storm(login_pooled, logins, password, hashed))
+    auth.shutdown_password_executor()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Admin user/subscription breakdown: one COUNT per figure vs a single pass
+Run this from the backend directory against a development database:
+    python3 bench_stats.py [users] [runs]
+
+Builds a synthetic copy of the users and subscriptions tables (default 1M
+users, ~12% premium / 20% trial, ~15% with a subscription) in a throwaway
+schema, then times the per-figure COUNT queries the dashboard used to run
+against stats_queries.get_status_counts - first with only the primary keys,
+then with the stats indexes. The schema is dropped at the end.
+"""
+
+import io
+import sys
+import time
+import statistics
+import contextlib
+
+from sqlalchemy import text
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from database import engine, SessionLocal
+    from metrics_rollup import _live_snapshot
+    from stats_queries import get_status_counts
+
+SCHEMA = "bench_stats"
+
+
+def build(users: int) -> None:
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}"))
+        for table in ("users", "subscriptions"):
+            conn.execute(text(
+                f"CREATE TABLE {SCHEMA}.{table} (LIKE public.{table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS);"
+                f"ALTER TABLE {SCHEMA}.{table} ADD PRIMARY KEY (id)"
+            ))
+        conn.execute(text(f"""
+            INSERT INTO {SCHEMA}.users (id, username_hash, username_encrypted, email_hash, email_encrypted,
+                                        created_at, subscription_status, sync_version)
+            SELECT 'u' || n, 'h' || n, 'x', 'e' || n, 'x', now() - (n % 700) * interval '1 day',
+                   CASE WHEN n % 25 < 3 THEN 'premium' WHEN n % 5 = 1 THEN 'trial' ELSE 'free' END, 0
+            FROM generate_series(1, :users) AS n
+        """), {"users": users})
+        conn.execute(text(f"""
+            INSERT INTO {SCHEMA}.subscriptions (id, user_id, plan_type, status, started_at, expires_at, is_launch_price)
+            SELECT n, 'u' || n, CASE WHEN n % 3 = 0 THEN 'yearly' ELSE 'monthly' END,
+                   CASE WHEN n % 25 < 3 THEN 'active' WHEN n % 2 = 0 THEN 'expired' ELSE 'cancelled' END,
+                   now() - interval '20 days', now() + interval '10 days', false
+            FROM generate_series(1, :users) AS n
+            WHERE n % 25 < 3 OR n % 10 = 7
+        """), {"users": users})
+    vacuum()
+
+
+def vacuum() -> None:
+    # VACUUM sets the visibility map that index-only scans depend on
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"VACUUM ANALYZE {SCHEMA}.users"))
+        conn.execute(text(f"VACUUM ANALYZE {SCHEMA}.subscriptions"))
+
+
+def add_indexes() -> None:
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE INDEX ON {SCHEMA}.users (subscription_status);
+            CREATE INDEX ON {SCHEMA}.subscriptions (plan_type) WHERE status = 'active';
+        """))
+    vacuum()
+
+
+def measure(fn, runs: int) -> tuple:
+    db = SessionLocal()
+    try:
+        db.execute(text(f"SET search_path TO {SCHEMA}"))
+        result = fn(db)  # warm-up
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            fn(db)
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), result
+    finally:
+        db.rollback()
+        db.close()
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 9
+
+    print(f"🔵 Building {users:,} synthetic users in schema {SCHEMA}...")
+    build(users)
+    try:
+        for label, prepare in (("primary keys only", None), ("with stats indexes", add_indexes)):
+            if prepare:
+                prepare()
+            per_figure, expected = measure(_live_snapshot, runs)
+            single_pass, counts = measure(get_status_counts, runs)
+            assert counts == expected, (counts, expected)
+            print(f"\n  {label}")
+            print(f"    one COUNT per figure (6 queries) {per_figure:9.1f} ms")
+            print(f"    single pass (1 query)            {single_pass:9.1f} ms  ({per_figure / single_pass:.1f}x)")
+        print(f"\n  counts: {counts}")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
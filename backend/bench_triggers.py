@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Next-trigger engine benchmark: one reminder per call vs one batch call
+Run this from the backend directory:
+    python3 bench_triggers.py [reminders]
+
+Correctness against a reference implementation is covered by
+test_trigger_engine.py. No database needed.
+"""
+
+import sys
+import time
+import random
+from datetime import datetime, timezone
+
+import trigger_engine
+from trigger_engine import ReminderSchedule
+
+ZONES = ["Asia/Jerusalem", "America/New_York", "Europe/London", "Australia/Sydney", "UTC", None,
+         "Europe/Paris", "Asia/Tokyo", "America/Los_Angeles"]
+
+
+def benchmark(count: int) -> None:
+    rng = random.Random(7)
+    common_masks = [0b0111110, 0b1000001, 0b0010101, 0b0000001, 0b1111111]
+    schedules = [
+        ReminderSchedule(
+            reminder_type=rng.choice(['daily', 'weekly', 'weekly', 'recurring']),
+            interval_type='days',
+            interval_value=rng.randint(1, 14),
+            weekday_mask=rng.choice(common_masks),
+            time_minutes=rng.randrange(0, 1440, 15),
+            timezone=rng.choice(ZONES),
+            last_triggered=None
+        )
+        for _ in range(count)
+    ]
+    now = datetime.now(timezone.utc)
+
+    start = time.perf_counter()
+    single = [trigger_engine.next_trigger(schedule, now) for schedule in schedules]
+    per_call = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = trigger_engine.next_triggers(schedules, now)
+    batched = time.perf_counter() - start
+
+    print(f"\n🔵 {count:,} reminders, {len(ZONES)} time zones")
+    print(f"  one per call: {per_call:7.2f}s  ({per_call / count * 1e6:.2f} µs/reminder)")
+    print(f"  one batch:    {batched:7.2f}s  ({batched / count * 1e6:.2f} µs/reminder)")
+    print(f"  results identical: {single == batch}")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    benchmark(count)
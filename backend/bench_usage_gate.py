@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+SQL statements per usage-gate check: one query per figure vs the snapshot
+Run this from the backend directory against a development database:
+    python3 bench_usage_gate.py [runs]
+
+Creates a free (expired trial, some usage today), a trial and a premium user
+with ids starting with "bench-gate-", then counts the statements each
+check_can_generate_message issues (a before_cursor_execute listener on the
+engine) and times it:
+- before: the per-figure queries the gate used to run, kept here as
+  legacy_check_can_generate_message
+- after, cache miss: usage_limiter's single snapshot query
+- after, cache hit: the snapshot served from the entitlements cache
+The bench users are deleted at the end.
+"""
+
+import io
+import sys
+import time
+import statistics
+import contextlib
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import event, func
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import entitlements
+    import settings_service
+    import usage_limiter
+    from database import engine, SessionLocal
+    from models import User, UsageStats, AppSettings, Subscription, Coupon, CouponUsage
+
+USER_PREFIX = "bench-gate-"
+
+
+class StatementCounter:
+    """Counts statements sent to the database while active"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(engine, "before_cursor_execute", self._count)
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def count_statements(fn, *args) -> tuple:
+    """(statements issued by fn(*args), its result)"""
+    with StatementCounter() as counter:
+        result = fn(*args)
+    return counter.count, result
+
+
+# ---- The gate before the snapshot: one query per figure ----
+
+def _legacy_setting(db, key: str, default: str) -> str:
+    setting = db.query(AppSettings).filter(AppSettings.key == key).first()
+    return setting.value if setting else default
+
+
+def _legacy_setting_int(db, key: str, default: int) -> int:
+    try:
+        return int(_legacy_setting(db, key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def _legacy_trial_end(db, user):
+    trial_days = _legacy_setting_int(db, 'trial_days', 14)
+    trial_days += db.query(func.sum(Coupon.value)).join(CouponUsage).filter(
+        CouponUsage.user_id == user.id,
+        Coupon.coupon_type == 'trial_extension'
+    ).scalar() or 0
+    return user.trial_started_at + timedelta(days=trial_days)
+
+
+def _legacy_status(db, user_id: str) -> str:
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        return 'free'
+    now = datetime.now(timezone.utc)
+    status = 'free'
+    if db.query(Subscription).filter(
+        Subscription.user_id == user_id,
+        Subscription.status == 'active',
+        Subscription.expires_at > now
+    ).first():
+        status = 'premium'
+    elif user.trial_started_at and now < _legacy_trial_end(db, user):
+        status = 'trial'
+    if user.subscription_status != status:
+        user.subscription_status = status
+        db.commit()
+    return status
+
+
+def legacy_check_can_generate_message(db, user_id: str) -> tuple:
+    """check_can_generate_message as it was before get_usage_snapshot (statement for statement)"""
+    status = _legacy_status(db, user_id)
+    info = {'status': status, 'can_generate': True, 'reason': None}
+    if status == 'premium':
+        return True, info
+    if status == 'trial':
+        user = db.query(User).filter(User.id == user_id).first()
+        info['trial_days_remaining'] = max(0, (_legacy_trial_end(db, user) - datetime.now(timezone.utc)).days)
+        return True, info
+
+    if _legacy_setting(db, 'freemium_enabled', 'true').lower() not in ('true', '1', 'yes'):
+        return False, {**info, 'can_generate': False, 'reason': 'freemium_disabled'}
+    daily_limit = _legacy_setting_int(db, 'free_messages_per_day', 10)
+    monthly_limit = _legacy_setting_int(db, 'free_messages_per_month', 300)
+    today = date.today()
+    usage = db.query(UsageStats).filter(UsageStats.user_id == user_id, UsageStats.date == today).first()
+    daily_used = usage.messages_generated if usage else 0
+    usage = db.query(UsageStats).filter(UsageStats.user_id == user_id, UsageStats.date == today).first()
+    rewarded_bonus = usage.rewarded_video_bonus if usage else 0
+    monthly_used = db.query(func.sum(UsageStats.messages_generated)).filter(
+        UsageStats.user_id == user_id,
+        UsageStats.date >= today.replace(day=1)
+    ).scalar() or 0
+
+    info.update(daily_used=daily_used, rewarded_bonus=rewarded_bonus, monthly_used=monthly_used)
+    if daily_used >= daily_limit + rewarded_bonus:
+        return False, {**info, 'can_generate': False, 'reason': 'daily_limit_reached'}
+    if monthly_used >= monthly_limit:
+        return False, {**info, 'can_generate': False, 'reason': 'monthly_limit_reached'}
+    return True, info
+
+
+# ---- Setup ----
+
+def create_users(db) -> dict:
+    """A free, a trial and a premium bench user; status -> user_id"""
+    now = datetime.now(timezone.utc)
+    users = {
+        'free': now - timedelta(days=60),
+        'trial': now - timedelta(days=1),
+        'premium': None,
+    }
+    for status, trial_started_at in users.items():
+        db.add(User(
+            id=USER_PREFIX + status, username_hash=USER_PREFIX + status, username_encrypted="x",
+            email_hash=USER_PREFIX + status + "@example.com", email_encrypted="x",
+            subscription_status=status, trial_started_at=trial_started_at,
+        ))
+    db.flush()
+    db.add(Subscription(
+        user_id=USER_PREFIX + 'premium', plan_type='monthly', status='active',
+        started_at=now - timedelta(days=3), expires_at=now + timedelta(days=27),
+    ))
+    db.add(UsageStats(user_id=USER_PREFIX + 'free', date=date.today(), messages_generated=3, rewarded_video_bonus=0))
+    entitlements.refresh_users(db, [USER_PREFIX + status for status in users])
+    db.commit()
+    return {status: USER_PREFIX + status for status in users}
+
+
+def delete_users(db) -> None:
+    db.query(User).filter(User.id.like(USER_PREFIX + '%')).delete(synchronize_session=False)
+    db.commit()
+
+
+def snapshot_miss(db, user_id: str) -> tuple:
+    entitlements.invalidate(None, [user_id])
+    return usage_limiter.check_can_generate_message(db, user_id)
+
+
+def measure(fn, db, user_id: str, runs: int) -> tuple:
+    """(statements per call, median ms, result)"""
+    fn(db, user_id)  # warm-up (settings snapshot, connection)
+    statements, result = count_statements(fn, db, user_id)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(db, user_id)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statements, statistics.median(timings), result
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    db = SessionLocal()
+    try:
+        delete_users(db)
+        users = create_users(db)
+        settings_service.invalidate()
+        print(f"{'user':<9} {'path':<28} {'statements':>10} {'median':>10}")
+        for status, user_id in users.items():
+            paths = (
+                ("before (query per figure)", legacy_check_can_generate_message),
+                ("after, cache miss", snapshot_miss),
+                ("after, cache hit", usage_limiter.check_can_generate_message),
+            )
+            results = []
+            for label, fn in paths:
+                statements, median, result = measure(fn, db, user_id, runs)
+                results.append(result)
+                print(f"{status:<9} {label:<28} {statements:>10} {median:>8.2f} ms")
+            assert len({(allowed, info['status']) for allowed, info in results}) == 1, results
+    finally:
+        delete_users(db)
+        db.close()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Shared pytest fixtures
+
+Tests that need PostgreSQL run against TEST_DATABASE_URL, a throwaway
+database: its public schema is dropped and rebuilt with init_db() once per
+session, and every table is truncated before each test. Without
+TEST_DATABASE_URL those tests are skipped.
+"""
+
+import io
+import os
+import time
+import contextlib
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    # Must be set before database.py builds the engine
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+os.environ.setdefault("XAI_API_KEY", "test-key")
+
+
+@pytest.fixture(scope="session")
+def pg_engine():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    with contextlib.redirect_stdout(io.StringIO()):
+        import database
+        with database.engine.begin() as conn:
+            conn.exec_driver_sql("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+        database.init_db()
+    return database.engine
+
+
+@pytest.fixture
+def pg_db(pg_engine):
+    """A session on an emptied test database"""
+    from database import Base, SessionLocal
+
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+    with pg_engine.begin() as conn:
+        conn.exec_driver_sql(f"TRUNCATE {tables} CASCADE")
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.rollback()
+        db.close()
+
+
+@pytest.fixture
+def notify_listener(pg_engine):
+    """This process's LISTEN thread, running for the test"""
+    import database
+
+    database.start_notify_listener()
+    # LISTEN is issued right after connecting
+    deadline = time.monotonic() + 5
+    while not database.notify_listener_alive() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.5)
+    yield
+    database.stop_notify_listener()
+    database._notify_thread.join(timeout=10)
@@ -9,6 +9,7 @@ from sqlalchemy.orm import Session
 from sqlalchemy import func
 
 from models import Coupon, CouponUsage, User, Subscription
+import entitlements
 
 
 def utc_now():
@@ -180,6 +181,8 @@ def apply_coupon(
     db.add(usage)
     
     try:
+        # Trial extensions and free periods move the trial/premium end dates
+        entitlements.refresh_user(db, user_id)
         db.commit()
         print(f"✅ [COUPON] Applied coupon '{code}' for user {user_id}: {result}")
         return result
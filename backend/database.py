@@ -4,6 +4,9 @@ Database connection and session management for PostgreSQL
 """
 
 import os
+import select
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -50,6 +53,16 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 # Base class for models
 Base = declarative_base()
 
+# Reminders whose legacy weekdays/specific_time text did not convert in migration 21.
+# The drop of the text columns must wait until this returns no rows.
+UNCONVERTED_REMINDER_SCHEDULES_SQL = """
+    SELECT id, weekdays, specific_time
+    FROM reminders
+    WHERE (weekday_mask IS NULL AND NULLIF(btrim(weekdays), '') IS NOT NULL)
+       OR (time_minutes IS NULL AND NULLIF(btrim(specific_time), '') IS NOT NULL)
+    ORDER BY id;
+"""
+
 def get_db():
     """
     Dependency function to get database session
@@ -61,6 +74,94 @@ def get_db():
     finally:
         db.close()
 
+# Cross-worker notifications: one LISTEN connection per worker, shared by every channel.
+# channel -> (on_notify(payloads), on_reset()); on_reset runs whenever notifications may
+# have been missed (listener (re)connected or failed), so the module can drop what it cached.
+_notify_handlers: Dict[str, Tuple[Callable[[List[str]], None], Optional[Callable[[], None]]]] = {}
+_notify_thread: Optional[threading.Thread] = None
+_notify_stop = threading.Event()
+
+def register_notify_handler(
+    channel: str,
+    on_notify: Callable[[List[str]], None],
+    on_reset: Optional[Callable[[], None]] = None
+) -> None:
+    """
+    Deliver NOTIFYs on a channel to on_notify (called on the listener thread
+    with the payloads received together). Register at import time; a channel
+    added while the listener runs is picked up within a few seconds.
+    """
+    _notify_handlers[channel] = (on_notify, on_reset)
+
+def _run_notify_handler(channel: str, callback, *args) -> None:
+    try:
+        callback(*args)
+    except Exception as e:
+        print(f"⚠️ [DATABASE] Notify handler for {channel} failed: {e}")
+
+def _reset_notify_handlers(channels) -> None:
+    for channel in channels:
+        on_reset = _notify_handlers[channel][1]
+        if on_reset is not None:
+            _run_notify_handler(channel, on_reset)
+
+def _notify_loop() -> None:
+    """LISTEN on every registered channel; reconnects on errors"""
+    while not _notify_stop.is_set():
+        connection = None
+        listening = set()
+        try:
+            connection = engine.raw_connection()
+            dbapi_connection = connection.driver_connection
+            connection.detach()  # Dedicated connection - never returned to the pool
+            dbapi_connection.autocommit = True
+            cursor = dbapi_connection.cursor()
+            while not _notify_stop.is_set():
+                new_channels = set(_notify_handlers) - listening
+                for channel in sorted(new_channels):
+                    cursor.execute(f"LISTEN {channel};")
+                listening |= new_channels
+                # Notifications sent before LISTEN (or while we were disconnected) are lost
+                _reset_notify_handlers(new_channels)
+                if select.select([dbapi_connection], [], [], 5) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                payloads: Dict[str, List[str]] = {}
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    payloads.setdefault(notify.channel, []).append(notify.payload)
+                for channel, channel_payloads in payloads.items():
+                    if channel in _notify_handlers:
+                        _run_notify_handler(channel, _notify_handlers[channel][0], channel_payloads)
+        except Exception as e:
+            print(f"⚠️ [DATABASE] Notify listener error: {e}, reconnecting")
+            _reset_notify_handlers(listening)
+            _notify_stop.wait(5)
+        finally:
+            if connection is not None:
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+def start_notify_listener() -> None:
+    """Start this worker's LISTEN thread (PostgreSQL only)"""
+    global _notify_thread
+    if engine.dialect.name != 'postgresql':
+        return
+    if _notify_thread is not None and _notify_thread.is_alive():
+        return
+    _notify_stop.clear()
+    _notify_thread = threading.Thread(target=_notify_loop, daemon=True)
+    _notify_thread.start()
+
+def stop_notify_listener() -> None:
+    """Stop the LISTEN thread"""
+    _notify_stop.set()
+
+def notify_listener_alive() -> bool:
+    return bool(_notify_thread and _notify_thread.is_alive())
+
 def init_db():
     """
     Initialize database - create all tables and run migrations
@@ -568,6 +669,328 @@ def _run_migrations():
             db.commit()
             print("✅ [DATABASE] Migration completed: rewarded_video_bonus column added")
 
+        # Migration 17: Add message cache settings
+        check_message_cache_setting = text("""
+            SELECT key
+            FROM app_settings
+            WHERE key='message_cache_enabled';
+        """)
+
+        result_message_cache = db.execute(check_message_cache_setting).fetchone()
+
+        if not result_message_cache:
+            print("🔵 [DATABASE] Running migration: Adding message cache settings...")
+            insert_message_cache = text("""
+                INSERT INTO app_settings (key, value, description) VALUES
+                ('message_cache_enabled', 'false', 'האם להגיש הודעות שנוצרו מה-cache (חוסך קריאות API)'),
+                ('message_cache_shared', 'false', 'האם לשתף את ה-cache בין שרתים דרך טבלת message_templates'),
+                ('message_cache_pool_size', '5', 'מספר הודעות מועמדות לכל שילוב סוג/טון/שפה'),
+                ('message_cache_ttl_hours', '24', 'תוקף הודעה ב-cache (שעות)'),
+                ('message_cache_no_repeat', '5', 'לא לחזור על אחת מ-N ההודעות האחרונות של המשתמש')
+                ON CONFLICT (key) DO NOTHING;
+            """)
+            db.execute(insert_message_cache)
+            db.commit()
+            print("✅ [DATABASE] Migration completed: message cache settings added")
+
+        # Migration 18: Add message pool settings
+        check_message_pool_setting = text("""
+            SELECT key
+            FROM app_settings
+            WHERE key='message_pool_enabled';
+        """)
+
+        result_message_pool = db.execute(check_message_pool_setting).fetchone()
+
+        if not result_message_pool:
+            print("🔵 [DATABASE] Running migration: Adding message pool settings...")
+            insert_message_pool = text("""
+                INSERT INTO app_settings (key, value, description) VALUES
+                ('message_pool_enabled', 'false', 'האם להכין מראש הודעות לשילובים הפופולריים'),
+                ('message_pool_size', '5', 'מספר הודעות מוכנות מראש לכל שילוב'),
+                ('message_pool_combos', '20', 'מספר השילובים הפופולריים שעבורם מכינים הודעות')
+                ON CONFLICT (key) DO NOTHING;
+            """)
+            db.execute(insert_message_pool)
+            db.commit()
+            print("✅ [DATABASE] Migration completed: message pool settings added")
+
+        # Migration 19: Unique (user_id, date) on usage_stats (required for atomic upserts)
+        check_usage_unique = text("""
+            SELECT indexname
+            FROM pg_indexes
+            WHERE tablename='usage_stats' AND indexname='uq_usage_stats_user_date';
+        """)
+
+        result_usage_unique = db.execute(check_usage_unique).fetchone()
+
+        if not result_usage_unique:
+            print("🔵 [DATABASE] Running migration: Merging duplicate usage_stats rows and adding unique (user_id, date)...")
+            merge_usage_duplicates = text("""
+                UPDATE usage_stats u
+                SET messages_generated = d.messages_generated,
+                    rewarded_video_bonus = d.rewarded_video_bonus
+                FROM (
+                    SELECT MIN(id) AS keep_id,
+                           SUM(messages_generated) AS messages_generated,
+                           SUM(rewarded_video_bonus) AS rewarded_video_bonus
+                    FROM usage_stats
+                    GROUP BY user_id, date
+                    HAVING COUNT(*) > 1
+                ) d
+                WHERE u.id = d.keep_id;
+            """)
+            delete_usage_duplicates = text("""
+                DELETE FROM usage_stats u
+                USING usage_stats k
+                WHERE u.user_id = k.user_id AND u.date = k.date AND u.id > k.id;
+            """)
+            add_usage_unique = text("""
+                ALTER TABLE usage_stats
+                ADD CONSTRAINT uq_usage_stats_user_date UNIQUE (user_id, date);
+            """)
+            db.execute(merge_usage_duplicates)
+            db.execute(delete_usage_duplicates)
+            db.execute(add_usage_unique)
+            db.commit()
+            print("✅ [DATABASE] Migration completed: usage_stats unique (user_id, date) added")
+
+        # Migration 20: Due-index on reminders for the scheduler
+        check_reminders_due_index = text("""
+            SELECT indexname
+            FROM pg_indexes
+            WHERE tablename='reminders' AND indexname='ix_reminders_enabled_next_trigger';
+        """)
+
+        result_reminders_due_index = db.execute(check_reminders_due_index).fetchone()
+
+        if not result_reminders_due_index:
+            print("🔵 [DATABASE] Running migration: Creating reminders (enabled, next_trigger) index...")
+            create_reminders_due_index = text("""
+                CREATE INDEX IF NOT EXISTS ix_reminders_enabled_next_trigger
+                ON reminders (enabled, next_trigger);
+            """)
+            db.execute(create_reminders_due_index)
+            db.commit()
+            print("✅ [DATABASE] Migration completed: reminders due-index created")
+
+        # Migration 21: Typed reminder schedule (weekday bitmask + minutes of day instead of JSON/"HH:MM" text)
+        check_weekday_mask = text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name='reminders' AND column_name='weekday_mask';
+        """)
+
+        result_weekday_mask = db.execute(check_weekday_mask).fetchone()
+
+        if not result_weekday_mask:
+            print("🔵 [DATABASE] Running migration: Converting reminder weekdays/specific_time to SMALLINT...")
+            add_schedule_columns = text("""
+                ALTER TABLE reminders
+                ADD COLUMN weekday_mask SMALLINT,
+                ADD COLUMN time_minutes SMALLINT;
+            """)
+            # "[0,2,4]" -> 0b10101 (bit 0 = Sunday); malformed values stay NULL and are reported below
+            convert_weekdays = text(r"""
+                UPDATE reminders
+                SET weekday_mask = (
+                    SELECT COALESCE(SUM(DISTINCT 1 << day::int), 0)::smallint
+                    FROM json_array_elements_text(weekdays::json) AS day
+                    WHERE day::int BETWEEN 0 AND 6
+                )
+                WHERE weekdays ~ '^\s*\[\s*([0-9]+\s*(,\s*[0-9]+\s*)*)?\]\s*$';
+            """)
+            # "14:30" -> 870
+            convert_times = text(r"""
+                UPDATE reminders
+                SET time_minutes = (split_part(specific_time, ':', 1)::int * 60
+                                    + split_part(specific_time, ':', 2)::int)::smallint
+                WHERE specific_time ~ '^\s*([01]?[0-9]|2[0-3]):[0-5][0-9]\s*$';
+            """)
+            # The text columns stay for one release (rollback reads them, the app keeps writing them);
+            # they are dropped in a later migration once no row is left unconverted
+            db.execute(add_schedule_columns)
+            db.execute(convert_weekdays)
+            db.execute(convert_times)
+
+            unconverted = db.execute(text(UNCONVERTED_REMINDER_SCHEDULES_SQL)).fetchall()
+            if unconverted:
+                print(f"⚠️ [DATABASE] {len(unconverted)} reminders have a weekdays/specific_time value that could not be converted; "
+                      f"the original text is kept for a manual fix: {[row.id for row in unconverted[:50]]}")
+
+            # Canonical IANA ids - one UPDATE per distinct stored value; unknown names are left as they are
+            from trigger_engine import normalize_timezone
+            stored_timezones = db.execute(text(
+                "SELECT timezone, COUNT(*) AS reminders FROM reminders WHERE timezone IS NOT NULL GROUP BY timezone;"
+            )).fetchall()
+            for stored, reminders in stored_timezones:
+                normalized = normalize_timezone(stored)
+                if normalized is None:
+                    print(f"⚠️ [DATABASE] Unknown reminder timezone {stored!r} on {reminders} reminders, left for a manual fix")
+                elif normalized != stored:
+                    db.execute(
+                        text("UPDATE reminders SET timezone = :normalized WHERE timezone = :stored;"),
+                        {"normalized": normalized, "stored": stored}
+                    )
+            db.commit()
+            print("✅ [DATABASE] Migration completed: reminder schedules converted")
+
+        # Migration 22: Composite indexes for keyset pagination of list endpoints
+        check_pagination_indexes = text("""
+            SELECT indexname
+            FROM pg_indexes
+            WHERE indexname IN ('ix_contacts_user_created_id', 'ix_reminders_user_created_id', 'ix_support_tickets_created_id');
+        """)
+
+        result_pagination_indexes = db.execute(check_pagination_indexes).fetchall()
+
+        if len(result_pagination_indexes) < 3:
+            print("🔵 [DATABASE] Running migration: Creating pagination indexes...")
+            create_pagination_indexes = text("""
+                CREATE INDEX IF NOT EXISTS ix_contacts_user_created_id ON contacts (user_id, created_at, id);
+                CREATE INDEX IF NOT EXISTS ix_reminders_user_created_id ON reminders (user_id, created_at, id);
+                CREATE INDEX IF NOT EXISTS ix_support_tickets_created_id ON support_tickets (created_at, id);
+            """)
+            db.execute(create_pagination_indexes)
+            db.commit()
+            print("✅ [DATABASE] Migration completed: pagination indexes created")
+
+        # Migration 23: Per-user change versions for delta sync
+        check_sync_version = text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name='contacts' AND column_name='sync_version';
+        """)
+
+        result_sync_version = db.execute(check_sync_version).fetchone()
+
+        if not result_sync_version:
+            print("🔵 [DATABASE] Running migration: Adding sync_version columns...")
+            add_sync_versions = text("""
+                ALTER TABLE users ADD COLUMN IF NOT EXISTS sync_version BIGINT NOT NULL DEFAULT 0;
+                ALTER TABLE contacts ADD COLUMN IF NOT EXISTS sync_version BIGINT NOT NULL DEFAULT 0;
+                ALTER TABLE reminders ADD COLUMN IF NOT EXISTS sync_version BIGINT NOT NULL DEFAULT 0;
+                CREATE INDEX IF NOT EXISTS ix_contacts_user_sync_version ON contacts (user_id, sync_version);
+                CREATE INDEX IF NOT EXISTS ix_reminders_user_sync_version ON reminders (user_id, sync_version);
+            """)
+            db.execute(add_sync_versions)
+            db.commit()
+            print("✅ [DATABASE] Migration completed: sync_version columns added")
+
+        # Migration 24: Day-range indexes for the daily metrics rollup (the table itself comes from create_all)
+        check_rollup_indexes = text("""
+            SELECT indexname
+            FROM pg_indexes
+            WHERE indexname IN ('ix_users_created_at', 'ix_users_trial_started_at', 'ix_subscriptions_started_at',
+                                'ix_subscriptions_cancelled_at', 'ix_subscriptions_expires_at');
+        """)
+
+        result_rollup_indexes = db.execute(check_rollup_indexes).fetchall()
+
+        if len(result_rollup_indexes) < 5:
+            print("🔵 [DATABASE] Running migration: Creating metrics rollup indexes...")
+            create_rollup_indexes = text("""
+                CREATE INDEX IF NOT EXISTS ix_users_created_at ON users (created_at);
+                CREATE INDEX IF NOT EXISTS ix_users_trial_started_at ON users (trial_started_at);
+                CREATE INDEX IF NOT EXISTS ix_subscriptions_started_at ON subscriptions (started_at);
+                CREATE INDEX IF NOT EXISTS ix_subscriptions_cancelled_at ON subscriptions (cancelled_at);
+                CREATE INDEX IF NOT EXISTS ix_subscriptions_expires_at ON subscriptions (expires_at);
+            """)
+            db.execute(create_rollup_indexes)
+            db.commit()
+            print("✅ [DATABASE] Migration completed: metrics rollup indexes created")
+
+        # Migration 25: Indexes for the single-pass user/subscription breakdown (see stats_queries)
+        check_stats_indexes = text("""
+            SELECT indexname
+            FROM pg_indexes
+            WHERE indexname IN ('ix_users_subscription_status', 'ix_subscriptions_active_plan');
+        """)
+
+        result_stats_indexes = db.execute(check_stats_indexes).fetchall()
+
+        if len(result_stats_indexes) < 2:
+            print("🔵 [DATABASE] Running migration: Creating stats indexes...")
+            create_stats_indexes = text("""
+                CREATE INDEX IF NOT EXISTS ix_users_subscription_status ON users (subscription_status);
+                CREATE INDEX IF NOT EXISTS ix_subscriptions_active_plan ON subscriptions (plan_type) WHERE status = 'active';
+            """)
+            db.execute(create_stats_indexes)
+            db.commit()
+            print("✅ [DATABASE] Migration completed: stats indexes created")
+
+        # Migration 26: Active subscriptions by expiry for the expiry sweeper
+        check_active_expires_index = text("""
+            SELECT indexname
+            FROM pg_indexes
+            WHERE indexname = 'ix_subscriptions_active_expires_at';
+        """)
+
+        result_active_expires_index = db.execute(check_active_expires_index).fetchone()
+
+        if not result_active_expires_index:
+            print("🔵 [DATABASE] Running migration: Creating active subscription expiry index...")
+            create_active_expires_index = text("""
+                CREATE INDEX IF NOT EXISTS ix_subscriptions_active_expires_at ON subscriptions (expires_at) WHERE status = 'active';
+            """)
+            db.execute(create_active_expires_index)
+            db.commit()
+            print("✅ [DATABASE] Migration completed: active subscription expiry index created")
+
+        # Migration 27: Precomputed trial_ends_at / premium_until on users (see entitlements)
+        check_entitlement_dates = text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name='users' AND column_name='trial_ends_at';
+        """)
+
+        result_entitlement_dates = db.execute(check_entitlement_dates).fetchone()
+
+        if not result_entitlement_dates:
+            print("🔵 [DATABASE] Running migration: Adding trial_ends_at / premium_until columns...")
+            add_entitlement_dates = text("""
+                ALTER TABLE users ADD COLUMN IF NOT EXISTS trial_ends_at TIMESTAMP WITH TIME ZONE;
+                ALTER TABLE users ADD COLUMN IF NOT EXISTS premium_until TIMESTAMP WITH TIME ZONE;
+                UPDATE users SET
+                    trial_ends_at = users.trial_started_at + make_interval(days => COALESCE(
+                        (SELECT value::int FROM app_settings WHERE key = 'trial_days' AND value ~ '^[0-9]+$'), 14
+                    ) + COALESCE((
+                        SELECT SUM(c.value)::int
+                        FROM coupon_usages cu JOIN coupons c ON c.id = cu.coupon_id
+                        WHERE cu.user_id = users.id AND c.coupon_type = 'trial_extension'
+                    ), 0)),
+                    premium_until = (
+                        SELECT MAX(s.expires_at) FROM subscriptions s
+                        WHERE s.user_id = users.id AND s.status = 'active'
+                    );
+                CREATE INDEX IF NOT EXISTS ix_users_trial_ends_at ON users (trial_ends_at);
+                CREATE INDEX IF NOT EXISTS ix_users_premium_until ON users (premium_until);
+            """)
+            db.execute(add_entitlement_dates)
+            db.commit()
+            print("✅ [DATABASE] Migration completed: trial_ends_at / premium_until columns added")
+
+        # Migration 28: Delivery marker for /api/reminders/check (events materialized by anyone)
+        check_checked_at = text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name='reminder_events' AND column_name='checked_at';
+        """)
+
+        result_checked_at = db.execute(check_checked_at).fetchone()
+
+        if not result_checked_at:
+            print("🔵 [DATABASE] Running migration: Adding reminder_events.checked_at...")
+            add_checked_at = text("""
+                ALTER TABLE reminder_events ADD COLUMN IF NOT EXISTS checked_at TIMESTAMP WITH TIME ZONE;
+                -- Existing events are not re-announced to polling clients
+                UPDATE reminder_events SET checked_at = created_at WHERE checked_at IS NULL;
+                CREATE INDEX IF NOT EXISTS ix_reminder_events_unchecked ON reminder_events (user_id, id) WHERE checked_at IS NULL;
+            """)
+            db.execute(add_checked_at)
+            db.commit()
+            print("✅ [DATABASE] Migration completed: reminder_events.checked_at added")
+
         print("✅ [DATABASE] All migrations completed successfully")
     except Exception as e:
         db.rollback()
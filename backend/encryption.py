@@ -1,24 +1,44 @@
 # -*- coding: utf-8 -*-
 """
 Encryption utilities for sensitive data
-Uses AES encryption for reversible encryption and SHA256 for hashing
+Uses AES encryption for reversible encryption and SHA256 for hashing.
+New values are written in ENCRYPTION_FORMAT: Fernet until every instance
+reads the versioned AES-GCM / ChaCha20-Poly1305 format, then one of those.
+All formats are always readable.
 """
 
 import os
 import hashlib
 import base64
+import threading
+from collections import OrderedDict
+from typing import List, Optional
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
 
 # Get encryption key from environment
 ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY', 'default-dev-key-change-in-production')
 
-def _get_fernet_key() -> bytes:
-    """
-    Derive a Fernet-compatible key from the ENCRYPTION_KEY.
-    Fernet requires a 32-byte base64-encoded key.
-    """
+# Format for new values: 'fernet' (default, readable by older releases), 'aesgcm' or 'chacha20'.
+# Switch only once no instance runs a release that cannot read the v1:/v2: values.
+ENCRYPTION_FORMAT = os.getenv('ENCRYPTION_FORMAT', 'fernet')
+
+# Versioned values look like "v<version>:<base64url(nonce + ciphertext + tag)>".
+# Legacy Fernet tokens have no prefix (':' is not in the base64url alphabet).
+AEAD_VERSIONS = {1: AESGCM, 2: ChaCha20Poly1305}
+FORMAT_VERSIONS = {'aesgcm': 1, 'chacha20': 2}
+NONCE_SIZE = 12
+
+_master_key: Optional[bytes] = None
+_fernet = None
+_aead_ciphers = {}
+_init_lock = threading.Lock()
+
+
+def _derive_master_key() -> bytes:
     # Use PBKDF2 to derive a consistent key from our secret
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
@@ -26,24 +46,77 @@ def _get_fernet_key() -> bytes:
         salt=b'stay-close-app-salt',  # Fixed salt for consistent key derivation
         iterations=100000,
     )
-    key = base64.urlsafe_b64encode(kdf.derive(ENCRYPTION_KEY.encode()))
-    return key
+    return kdf.derive(ENCRYPTION_KEY.encode())
+
+
+def _derive_aead_key(master_key: bytes, version: int) -> bytes:
+    """Separate key per format version, so no key material is shared with Fernet"""
+    return HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=f'stay-close-aead-v{version}'.encode(),
+    ).derive(master_key)
+
+
+def init_encryption() -> None:
+    """
+    Derive all keys up front (PBKDF2 takes a noticeable moment).
+    Call during startup so the first request on a fresh worker does not pay for it.
+    """
+    global _master_key, _fernet
+    with _init_lock:
+        if _master_key is not None:
+            return
+        master_key = _derive_master_key()
+        # Fernet requires a 32-byte base64-encoded key
+        _fernet = Fernet(base64.urlsafe_b64encode(master_key))
+        for version, cipher in AEAD_VERSIONS.items():
+            _aead_ciphers[version] = cipher(_derive_aead_key(master_key, version))
+        _master_key = master_key
 
-# Initialize Fernet cipher
-_fernet = None
 
 def _get_fernet():
-    """Get or create Fernet instance (lazy initialization)"""
-    global _fernet
+    """Get the Fernet instance (derives the keys if startup did not)"""
     if _fernet is None:
-        _fernet = Fernet(_get_fernet_key())
+        init_encryption()
     return _fernet
 
 
+def _get_aead(version: int):
+    if _master_key is None:
+        init_encryption()
+    return _aead_ciphers[version]
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _ciphertext_version(ciphertext: str) -> Optional[int]:
+    """AEAD format version of a value, or None for a legacy Fernet token"""
+    prefix, sep, _ = ciphertext.partition(':')
+    if sep and prefix.startswith('v') and prefix[1:].isdigit():
+        return int(prefix[1:])
+    return None
+
+
+def _encrypt_bytes(data: bytes, encryption_format: str) -> str:
+    version = FORMAT_VERSIONS.get(encryption_format)
+    if version is None:
+        return _get_fernet().encrypt(data).decode('utf-8')
+    nonce = os.urandom(NONCE_SIZE)
+    return f"v{version}:" + _b64encode(nonce + _get_aead(version).encrypt(nonce, data, None))
+
+
 def encrypt(plaintext: str) -> str:
     """
-    Encrypt a string using AES (Fernet).
-    Returns base64-encoded encrypted string.
+    Encrypt a string with the configured format (AES-GCM by default).
+    Returns a versioned, base64-encoded string.
     
     Args:
         plaintext: The string to encrypt
@@ -54,14 +127,113 @@ def encrypt(plaintext: str) -> str:
     if not plaintext:
         return ""
     
-    fernet = _get_fernet()
-    encrypted = fernet.encrypt(plaintext.encode('utf-8'))
-    return encrypted.decode('utf-8')
+    return _encrypt_bytes(plaintext.encode('utf-8'), ENCRYPTION_FORMAT)
+
+
+def needs_reencryption(ciphertext: str) -> bool:
+    """True if a stored value is not in the format new values are written in"""
+    if not ciphertext:
+        return False
+    return _ciphertext_version(ciphertext) != FORMAT_VERSIONS.get(ENCRYPTION_FORMAT)
+
+
+def reencrypt(ciphertext: str) -> Optional[str]:
+    """
+    Re-encrypt a stored value in the current format.
+    Returns None if it is already current or cannot be decrypted.
+    """
+    if not needs_reencryption(ciphertext):
+        return None
+    decrypted = _decrypt_uncached(ciphertext)
+    if decrypted is None:
+        return None
+    return _encrypt_bytes(decrypted, ENCRYPTION_FORMAT)
+
+
+class _PlaintextCache:
+    """
+    Process-local LRU of ciphertext -> plaintext, capped by memory.
+    Plaintexts are kept in bytearrays that are zeroed when evicted.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[str, bytearray]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _drop(self, ciphertext: str) -> None:
+        plaintext = self._data.pop(ciphertext)
+        self.size_bytes -= len(ciphertext) + len(plaintext)
+        plaintext[:] = bytes(len(plaintext))
+
+    def get(self, ciphertext: str) -> Optional[str]:
+        with self._lock:
+            plaintext = self._data.get(ciphertext)
+            if plaintext is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(ciphertext)
+            self.hits += 1
+            return plaintext.decode('utf-8')
+
+    def set(self, ciphertext: str, plaintext: bytes) -> None:
+        entry_bytes = len(ciphertext) + len(plaintext)
+        if entry_bytes > self.max_bytes:
+            return
+        with self._lock:
+            if ciphertext in self._data:
+                self._drop(ciphertext)
+            self._data[ciphertext] = bytearray(plaintext)
+            self.size_bytes += entry_bytes
+            while self.size_bytes > self.max_bytes:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for ciphertext in list(self._data):
+                self._drop(ciphertext)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'size_bytes': self.size_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+# Decrypted values of hot rows (contact names, emails), 0 disables the cache
+DECRYPT_CACHE_MAX_BYTES = int(os.getenv('DECRYPT_CACHE_MAX_BYTES', str(4 * 1024 * 1024)))
+_plaintext_cache = _PlaintextCache(DECRYPT_CACHE_MAX_BYTES)
+
+DECRYPTION_ERROR_TEXT = "[שגיאת פענוח]"
+
+
+def _decrypt_uncached(ciphertext: str) -> Optional[bytes]:
+    try:
+        version = _ciphertext_version(ciphertext)
+        if version is None:
+            return _get_fernet().decrypt(ciphertext.encode('utf-8'))
+        raw = _b64decode(ciphertext.partition(':')[2])
+        return _get_aead(version).decrypt(raw[:NONCE_SIZE], raw[NONCE_SIZE:], None)
+    except Exception as e:
+        print(f"❌ [ENCRYPTION] Decryption error: {e}")
+        return None
 
 
 def decrypt(ciphertext: str) -> str:
     """
-    Decrypt a string that was encrypted with encrypt().
+    Decrypt a string that was encrypted with encrypt() (any format version).
+    Results are kept in a bounded in-memory cache keyed by ciphertext.
     
     Args:
         ciphertext: The encrypted string (base64 encoded)
@@ -69,16 +241,41 @@ def decrypt(ciphertext: str) -> str:
     Returns:
         Decrypted plaintext string
     """
-    if not ciphertext:
-        return ""
+    return decrypt_many([ciphertext])[0]
+
+
+def decrypt_many(ciphertexts: List[str]) -> List[str]:
+    """
+    Decrypt a list of strings encrypted with encrypt(), in order.
+    Cached values are served without touching the cipher; the rest are
+    decrypted and added to the cache.
     
-    try:
-        fernet = _get_fernet()
-        decrypted = fernet.decrypt(ciphertext.encode('utf-8'))
-        return decrypted.decode('utf-8')
-    except Exception as e:
-        print(f"❌ [ENCRYPTION] Decryption error: {e}")
-        return "[שגיאת פענוח]"
+    Args:
+        ciphertexts: Encrypted strings (base64 encoded)
+        
+    Returns:
+        Decrypted plaintext strings (the error text for values that fail)
+    """
+    results = []
+    for ciphertext in ciphertexts:
+        if not ciphertext:
+            results.append("")
+            continue
+        plaintext = _plaintext_cache.get(ciphertext)
+        if plaintext is None:
+            decrypted = _decrypt_uncached(ciphertext)
+            if decrypted is None:
+                plaintext = DECRYPTION_ERROR_TEXT
+            else:
+                _plaintext_cache.set(ciphertext, decrypted)
+                plaintext = decrypted.decode('utf-8')
+        results.append(plaintext)
+    return results
+
+
+def get_decrypt_cache_metrics() -> dict:
+    """Return plaintext cache counters"""
+    return _plaintext_cache.stats()
 
 
 def hash_for_lookup(value: str) -> str:
@@ -120,6 +317,12 @@ def encrypt_for_storage(value: str) -> tuple[str, str]:
 
 # Test the encryption
 if __name__ == "__main__":
+    import time
+
+    start = time.perf_counter()
+    init_encryption()
+    print(f"Key derivation (once per worker, at startup): {(time.perf_counter() - start) * 1000:.1f} ms")
+
     test_email = "test@example.com"
     
     print(f"Original: {test_email}")
@@ -135,3 +338,50 @@ if __name__ == "__main__":
     hash_val2 = hash_for_lookup(test_email)
     print(f"Hash consistent: {hash_val == hash_val2}")
 
+    # Legacy values stay readable and are migrated by reencrypt()
+    legacy_val = _encrypt_bytes(test_email.encode('utf-8'), 'fernet')
+    migrated = reencrypt(legacy_val)
+    print(f"Legacy Fernet readable: {decrypt(legacy_val) == test_email}, "
+          f"re-encrypted: {migrated is not None and decrypt(migrated) == test_email}")
+
+    # Per-field cost by format (uncached)
+    rounds = 5000
+    field = "איש קשר לדוגמה".encode('utf-8')
+    print(f"\nPer-field cost ({rounds} rounds, {len(field)}-byte field):")
+    for encryption_format in ('fernet', 'aesgcm', 'chacha20'):
+        start = time.perf_counter()
+        values = [_encrypt_bytes(field, encryption_format) for _ in range(rounds)]
+        encrypt_cost = (time.perf_counter() - start) / rounds
+        start = time.perf_counter()
+        for value in values:
+            _decrypt_uncached(value)
+        decrypt_cost = (time.perf_counter() - start) / rounds
+        print(f"{encryption_format:<10} encrypt {encrypt_cost * 1e6:6.1f} µs  "
+              f"decrypt {decrypt_cost * 1e6:6.1f} µs  stored length {len(values[0])}")
+
+    # Throughput: contact list of 2,000 names
+    names = [f"איש קשר {i}" for i in range(2000)]
+    encrypted_names = [encrypt(name) for name in names]
+
+    start = time.perf_counter()
+    for value in encrypted_names:
+        _decrypt_uncached(value)
+    per_row = time.perf_counter() - start
+
+    _plaintext_cache.clear()
+    start = time.perf_counter()
+    cold = decrypt_many(encrypted_names)
+    batch_cold = time.perf_counter() - start
+
+    start = time.perf_counter()
+    warm = decrypt_many(encrypted_names)
+    batch_warm = time.perf_counter() - start
+
+    print(f"\nBatch result matches: {cold == warm == names}")
+    for label, elapsed in (
+        ("decrypt per row (uncached)", per_row),
+        ("decrypt_many, cold cache", batch_cold),
+        ("decrypt_many, warm cache", batch_warm),
+    ):
+        print(f"{label:<28} {elapsed * 1000:8.2f} ms  ({len(names) / elapsed:,.0f} rows/s)")
+    print(f"Cache: {get_decrypt_cache_metrics()}")
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Entitlements - Precomputed trial and premium end dates on the user row
+
+users.trial_ends_at is trial_started_at plus the trial_days setting plus
+all trial_extension coupons the user applied; users.premium_until is the
+latest expires_at of the user's active subscriptions. Both are recomputed
+in the write paths that can change them (registration, trial start, coupon,
+subscription created/renewed/cancelled/expired), so a status check is two
+timestamp comparisons on the user row. A change of trial_days recomputes
+every user in batches (recompute_all).
+
+The per-user entitlement snapshot (tier, limits, trial/premium end, usage
+counters - see usage_limiter.get_usage_snapshot) is cached in process as an
+immutable mapping. Entries are dropped by explicit events - purchase,
+cancellation, coupon, expiry (all via refresh_users) and usage increments -
+in this worker right away and in the others through PostgreSQL NOTIFY, which
+is sent when the writing transaction commits. Independently of events, an
+entry never outlives ENTITLEMENT_CACHE_TTL_SECONDS, the trial/premium end it
+was computed against, local midnight (daily counters), or a change of the
+app settings.
+"""
+
+import os
+import time
+from datetime import datetime, date, timedelta, timezone
+from types import MappingProxyType
+from typing import Optional, Iterable, Dict, Any, Mapping
+from sqlalchemy import func, select, cast, Integer, text
+from sqlalchemy.orm import Session
+
+import settings_service
+from database import SessionLocal, register_notify_handler, notify_listener_alive
+from models import User, Subscription, Coupon, CouponUsage
+from ttl_cache import TTLCache
+
+
+ENTITLEMENT_CACHE_TTL_SECONDS = float(os.getenv("ENTITLEMENT_CACHE_TTL_SECONDS", "60"))
+ENTITLEMENT_CACHE_SIZE = int(os.getenv("ENTITLEMENT_CACHE_SIZE", "10000"))
+ENTITLEMENTS_CHANNEL = "entitlements_changed"
+# More users than this in one invalidation are sent as a single "drop everything"
+NOTIFY_MAX_USERS = 100
+# Rows updated per transaction by recompute_all
+RECOMPUTE_BATCH_SIZE = 5000
+
+# user_id -> (settings fingerprint, monotonic time computed, snapshot)
+_cache = TTLCache(maxsize=ENTITLEMENT_CACHE_SIZE, ttl=ENTITLEMENT_CACHE_TTL_SECONDS)
+
+_metrics = {
+    'users_refreshed': 0,
+    'full_recomputes': 0,
+    'last_recompute_users': 0,
+    'last_recompute_seconds': 0.0,
+    'cache_hits': 0,
+    'cache_misses': 0,
+    'settings_misses': 0,
+    'invalidations': 0,
+    'notifications': 0,
+    'max_hit_age_seconds': 0.0,
+    '_hit_age_total': 0.0,
+}
+
+
+def effective_status(
+    trial_ends_at: Optional[datetime],
+    premium_until: Optional[datetime],
+    now: Optional[datetime] = None
+) -> str:
+    """'premium', 'trial' or 'free' from the two precomputed dates"""
+    now = now or datetime.now(timezone.utc)
+    if premium_until and premium_until > now:
+        return 'premium'
+    if trial_ends_at and trial_ends_at > now:
+        return 'trial'
+    return 'free'
+
+
+def _date_columns(db: Session) -> Dict[Any, Any]:
+    """SQL expressions for both columns, correlated to the updated users row"""
+    trial_extension_days = select(func.coalesce(func.sum(Coupon.value), 0)).select_from(
+        Coupon
+    ).join(CouponUsage).where(
+        CouponUsage.user_id == User.id,
+        Coupon.coupon_type == 'trial_extension'
+    ).scalar_subquery()
+    premium_until = select(func.max(Subscription.expires_at)).where(
+        Subscription.user_id == User.id,
+        Subscription.status == 'active'
+    ).scalar_subquery()
+    trial_days = settings_service.get_int(db, 'trial_days', 14)
+    return {
+        # NULL while no trial has started
+        User.trial_ends_at: User.trial_started_at + func.make_interval(0, 0, 0, cast(trial_days + trial_extension_days, Integer)),
+        User.premium_until: premium_until,
+    }
+
+
+def refresh_users(db: Session, user_ids: Iterable[str]) -> int:
+    """Recompute both dates for these users (inside the caller's transaction). Call before commit."""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return 0
+    db.flush()
+    updated = db.query(User).filter(User.id.in_(user_ids)).update(
+        _date_columns(db),
+        synchronize_session='fetch'
+    )
+    invalidate(db, user_ids)
+    _metrics['users_refreshed'] += updated
+    return updated
+
+
+def refresh_user(db: Session, user_id: str) -> int:
+    return refresh_users(db, [user_id])
+
+
+def recompute_all(db: Session, batch_size: int = RECOMPUTE_BATCH_SIZE) -> int:
+    """Recompute every user in id order, one transaction per batch (after trial_days changes)"""
+    started = datetime.now(timezone.utc)
+    columns = _date_columns(db)
+    last_id = None
+    total = 0
+    while True:
+        query = db.query(User.id).order_by(User.id)
+        if last_id is not None:
+            query = query.filter(User.id > last_id)
+        batch = [row.id for row in query.limit(batch_size).all()]
+        if not batch:
+            break
+        total += db.query(User).filter(User.id.in_(batch)).update(columns, synchronize_session=False)
+        invalidate(db, batch)
+        db.commit()
+        last_id = batch[-1]
+
+    _metrics['full_recomputes'] += 1
+    _metrics['last_recompute_users'] = total
+    _metrics['last_recompute_seconds'] = round((datetime.now(timezone.utc) - started).total_seconds(), 3)
+    print(f"✅ [ENTITLEMENTS] Recomputed trial/premium dates for {total} users")
+    return total
+
+
+def run_recompute() -> None:
+    """recompute_all in its own session (background task after a trial_days change)"""
+    db = SessionLocal()
+    try:
+        recompute_all(db)
+    except Exception as e:
+        db.rollback()
+        print(f"❌ [ENTITLEMENTS] Recompute failed: {e}")
+    finally:
+        db.close()
+
+
+def _entry_ttl(snapshot: Mapping[str, Any]) -> float:
+    """Seconds until the snapshot can no longer be right without an event"""
+    now = datetime.now(timezone.utc)
+    ttl = ENTITLEMENT_CACHE_TTL_SECONDS
+    for boundary in (snapshot.get('trial_ends_at'), snapshot.get('premium_until')):
+        if boundary and boundary > now:
+            ttl = min(ttl, (boundary - now).total_seconds())
+    # Daily counters (and the month) roll over at local midnight, like date.today()
+    local_now = datetime.now()
+    midnight = datetime.combine(date.today() + timedelta(days=1), datetime.min.time())
+    return min(ttl, (midnight - local_now).total_seconds())
+
+
+def lookup(user_id: str, settings_fingerprint: str) -> Optional[Mapping[str, Any]]:
+    """Cached snapshot of the user, or None if missing, expired or computed under other settings"""
+    entry = _cache.get(user_id)
+    if entry is None:
+        _metrics['cache_misses'] += 1
+        return None
+    fingerprint, computed_at, snapshot = entry
+    if fingerprint != settings_fingerprint:
+        _cache.pop(user_id)
+        _metrics['cache_misses'] += 1
+        _metrics['settings_misses'] += 1
+        return None
+    age = time.monotonic() - computed_at
+    _metrics['cache_hits'] += 1
+    _metrics['_hit_age_total'] += age
+    _metrics['max_hit_age_seconds'] = max(_metrics['max_hit_age_seconds'], round(age, 3))
+    return snapshot
+
+
+def store(user_id: str, settings_fingerprint: str, snapshot: Dict[str, Any]) -> Mapping[str, Any]:
+    """Freeze a freshly loaded snapshot and cache it. Returns the frozen snapshot."""
+    frozen = MappingProxyType(dict(snapshot))
+    ttl = _entry_ttl(frozen)
+    if ttl > 0:
+        _cache.set(user_id, (settings_fingerprint, time.monotonic(), frozen), ttl=ttl)
+    return frozen
+
+
+def _drop_local(payload: str) -> None:
+    if payload == '*':
+        _cache.clear()
+        return
+    for user_id in payload.split(','):
+        _cache.pop(user_id)
+
+
+def invalidate(db: Optional[Session], user_ids: Iterable[str]) -> None:
+    """
+    Drop the users' snapshots in this worker, and (with db) in every worker
+    once the caller's transaction commits. Call before commit.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    payload = '*' if len(user_ids) > NOTIFY_MAX_USERS else ','.join(user_ids)
+    _drop_local(payload)
+    _metrics['invalidations'] += len(user_ids)
+    if db is None or db.get_bind().dialect.name != 'postgresql':
+        return
+    # Delivered on commit (also to this worker's listener, which covers a
+    # reload that raced with the write); discarded on rollback
+    db.execute(text("SELECT pg_notify(:channel, :payload)"),
+               {"channel": ENTITLEMENTS_CHANNEL, "payload": payload})
+
+
+def _on_notify(payloads) -> None:
+    _metrics['notifications'] += len(payloads)
+    for payload in payloads:
+        _drop_local(payload)
+
+
+# Invalidations missed while the listener was down are covered by dropping everything
+register_notify_handler(ENTITLEMENTS_CHANNEL, _on_notify, _cache.clear)
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Return recompute counters, cache hit rate and staleness bounds"""
+    lookups = _metrics['cache_hits'] + _metrics['cache_misses']
+    metrics = {key: value for key, value in _metrics.items() if not key.startswith('_')}
+    return {
+        **metrics,
+        'cache_size': len(_cache),
+        'cache_evictions': _cache.evictions,
+        'hit_rate': round(_metrics['cache_hits'] / lookups, 3) if lookups else None,
+        'avg_hit_age_seconds': round(_metrics['_hit_age_total'] / _metrics['cache_hits'], 3) if _metrics['cache_hits'] else None,
+        # Upper bound on serving a snapshot after a change that sent no event
+        # (or whose NOTIFY was missed while the listener was down)
+        'ttl_seconds': ENTITLEMENT_CACHE_TTL_SECONDS,
+        'listener_alive': notify_listener_alive(),
+    }
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+ETag - Conditional GET for polled read endpoints
+
+Each endpoint computes a cheap validator for the resource first (a per-user
+version or a one-query snapshot), hashes it into a weak ETag, and answers
+304 Not Modified when the client's If-None-Match matches - before loading,
+decrypting or serializing anything.
+"""
+
+import json
+import hashlib
+from typing import Dict, Any
+from fastapi import Request
+from fastapi.responses import Response
+
+
+# Clients may keep the response but must revalidate it every time
+CACHE_CONTROL = "private, no-cache"
+
+# resource -> counters
+_metrics: Dict[str, Dict[str, int]] = {}
+
+
+def make_etag(resource: str, *parts: Any) -> str:
+    """Weak ETag from the resource name and its validator parts"""
+    raw = json.dumps([resource, *parts], sort_keys=True, default=str, separators=(',', ':'))
+    return f'W/"{hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]}"'
+
+
+def is_not_modified(request: Request, resource: str, etag: str) -> bool:
+    """True if the client already has this version (If-None-Match). Counts hits/misses."""
+    counters = _metrics.setdefault(resource, {'not_modified': 0, 'full': 0})
+    header = request.headers.get("if-none-match")
+    if header:
+        candidates = {tag.strip() for tag in header.split(',')}
+        # Weak comparison: W/"x" and "x" match
+        if '*' in candidates or etag in candidates or etag[2:] in candidates:
+            counters['not_modified'] += 1
+            return True
+    counters['full'] += 1
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+
+def set_etag(response: Response, etag: str) -> Response:
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Return 304/full counts and hit rate per resource"""
+    result = {}
+    for resource, counters in _metrics.items():
+        total = counters['not_modified'] + counters['full']
+        result[resource] = {
+            **counters,
+            'hit_rate': round(counters['not_modified'] / total, 3) if total else 0.0,
+        }
+    return result
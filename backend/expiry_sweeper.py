@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Expiry Sweeper - Expires subscriptions and keeps users.subscription_status current
+
+Status reads derive the effective status (premium / trial / free) from the
+user's precomputed premium_until and trial_ends_at without writing anything. The stored
+users.subscription_status, which the admin counts are based on, is brought
+up to date here in a periodic pass of two set-based statements:
+
+  1. active subscriptions past expires_at become 'expired' (found through the
+     partial index on active subscriptions' expires_at), and their users'
+     premium_until is recomputed
+  2. users whose stored status differs from the one implied by premium_until
+     and trial_ends_at (see entitlements) are updated in one UPDATE ... FROM.
+     Only possible changes are considered, each through an index: premium
+     users, trial users whose trial ended, and users with a running premium
+     period or trial.
+"""
+
+import os
+import asyncio
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+import entitlements
+from database import SessionLocal
+
+
+SUBSCRIPTION_SWEEP_INTERVAL_SECONDS = float(os.getenv("SUBSCRIPTION_SWEEP_INTERVAL_SECONDS", "60"))
+
+_worker_task: Optional[asyncio.Task] = None
+
+_metrics = {
+    'passes': 0,
+    'subscriptions_expired': 0,
+    'users_updated': 0,
+    'to_premium': 0,
+    'to_trial': 0,
+    'to_free': 0,
+    'errors': 0,
+    'last_pass_seconds': 0.0,
+}
+
+_EXPIRE_SUBSCRIPTIONS = text("""
+    UPDATE subscriptions
+    SET status = 'expired', updated_at = now()
+    WHERE status = 'active' AND expires_at <= :now
+    RETURNING user_id
+""")
+
+# Same rule as entitlements.effective_status
+_RECONCILE_USER_STATUSES = text("""
+    WITH candidates AS (
+        SELECT id FROM users WHERE subscription_status = 'premium'
+        UNION
+        SELECT id FROM users WHERE subscription_status = 'trial' AND (trial_ends_at IS NULL OR trial_ends_at <= :now)
+        UNION
+        SELECT id FROM users WHERE premium_until > :now
+        UNION
+        SELECT id FROM users WHERE trial_ends_at > :now
+    ),
+    effective AS (
+        SELECT u.id,
+               CASE
+                   WHEN u.premium_until > :now THEN 'premium'
+                   WHEN u.trial_ends_at > :now THEN 'trial'
+                   ELSE 'free'
+               END AS status
+        FROM users u JOIN candidates ON candidates.id = u.id
+    )
+    UPDATE users
+    SET subscription_status = effective.status
+    FROM effective
+    WHERE users.id = effective.id AND users.subscription_status <> effective.status
+    RETURNING effective.status
+""")
+
+
+def sweep(db: Session, now: Optional[datetime] = None) -> Dict[str, int]:
+    """One pass: expire subscriptions, then reconcile stored user statuses (commits)"""
+    now = now or datetime.now(timezone.utc)
+
+    expired_user_ids = db.execute(_EXPIRE_SUBSCRIPTIONS, {"now": now}).scalars().all()
+    entitlements.refresh_users(db, expired_user_ids)
+    statuses = db.execute(_RECONCILE_USER_STATUSES, {"now": now}).scalars().all()
+    db.commit()
+
+    result = {'expired': len(expired_user_ids), 'premium': 0, 'trial': 0, 'free': 0}
+    for status in statuses:
+        result[status] += 1
+    _metrics['subscriptions_expired'] += result['expired']
+    _metrics['users_updated'] += len(statuses)
+    for status in ('premium', 'trial', 'free'):
+        _metrics[f'to_{status}'] += result[status]
+    return result
+
+
+def _run_pass() -> Dict[str, int]:
+    db = SessionLocal()
+    try:
+        return sweep(db)
+    finally:
+        db.close()
+
+
+async def _worker_loop() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        try:
+            result = await asyncio.to_thread(_run_pass)
+            _metrics['passes'] += 1
+            _metrics['last_pass_seconds'] = round(loop.time() - started, 3)
+            if any(result.values()):
+                print(f"✅ [SUBSCRIPTION] Sweep: {result['expired']} subscriptions expired, "
+                      f"users -> premium {result['premium']}, trial {result['trial']}, free {result['free']}")
+        except Exception as e:
+            _metrics['errors'] += 1
+            print(f"⚠️ [SUBSCRIPTION] Sweep failed: {e}")
+        await asyncio.sleep(SUBSCRIPTION_SWEEP_INTERVAL_SECONDS)
+
+
+def start_worker() -> None:
+    """Start the sweeper (call from the startup event)"""
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stop_worker() -> None:
+    """Stop the sweeper (call from the shutdown event)"""
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Return sweeper counters"""
+    return {
+        **_metrics,
+        'running': _worker_task is not None and not _worker_task.done(),
+        'interval_seconds': SUBSCRIPTION_SWEEP_INTERVAL_SECONDS,
+    }
@@ -4,10 +4,16 @@
 """
 
 import os
+import re
 import json
+import time
+import threading
+from typing import Dict, Optional
+import requests
 import firebase_admin
-from firebase_admin import credentials, auth
+from firebase_admin import credentials
 from fastapi import HTTPException
+from jose import JWTError, jwt
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -39,10 +45,93 @@ if not firebase_admin._apps:
         print("⚠️ Firebase Service Account לא מוגדר - Firebase authentication לא יעבוד")
         print("   הגדר FIREBASE_SERVICE_ACCOUNT_KEY_PATH או FIREBASE_SERVICE_ACCOUNT_KEY_JSON")
 
+# Firebase ID tokens are RS256, signed with Google's rotating public certificates
+FIREBASE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
+
+# kid -> PEM certificate, refreshed in the background before Cache-Control max-age runs out
+_public_keys: Dict[str, str] = {}
+_keys_expire_at = 0.0
+_keys_fetched_at = 0.0
+_keys_lock = threading.Lock()
+_refresh_thread: Optional[threading.Thread] = None
+_refresh_stop = threading.Event()
+
+
+def _project_id() -> Optional[str]:
+    if FIREBASE_PROJECT_ID:
+        return FIREBASE_PROJECT_ID
+    if firebase_admin._apps:
+        return firebase_admin.get_app().project_id
+    return None
+
+
+def _fetch_public_keys() -> None:
+    """Download the current certificates and remember when they expire"""
+    global _public_keys, _keys_expire_at, _keys_fetched_at
+    _keys_fetched_at = time.time()
+    response = requests.get(FIREBASE_CERTS_URL, timeout=10)
+    response.raise_for_status()
+    max_age = 3600
+    match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+    if match:
+        max_age = int(match.group(1))
+    _public_keys = response.json()
+    _keys_expire_at = time.time() + max_age
+
+
+def get_public_keys(force_refresh: bool = False) -> Dict[str, str]:
+    """
+    Cached Firebase certificates (fetched inline only if the background refresh fell behind).
+    force_refresh re-fetches at most once a minute, so unknown kids cannot trigger a fetch per request.
+    """
+    def stale() -> bool:
+        if force_refresh and time.time() - _keys_fetched_at >= 60:
+            return True
+        return time.time() >= _keys_expire_at
+
+    if stale():
+        with _keys_lock:
+            if stale():
+                _fetch_public_keys()
+    return _public_keys
+
+
+def _refresh_loop() -> None:
+    while not _refresh_stop.is_set():
+        try:
+            with _keys_lock:
+                _fetch_public_keys()
+            # Refresh 5 minutes before the certificates expire
+            wait = max(60, _keys_expire_at - time.time() - 300)
+        except Exception as e:
+            print(f"⚠️ [FIREBASE] Error refreshing public keys: {e}")
+            wait = 60
+        _refresh_stop.wait(wait)
+
+
+def start_key_refresh() -> None:
+    """Keep the certificates warm in a background thread (no-op if Firebase is not configured)"""
+    global _refresh_thread
+    if not _project_id():
+        return
+    if _refresh_thread is not None and _refresh_thread.is_alive():
+        return
+    _refresh_stop.clear()
+    _refresh_thread = threading.Thread(target=_refresh_loop, daemon=True)
+    _refresh_thread.start()
+
+
+def stop_key_refresh() -> None:
+    _refresh_stop.set()
+
+
 def verify_firebase_token(token: str) -> dict:
     """
     מאמת Firebase ID token ומחזיר user info
     
+    האימות מקומי מול המפתחות הציבוריים השמורים ב-cache (בלי קריאת רשת בנתיב החם)
+    
     Args:
         token: Firebase ID token
         
@@ -52,20 +141,42 @@ def verify_firebase_token(token: str) -> dict:
     Raises:
         HTTPException: אם ה-token לא תקין
     """
+    project_id = _project_id()
+    if not project_id:
+        raise HTTPException(status_code=401, detail="Firebase לא מוגדר")
+    
     try:
-        decoded_token = auth.verify_id_token(token)
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = get_public_keys().get(kid)
+        if key is None and kid:
+            # Google rotated the keys since our last refresh
+            key = get_public_keys(force_refresh=True).get(kid)
+        if key is None:
+            raise HTTPException(status_code=401, detail="Firebase token לא תקין: מפתח חתימה לא מוכר")
+        
+        decoded_token = jwt.decode(
+            token,
+            key,
+            algorithms=["RS256"],
+            audience=project_id,
+            issuer=f"https://securetoken.google.com/{project_id}"
+        )
+        if not decoded_token.get("sub"):
+            raise HTTPException(status_code=401, detail="Firebase token לא תקין: חסר sub")
         
         return {
-            'user_id': decoded_token['uid'],
+            'user_id': decoded_token['sub'],
             'email': decoded_token.get('email'),
             'name': decoded_token.get('name'),
             'picture': decoded_token.get('picture'),
-            'firebase_uid': decoded_token['uid']
+            'firebase_uid': decoded_token['sub'],
+            'exp': decoded_token.get('exp')
         }
-    except ValueError as e:
+    except HTTPException:
+        raise
+    except JWTError as e:
         # Token לא תקין
         raise HTTPException(status_code=401, detail=f"Firebase token לא תקין: {str(e)}")
     except Exception as e:
         # שגיאה כללית
         raise HTTPException(status_code=401, detail=f"שגיאה באימות Firebase token: {str(e)}")
-
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+LLM Client - Async, pooled client for the xAI chat completions API
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Optional, Dict, Any, List, AsyncIterator
+
+import httpx
+
+
+XAI_API_URL = os.getenv("XAI_API_URL", "https://api.x.ai/v1/chat/completions")
+LLM_MODEL = os.getenv("LLM_MODEL", "grok-4-1-fast-reasoning")
+
+# Connection pool and concurrency limits (per worker)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "50"))
+
+# Overall deadline for one generation, including retries and waiting for a slot
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+
+# Retry policy for 429 / 5xx responses and transport errors
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    """Raised when the completion API could not produce a message"""
+
+    def __init__(self, detail: str, status_code: Optional[int] = None):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+# Shared client and concurrency gate (lazy initialization)
+_client: Optional[httpx.AsyncClient] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+# Metrics (per worker)
+_metrics = {
+    'requests': 0,
+    'errors': 0,
+    'retries': 0,
+    'in_flight': 0,
+}
+_ttfb_samples = deque(maxlen=1000)  # Seconds until first token (streaming)
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional 'h2' package"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Get or create the shared keep-alive client"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=_http2_available(),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                keepalive_expiry=60,
+            ),
+            timeout=httpx.Timeout(LLM_DEADLINE_SECONDS, connect=5.0),
+        )
+    return _client
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    """Get or create the concurrency gate"""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _semaphore
+
+
+async def close_client() -> None:
+    """Close the shared client (call on application shutdown)"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+def _get_api_key() -> str:
+    api_key = os.getenv("XAI_API_KEY") or os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise LLMError("מפתח API לא מוגדר. אנא הגדר XAI_API_KEY או GROQ_API_KEY בקובץ .env")
+    return api_key
+
+
+def _backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Full-jitter exponential backoff, honouring Retry-After when present"""
+    if retry_after:
+        try:
+            return min(float(retry_after), LLM_BACKOFF_MAX_SECONDS)
+        except ValueError:
+            pass
+    cap = min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return random.uniform(0, cap)
+
+
+def _error_detail(response: httpx.Response) -> str:
+    """Extract a readable error message from an API error response"""
+    error_data = response.text
+    try:
+        error_json = response.json()
+        if isinstance(error_json, dict) and error_json.get("error"):
+            error_data = str(error_json["error"])
+    except ValueError:
+        pass
+    return error_data
+
+
+def _percentile(samples: List[float], pct: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Return client counters and time-to-first-byte percentiles (ms)"""
+    samples = list(_ttfb_samples)
+    return {
+        **_metrics,
+        'ttfb_ms': {
+            'count': len(samples),
+            'p50': round(_percentile(samples, 50) * 1000, 1) if samples else None,
+            'p95': round(_percentile(samples, 95) * 1000, 1) if samples else None,
+            'p99': round(_percentile(samples, 99) * 1000, 1) if samples else None,
+        }
+    }
+
+
+def build_payload(messages: List[Dict[str, str]], **options) -> Dict[str, Any]:
+    """Build a chat completions request body"""
+    payload = {
+        "model": LLM_MODEL,
+        "messages": messages,
+        "temperature": 0.7,
+        "max_tokens": 500,
+    }
+    payload.update(options)
+    return payload
+
+
+async def chat_completion(
+    messages: List[Dict[str, str]],
+    deadline: Optional[float] = None,
+    **options
+) -> str:
+    """
+    Run a chat completion and return the assistant message content.
+
+    Args:
+        messages: Chat messages (role/content dicts)
+        deadline: Seconds allowed for the whole call, including retries
+        **options: Extra payload fields (temperature, max_tokens, ...)
+
+    Raises:
+        LLMError: If the API failed, or the deadline passed
+    """
+    headers = {
+        "Authorization": f"Bearer {_get_api_key()}",
+        "Content-Type": "application/json"
+    }
+    payload = build_payload(messages, **options)
+    timeout = deadline if deadline is not None else LLM_DEADLINE_SECONDS
+    expires = time.monotonic() + timeout
+
+    _metrics['requests'] += 1
+    _metrics['in_flight'] += 1
+    try:
+        async with asyncio.timeout(timeout):
+            async with _get_semaphore():
+                attempt = 0
+                while True:
+                    remaining = max(expires - time.monotonic(), 0.1)
+                    try:
+                        response = await _get_client().post(
+                            XAI_API_URL,
+                            headers=headers,
+                            json=payload,
+                            timeout=remaining,
+                        )
+                    except httpx.TransportError as e:
+                        if attempt >= LLM_MAX_RETRIES:
+                            raise LLMError(f"שגיאה בחיבור ל-API: {e}")
+                        _metrics['retries'] += 1
+                        await asyncio.sleep(_backoff_delay(attempt))
+                        attempt += 1
+                        continue
+
+                    if response.status_code == 200:
+                        result = response.json()
+                        return result["choices"][0]["message"]["content"]
+
+                    if response.status_code in RETRYABLE_STATUS_CODES and attempt < LLM_MAX_RETRIES:
+                        delay = _backoff_delay(attempt, response.headers.get("Retry-After"))
+                        print(f"⚠️ [LLM] API returned {response.status_code}, retrying in {delay:.2f}s")
+                        _metrics['retries'] += 1
+                        await asyncio.sleep(delay)
+                        attempt += 1
+                        continue
+
+                    raise LLMError(_error_detail(response), status_code=response.status_code)
+    except TimeoutError:
+        _metrics['errors'] += 1
+        raise LLMError(f"ה-API לא הגיב תוך {timeout:g} שניות")
+    except LLMError:
+        _metrics['errors'] += 1
+        raise
+    finally:
+        _metrics['in_flight'] -= 1
+
+
+async def stream_chat_completion(
+    messages: List[Dict[str, str]],
+    deadline: Optional[float] = None,
+    **options
+) -> AsyncIterator[str]:
+    """
+    Run a streaming chat completion and yield content deltas as they arrive.
+
+    Retries (429/5xx, transport errors) only happen before the first token
+    was received; once output started, errors are raised to the caller.
+    The deadline counts time spent waiting on the API only, not the time
+    the caller takes to consume each token.
+
+    Raises:
+        LLMError: If the API failed, or the deadline passed
+    """
+    headers = {
+        "Authorization": f"Bearer {_get_api_key()}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream"
+    }
+    payload = build_payload(messages, stream=True, **options)
+    timeout = deadline if deadline is not None else LLM_DEADLINE_SECONDS
+    started = time.monotonic()
+    first_token = True
+
+    # The deadline is a budget spent only while waiting on a slot or the
+    # upstream, never while the consumer holds a token (outside this generator)
+    loop = asyncio.get_running_loop()
+    budget = [timeout]
+
+    async def upstream(awaitable):
+        waited_from = loop.time()
+        try:
+            async with asyncio.timeout(max(budget[0], 0)):
+                return await awaitable
+        finally:
+            budget[0] -= loop.time() - waited_from
+
+    _metrics['requests'] += 1
+    _metrics['in_flight'] += 1
+    try:
+        semaphore = _get_semaphore()
+        await upstream(semaphore.acquire())
+        try:
+            attempt = 0
+            while True:
+                client = _get_client()
+                request = client.build_request(
+                    "POST",
+                    XAI_API_URL,
+                    headers=headers,
+                    json=payload,
+                    timeout=httpx.Timeout(timeout, connect=5.0),
+                )
+                try:
+                    response = await upstream(client.send(request, stream=True))
+                    try:
+                        if response.status_code != 200:
+                            await upstream(response.aread())
+                            if response.status_code in RETRYABLE_STATUS_CODES and attempt < LLM_MAX_RETRIES:
+                                delay = _backoff_delay(attempt, response.headers.get("Retry-After"))
+                                print(f"⚠️ [LLM] Stream returned {response.status_code}, retrying in {delay:.2f}s")
+                                _metrics['retries'] += 1
+                                await upstream(asyncio.sleep(delay))
+                                attempt += 1
+                                continue
+                            raise LLMError(_error_detail(response), status_code=response.status_code)
+
+                        lines = response.aiter_lines()
+                        while True:
+                            try:
+                                line = await upstream(anext(lines))
+                            except StopAsyncIteration:
+                                return
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                return
+                            try:
+                                chunk = json.loads(data)
+                                delta = chunk["choices"][0].get("delta", {}).get("content")
+                            except (ValueError, KeyError, IndexError):
+                                continue
+                            if not delta:
+                                continue
+                            if first_token:
+                                first_token = False
+                                _ttfb_samples.append(time.monotonic() - started)
+                            yield delta
+                    finally:
+                        await response.aclose()
+                except httpx.TransportError as e:
+                    if not first_token or attempt >= LLM_MAX_RETRIES:
+                        raise LLMError(f"שגיאה בחיבור ל-API: {e}")
+                    _metrics['retries'] += 1
+                    await upstream(asyncio.sleep(_backoff_delay(attempt)))
+                    attempt += 1
+        finally:
+            semaphore.release()
+    except TimeoutError:
+        _metrics['errors'] += 1
+        raise LLMError(f"ה-API לא הגיב תוך {timeout:g} שניות")
+    except LLMError:
+        _metrics['errors'] += 1
+        raise
+    finally:
+        _metrics['in_flight'] -= 1
@@ -10,25 +10,42 @@ import sys
 if sys.version_info < (3, 7):
     raise RuntimeError("האפליקציה דורשת Python 3.7 או גרסה חדשה יותר. גרסה נוכחית: {}".format(sys.version))
 
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import FastAPI, HTTPException, Depends, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse, JSONResponse
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
 import os
 import json
+import asyncio
 from datetime import datetime, timedelta, timezone
-import pytz
 import requests
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
-from database import get_db, init_db, SessionLocal
+from database import get_db, init_db, SessionLocal, start_notify_listener, stop_notify_listener
 from models import User, Contact as DBContact, Reminder as DBReminder
 from auth import (
     register_user, authenticate_user, create_access_token,
-    get_current_user, get_current_user_optional, create_or_get_google_user, create_or_get_firebase_user, verify_token
+    get_current_user, get_current_user_optional, create_or_get_google_user, create_or_get_firebase_user, verify_token,
+    invalidate_user_principals, get_principal_cache_metrics,
+    shutdown_password_executor, get_password_pool_metrics
 )
-from encryption import encrypt, decrypt
+from encryption import encrypt, decrypt, decrypt_many, get_decrypt_cache_metrics, init_encryption
+import llm_client
+import message_cache
+import message_pool
+import metrics_rollup
+import reminder_broker
+import reminder_scheduler
+import trigger_engine
+from pagination import paginate, parse_fields, NEXT_CURSOR_HEADER
+import settings_service
+import entitlements
+import etag
+import expiry_sweeper
+import sync_service
+import usage_buffer
 import threading
 import schedule
 import time
@@ -57,10 +74,57 @@ async def startup_event():
         print(f"⚠️ [STARTUP] Database initialization warning: {e}")
         print("   Application will continue, but database operations may fail")
 
+    # Derive encryption keys now rather than on the first request
+    init_encryption()
+    print("✅ [STARTUP] Encryption keys ready")
+
     # Notification System
     print("🔔 [NOTIF] Notification system: Local notifications only (FCM disabled)")
     print("🔔 [NOTIF] Reminders are scheduled locally on Android devices")
 
+    # One LISTEN connection per worker for cross-worker invalidations: app settings,
+    # entitlement snapshots, revoked principals, reminder stream wake-ups
+    start_notify_listener()
+
+    # Firebase public keys for local ID token verification
+    try:
+        from firebase_config import start_key_refresh
+        start_key_refresh()
+    except ImportError:
+        pass
+
+    # Write-behind usage counters for premium/trial users (USAGE_BUFFER_ENABLED)
+    usage_buffer.start_worker()
+
+    # Pre-generation worker (idle unless message_pool_enabled is set)
+    message_pool.start_worker(build_pool_messages)
+
+    # Materializes due reminders nobody polled for (see reminder_scheduler)
+    reminder_scheduler.start_worker(next_triggers_for_reminders)
+
+    # Expires subscriptions and keeps stored user statuses current (see expiry_sweeper)
+    expiry_sweeper.start_worker()
+
+    # Daily admin metrics rollup (see metrics_rollup)
+    metrics_rollup.start_worker()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release shared resources when application stops"""
+    await message_pool.stop_worker()
+    await reminder_scheduler.stop_worker()
+    await metrics_rollup.stop_worker()
+    await expiry_sweeper.stop_worker()
+    await llm_client.close_client()
+    await usage_buffer.stop_worker()
+    stop_notify_listener()
+    shutdown_password_executor()
+    try:
+        from firebase_config import stop_key_refresh
+        stop_key_refresh()
+    except ImportError:
+        pass
+
 # הגדרת CORS כדי לאפשר גישה מה-frontend
 # במצב פיתוח - מאפשרים את כל ה-localhost ports
 allowed_origins = [
@@ -102,7 +166,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS", "PATCH"],
     allow_headers=["*"],
-    expose_headers=["*"],
+    expose_headers=["*", NEXT_CURSOR_HEADER],  # "*" is not honoured for credentialed requests
     max_age=3600,  # Cache preflight requests for 1 hour
 )
 
@@ -189,10 +253,6 @@ class ReminderCreate(BaseModel):
     enabled: Optional[bool] = True
 
 # Database functions - using PostgreSQL instead of JSON files
-def get_contacts_from_db(db: Session, user_id: str) -> List[DBContact]:
-    """Get all contacts for a user from PostgreSQL"""
-    return db.query(DBContact).filter(DBContact.user_id == user_id).all()
-
 def get_contact_by_id(db: Session, contact_id: int, user_id: str) -> Optional[DBContact]:
     """Get a specific contact by ID (ensuring it belongs to the user)"""
     return db.query(DBContact).filter(
@@ -200,10 +260,6 @@ def get_contact_by_id(db: Session, contact_id: int, user_id: str) -> Optional[DB
         DBContact.user_id == user_id
     ).first()
 
-def get_reminders_from_db(db: Session, user_id: str) -> List[DBReminder]:
-    """Get all reminders for a user from PostgreSQL"""
-    return db.query(DBReminder).filter(DBReminder.user_id == user_id).all()
-
 def get_reminder_by_id(db: Session, reminder_id: int, user_id: str) -> Optional[DBReminder]:
     """Get a specific reminder by ID (ensuring it belongs to the user)"""
     return db.query(DBReminder).filter(
@@ -222,131 +278,62 @@ def calculate_next_trigger_advanced(
     user_timezone: Optional[str] = None
 ) -> Optional[datetime]:
     """
-    מחשב את זמן ההתראה הבאה לפי סוג ההתראה
+    מחשב את זמן ההתראה הבאה לפי סוג ההתראה (ראו trigger_engine)
     """
-    now = datetime.now(timezone.utc)
-    
-    if reminder_type == 'one_time':
-        # התראה חד-פעמית - מחזיר את התאריך הספציפי
-        if scheduled_datetime and scheduled_datetime > now:
-            return scheduled_datetime
-        return None  # אם התאריך כבר עבר
-    
-    elif reminder_type == 'recurring':
-        # התראה חזרתית - כמו עכשיו
-        if not interval_type or not interval_value:
-            return None
-        
-        if interval_type == 'hours':
-            delta = timedelta(hours=interval_value)
-        else:  # days
-            delta = timedelta(days=interval_value)
-        
-        if last_triggered:
-            return last_triggered + delta
-        else:
-            return now + delta
-    
-    elif reminder_type == 'weekly':
-        # התראה שבועית - יום/ימים קבועים בשבוע בשעה מסוימת
-        if not weekdays or not specific_time:
-            return None
-        
-        # פרסור שעה
-        try:
-            hour, minute = map(int, specific_time.split(':'))
-        except (ValueError, AttributeError):
-            return None
-        
-        # המרת השעה מ-timezone של המשתמש ל-UTC
-        if user_timezone:
-            try:
-                tz = pytz.timezone(user_timezone)
-                # יצירת datetime בשעה המקומית של המשתמש
-                local_now = datetime.now(tz)
-                # חישוב התאריך הבא בשעה המקומית
-                local_next = local_now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                if local_next <= local_now:
-                    local_next += timedelta(days=1)
-                # המרה ל-UTC
-                next_date = local_next.astimezone(timezone.utc).replace(tzinfo=None)
-                next_date = pytz.UTC.localize(next_date)
-            except Exception as e:
-                print(f"⚠️ [CALC] Error converting timezone {user_timezone}: {e}, using UTC")
-                # Fallback to UTC
-                current_weekday = now.weekday()
-                days_ahead = None
-                for weekday in sorted(weekdays):
-                    if weekday > current_weekday:
-                        days_ahead = weekday - current_weekday
-                        break
-                if days_ahead is None:
-                    days_ahead = (7 - current_weekday) + min(weekdays)
-                next_date = (now + timedelta(days=days_ahead)).replace(hour=hour, minute=minute, second=0, microsecond=0)
-                if next_date <= now:
-                    days_ahead += 7
-                    next_date = (now + timedelta(days=days_ahead)).replace(hour=hour, minute=minute, second=0, microsecond=0)
-        else:
-            # Fallback to UTC if no timezone provided
-            current_weekday = now.weekday()
-            days_ahead = None
-            for weekday in sorted(weekdays):
-                if weekday > current_weekday:
-                    days_ahead = weekday - current_weekday
-                    break
-            if days_ahead is None:
-                days_ahead = (7 - current_weekday) + min(weekdays)
-            next_date = (now + timedelta(days=days_ahead)).replace(hour=hour, minute=minute, second=0, microsecond=0)
-            if next_date <= now:
-                days_ahead += 7
-                next_date = (now + timedelta(days=days_ahead)).replace(hour=hour, minute=minute, second=0, microsecond=0)
-        
-        return next_date
-    
-    elif reminder_type == 'daily':
-        # התראה יומית - כל יום בשעה מסוימת
-        if not specific_time:
-            return None
-        
-        # פרסור שעה
-        try:
-            hour, minute = map(int, specific_time.split(':'))
-            print(f"🔍 [CALC] Daily reminder: specific_time={specific_time}, parsed hour={hour}, minute={minute}, timezone={user_timezone}")
-        except (ValueError, AttributeError):
-            print(f"❌ [CALC] Failed to parse specific_time: {specific_time}")
-            return None
-        
-        # המרת השעה מ-timezone של המשתמש ל-UTC
-        if user_timezone:
-            try:
-                tz = pytz.timezone(user_timezone)
-                # יצירת datetime בשעה המקומית של המשתמש
-                local_now = datetime.now(tz)
-                # חישוב התאריך הבא בשעה המקומית
-                local_next = local_now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                if local_next <= local_now:
-                    local_next += timedelta(days=1)
-                # המרה ל-UTC
-                next_datetime = local_next.astimezone(timezone.utc).replace(tzinfo=None)
-                next_datetime = pytz.UTC.localize(next_datetime)
-                print(f"🔍 [CALC] Daily: local_now={local_now}, local_next={local_next}, UTC next={next_datetime}")
-            except Exception as e:
-                print(f"⚠️ [CALC] Error converting timezone {user_timezone}: {e}, using UTC")
-                # Fallback to UTC
-                next_datetime = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-                if next_datetime <= now:
-                    next_datetime = (now + timedelta(days=1)).replace(hour=hour, minute=minute, second=0, microsecond=0)
-        else:
-            # Fallback to UTC if no timezone provided
-            next_datetime = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-            print(f"🔍 [CALC] Daily: now={now}, next_datetime (today)={next_datetime} (no timezone)")
-            if next_datetime <= now:
-                next_datetime = (now + timedelta(days=1)).replace(hour=hour, minute=minute, second=0, microsecond=0)
-                print(f"🔍 [CALC] Daily: hour passed, using tomorrow: {next_datetime}")
-        
-        return next_datetime
-    
-    return None
+    return trigger_engine.next_trigger(trigger_engine.make_schedule(
+        reminder_type,
+        interval_type=interval_type,
+        interval_value=interval_value,
+        scheduled_datetime=scheduled_datetime,
+        weekdays=weekdays,
+        specific_time=specific_time,
+        last_triggered=last_triggered,
+        user_timezone=user_timezone
+    ))
+
+def next_triggers_for_reminders(db_reminders: List[DBReminder], now: datetime) -> List[Optional[datetime]]:
+    """Next triggers of stored reminders that have just fired, in one batch (used by the reminder scheduler)"""
+    return trigger_engine.next_triggers([
+        trigger_engine.ReminderSchedule(
+            reminder_type=r.reminder_type or 'recurring',
+            interval_type=r.interval_type,
+            interval_value=r.interval_value,
+            scheduled_datetime=r.scheduled_datetime,
+            weekday_mask=r.weekday_mask or 0,
+            time_minutes=r.time_minutes,
+            timezone=r.timezone,
+            last_triggered=now
+        )
+        for r in db_reminders
+    ], now)
+
+def reminder_to_model(db_reminder: DBReminder) -> Reminder:
+    """Convert a stored reminder to the API model"""
+    return Reminder(
+        id=db_reminder.id,
+        user_id=db_reminder.user_id,
+        contact_id=db_reminder.contact_id,
+        reminder_type=db_reminder.reminder_type or 'recurring',
+        interval_type=db_reminder.interval_type,
+        interval_value=db_reminder.interval_value,
+        scheduled_datetime=db_reminder.scheduled_datetime,
+        weekdays=trigger_engine.mask_to_weekdays(db_reminder.weekday_mask) or None,
+        specific_time=trigger_engine.format_time(db_reminder.time_minutes),
+        timezone=db_reminder.timezone,
+        one_time_triggered=db_reminder.one_time_triggered or False,
+        last_triggered=db_reminder.last_triggered,
+        next_trigger=db_reminder.next_trigger,
+        enabled=db_reminder.enabled,
+        created_at=db_reminder.created_at
+    )
+
+def page_response(items: List[BaseModel], next_cursor: Optional[str], include: Optional[set] = None) -> JSONResponse:
+    """A page of a list endpoint: JSON array body, next cursor in the X-Next-Cursor header"""
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    return JSONResponse(
+        content=jsonable_encoder([item.model_dump(include=include) for item in items]),
+        headers=headers
+    )
 
 # Database is initialized on startup via startup_event
 # No need to load from JSON files anymore
@@ -359,20 +346,40 @@ async def root():
 
 @app.get("/api/contacts", response_model=List[Contact])
 async def get_contacts(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """קבלת רשימת כל אנשי הקשר של המשתמש הנוכחי"""
+    """
+    קבלת רשימת אנשי הקשר של המשתמש הנוכחי, בעמודים (cursor מה-header X-Next-Cursor).
+    fields: רשימת שדות מופרדת בפסיקים (למשל id,name)
+    """
     user_id = current_user["user_id"]
-    db_contacts = get_contacts_from_db(db, user_id)
-    # Convert SQLAlchemy models to Pydantic models (decrypt name)
-    return [Contact(
+    include = parse_fields(fields, Contact.model_fields)
+    
+    # Unchanged since the client's copy: skip the fetch and the decryption
+    resource_etag = etag.make_etag('contacts', user_id, sync_service.get_current_version(db, user_id), cursor, limit, fields)
+    if etag.is_not_modified(request, 'contacts', resource_etag):
+        return etag.not_modified(resource_etag)
+    
+    db_contacts, next_cursor = paginate(
+        db.query(DBContact).filter(DBContact.user_id == user_id), DBContact, cursor, limit
+    )
+    # Decrypt all names in one batch - and not at all when the name was not asked for
+    if include is None or 'name' in include:
+        names = decrypt_many([c.name_encrypted for c in db_contacts])
+    else:
+        names = [''] * len(db_contacts)
+    return etag.set_etag(page_response([Contact(
         id=c.id,
         user_id=c.user_id,
-        name=decrypt(c.name_encrypted),
+        name=name,
         default_tone=c.default_tone,
         created_at=c.created_at
-    ) for c in db_contacts]
+    ) for c, name in zip(db_contacts, names)], next_cursor, include), resource_etag)
 
 @app.get("/api/contacts/{contact_id}", response_model=Contact)
 async def get_contact(
@@ -433,6 +440,7 @@ async def create_contact(
         created_at=datetime.now(timezone.utc)
     )
     db.add(db_contact)
+    sync_service.touch(db, user_id, db_contact)
     db.commit()
     db.refresh(db_contact)
     
@@ -464,6 +472,7 @@ async def update_contact(
     # Update contact fields (encrypt name)
     db_contact.name_encrypted = encrypt(contact.name)
     db_contact.default_tone = contact.default_tone or 'friendly'
+    sync_service.touch(db, user_id, db_contact)
     
     db.commit()
     db.refresh(db_contact)
@@ -493,7 +502,10 @@ async def delete_contact(
         raise HTTPException(status_code=404, detail="איש קשר לא נמצא")
     
     # Delete contact (cascade will delete related reminders automatically)
+    reminder_ids = [r.id for r in db_contact.reminders]
     db.delete(db_contact)
+    sync_service.record_deletes(db, user_id, 'contact', [contact_id])
+    sync_service.record_deletes(db, user_id, 'reminder', reminder_ids)
     db.commit()
     
     print(f"✅ [DATABASE] Deleted contact {contact_id} for user {user_id}")
@@ -501,7 +513,7 @@ async def delete_contact(
 
 # ========== REMINDERS ENDPOINTS ==========
 
-# IMPORTANT: /api/reminders/check must be defined BEFORE /api/reminders/{reminder_id}
+# IMPORTANT: /api/reminders/check, /due and /stream must be defined BEFORE /api/reminders/{reminder_id}
 # Otherwise FastAPI will try to match "check" as a reminder_id and cause 422 errors
 @app.get("/api/reminders/check")
 async def check_reminders(
@@ -509,190 +521,30 @@ async def check_reminders(
     db: Session = Depends(get_db)
 ):
     """בודק אילו התראות צריכות להתפעל עכשיו"""
-    print(f"🔍 [CHECK] Endpoint called - starting check_reminders")
     try:
         user_id = current_user["user_id"]
-        now = datetime.now(timezone.utc)
-        print(f"🔍 [CHECK] Checking reminders for user {user_id} at {now}")
         
-        # Get all enabled reminders for user
-        # For one_time: check scheduled_datetime and one_time_triggered
-        # For others: check next_trigger
-        all_reminders = db.query(DBReminder).filter(
-            DBReminder.user_id == user_id,
-            DBReminder.enabled == True
-        ).all()
-        
-        triggered_reminders = []
-        for db_reminder in all_reminders:
-            reminder_type = db_reminder.reminder_type or 'recurring'
-            
-            # Check if reminder should trigger
-            should_trigger = False
-            
-            if reminder_type == 'one_time':
-                # One-time reminder: check scheduled_datetime and one_time_triggered
-                if db_reminder.scheduled_datetime and not db_reminder.one_time_triggered:
-                    # Check if scheduled time has passed (with 1 minute tolerance)
-                    time_diff = (now - db_reminder.scheduled_datetime).total_seconds()
-                    if -60 <= time_diff <= 60:  # Within 1 minute window
-                        should_trigger = True
-            else:
-                # Recurring, weekly, or daily: check next_trigger
-                if db_reminder.next_trigger:
-                    # Check if next_trigger time has passed (with 1 minute tolerance)
-                    time_diff = (now - db_reminder.next_trigger).total_seconds()
-                    if -60 <= time_diff <= 60:  # Within 1 minute window
-                        should_trigger = True
-            
-            if should_trigger:
-                print(f"✅ [CHECK] Reminder {db_reminder.id} should trigger (type={reminder_type})")
-                
-                # Get contact info for notification
-                contact = get_contact_by_id(db, db_reminder.contact_id, user_id)
-                if not contact:
-                    print(f"⚠️ [CHECK] Contact {db_reminder.contact_id} not found for reminder {db_reminder.id}")
-                    continue
-                
-                # Send push notification
-                contact_name = decrypt(contact.name_encrypted)
-                push_tokens = db.query(PushToken).filter(PushToken.user_id == user_id).all()
-                
-                # קבל את העדפת הפלטפורמה של המשתמש
-                user = db.query(User).filter(User.id == user_id).first()
-                notification_platform = user.notification_platform if user else 'both'
-                
-                # סנן טוקנים לפי העדפת המשתמש
-                filtered_tokens = []
-                for pt in push_tokens:
-                    try:
-                        device_info = json.loads(pt.device_info) if pt.device_info else {}
-                        platform = device_info.get('platform', 'web')
-                        
-                        if notification_platform == 'both':
-                            filtered_tokens.append(pt)
-                        elif notification_platform == 'phone' and platform in ['android', 'ios']:
-                            filtered_tokens.append(pt)
-                        elif notification_platform == 'browser' and platform == 'web':
-                            filtered_tokens.append(pt)
-                    except:
-                        filtered_tokens.append(pt)
-                
-                if filtered_tokens:
-                    notification_title = f"תזכורת: {contact_name}"
-                    notification_body = f"זמן להתקשר ל-{contact_name}!"
-                    
-                    for push_token in filtered_tokens:
-                        send_push_notification(
-                            push_token=push_token.token,
-                            title=notification_title,
-                            body=notification_body,
-                            data={"reminder_id": str(db_reminder.id), "contact_id": str(contact.id)}
-                        )
-                else:
-                    print(f"⚠️ [CHECK] No push tokens found for user {user_id} (platform: {notification_platform})")
-                
-                # Update reminder
-                if reminder_type == 'one_time':
-                    db_reminder.one_time_triggered = True
-                    db_reminder.next_trigger = None
-                else:
-                    # Calculate next trigger
-                    # Parse weekdays from JSON if exists
-                    weekdays = None
-                    if db_reminder.weekdays:
-                        try:
-                            weekdays = json.loads(db_reminder.weekdays)
-                        except (json.JSONDecodeError, TypeError):
-                            weekdays = None
-                    
-                    # Use stored timezone or default to None
-                    user_timezone = db_reminder.timezone
-                    
-                    next_trigger = calculate_next_trigger_advanced(
-                        reminder_type=reminder_type,
-                        interval_type=db_reminder.interval_type,
-                        interval_value=db_reminder.interval_value,
-                        scheduled_datetime=db_reminder.scheduled_datetime,
-                        weekdays=weekdays,
-                        specific_time=db_reminder.specific_time,
-                        last_triggered=now,
-                        user_timezone=user_timezone
-                    )
-                    db_reminder.last_triggered = now
-                    db_reminder.next_trigger = next_trigger
-                
-                # Create Reminder object for response
-                try:
-                    # Parse weekdays from JSON string if exists
-                    weekdays = None
-                    if db_reminder.weekdays:
-                        try:
-                            weekdays = json.loads(db_reminder.weekdays)
-                        except (json.JSONDecodeError, TypeError):
-                            weekdays = None
-                    
-                    reminder_obj = Reminder(
-                        id=db_reminder.id,
-                        user_id=db_reminder.user_id,
-                        contact_id=db_reminder.contact_id,
-                        reminder_type=reminder_type,
-                        interval_type=db_reminder.interval_type,
-                        interval_value=db_reminder.interval_value,
-                        scheduled_datetime=db_reminder.scheduled_datetime,
-                        weekdays=weekdays,
-                        specific_time=db_reminder.specific_time,
-                        one_time_triggered=db_reminder.one_time_triggered or False,
-                        timezone=db_reminder.timezone,
-                        last_triggered=db_reminder.last_triggered,
-                        next_trigger=db_reminder.next_trigger,
-                        enabled=db_reminder.enabled,
-                        created_at=db_reminder.created_at
-                    )
-                    
-                    triggered_reminders.append(reminder_obj)
-                except Exception as e:
-                    print(f"❌ [CHECK] Error creating Reminder object: {e}")
-                    print(f"   Reminder ID: {db_reminder.id}, Type: {reminder_type}")
-                    print(f"   Reminder data: id={db_reminder.id}, contact_id={db_reminder.contact_id}, enabled={db_reminder.enabled}")
-                    print(f"   scheduled_datetime={db_reminder.scheduled_datetime}, next_trigger={db_reminder.next_trigger}")
-                    print(f"   last_triggered={db_reminder.last_triggered}, created_at={db_reminder.created_at}")
-                    import traceback
-                    traceback.print_exc()
-                    # Don't raise - just skip this reminder and continue
-                    continue
-        
-        if triggered_reminders:
-            db.commit()
-            print(f"✅ [DATABASE] Updated {len(triggered_reminders)} triggered reminders for user {user_id}")
-        
-        # Validate that all reminders have required fields before returning
-        for r in triggered_reminders:
-            if r.contact_id is None:
-                print(f"⚠️ [CHECK] Warning: Reminder {r.id} has None contact_id")
-        
-        # Try to serialize manually to catch validation errors
-        try:
-            # Convert to dict to test serialization - use model_dump for Pydantic v2 compatibility
-            result = [r.model_dump() if hasattr(r, 'model_dump') else r.dict() for r in triggered_reminders]
-            print(f"✅ [CHECK] Serialization test passed: {len(result)} reminders")
-        except Exception as e:
-            print(f"❌ [CHECK] Serialization test failed: {e}")
-            import traceback
-            traceback.print_exc()
-            # Return empty list instead of raising error - better UX
+        # Only reminders that are already due are touched (index on enabled, next_trigger).
+        # Anything that came due since the last poll is still due, so no window is needed.
+        reminder_scheduler.materialize_due(db, next_triggers_for_reminders, user_id=user_id)
+        # Everything not returned yet - including what the background worker materialized
+        events = reminder_scheduler.take_unchecked_events(db, user_id)
+        if not events:
             return []
         
-        print(f"✅ [CHECK] Returning {len(triggered_reminders)} triggered reminders")
-        # Convert to dict to avoid serialization issues
-        result = []
-        for r in triggered_reminders:
-            try:
-                result.append(r.model_dump() if hasattr(r, 'model_dump') else r.dict())
-            except Exception as e:
-                print(f"⚠️ [CHECK] Error serializing reminder {r.id}: {e}")
-                continue
-        
+        reminders_by_id = {
+            r.id: r for r in db.query(DBReminder).filter(
+                DBReminder.id.in_([event.reminder_id for event in events])
+            ).all()
+        }
+        # One entry per reminder, even if it fired more than once since the last poll
+        reminder_ids = list(dict.fromkeys(event.reminder_id for event in events))
+        result = [
+            reminder_to_model(reminders_by_id[reminder_id]).model_dump()
+            for reminder_id in reminder_ids
+            if reminder_id in reminders_by_id
+        ]
+        print(f"✅ [CHECK] Returning {len(result)} triggered reminders for user {user_id}")
         return result
     except HTTPException:
         # Re-raise HTTP exceptions as-is
@@ -701,48 +553,154 @@ async def check_reminders(
         print(f"❌ [CHECK] Error in check_reminders: {e}")
         import traceback
         traceback.print_exc()
-        # Return 422 with detailed error message for validation errors
-        error_detail = str(e)
-        if "validation" in error_detail.lower() or "pydantic" in error_detail.lower():
-            raise HTTPException(status_code=422, detail=f"Validation error: {error_detail}")
-        raise HTTPException(status_code=500, detail=f"Error checking reminders: {error_detail}")
+        raise HTTPException(status_code=500, detail=f"Error checking reminders: {e}")
+
+def serialize_due_events(db: Session, user_id: str, events: list) -> List[dict]:
+    """Reminder events with their reminder and contact name, for /due and /stream"""
+    if not events:
+        return []
+    reminders_by_id = {
+        r.id: r for r in db.query(DBReminder).filter(
+            DBReminder.id.in_({event.reminder_id for event in events})
+        ).all()
+    }
+    contacts = db.query(DBContact).filter(
+        DBContact.user_id == user_id,
+        DBContact.id.in_({event.contact_id for event in events})
+    ).all()
+    contact_names = dict(zip(
+        [c.id for c in contacts],
+        decrypt_many([c.name_encrypted for c in contacts])
+    ))
+    return [
+        {
+            "event_id": event.id,
+            "reminder_id": event.reminder_id,
+            "contact_id": event.contact_id,
+            "contact_name": contact_names.get(event.contact_id),
+            "due_at": event.due_at,
+            "reminder": reminder_to_model(reminders_by_id[event.reminder_id]).model_dump()
+            if event.reminder_id in reminders_by_id else None
+        }
+        for event in events
+    ]
+
+@app.get("/api/reminders/due")
+async def get_due_reminders(
+    cursor: Optional[int] = None,
+    limit: int = 100,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """התראות שהגיע זמנן מאז ה-cursor (ללא cursor: היממה האחרונה)"""
+    user_id = current_user["user_id"]
+    limit = max(1, min(limit, 500))
+    
+    reminder_scheduler.materialize_due(db, next_triggers_for_reminders, user_id=user_id)
+    events = reminder_scheduler.get_due_events(db, user_id, cursor=cursor, limit=limit)
+    
+    return {
+        "events": serialize_due_events(db, user_id, events),
+        "cursor": events[-1].id if events else cursor
+    }
+
+REMINDER_STREAM_HEARTBEAT_SECONDS = float(os.getenv("REMINDER_STREAM_HEARTBEAT_SECONDS", "25"))
+REMINDER_STREAM_RETRY_MS = int(os.getenv("REMINDER_STREAM_RETRY_MS", "5000"))
+REMINDER_STREAM_BATCH = 100
+
+def load_stream_events(user_id: str, cursor: int, materialize: bool = False) -> List[dict]:
+    """One read for a reminder stream, with its own short-lived session (runs in a thread)"""
+    db = SessionLocal()
+    try:
+        if materialize:
+            reminder_scheduler.materialize_due(db, next_triggers_for_reminders, user_id=user_id)
+        events = reminder_scheduler.get_due_events(db, user_id, cursor=cursor, limit=REMINDER_STREAM_BATCH)
+        return serialize_due_events(db, user_id, events)
+    finally:
+        db.close()
+
+@app.get("/api/reminders/stream")
+async def stream_reminders(
+    request: Request,
+    cursor: Optional[int] = None,
+    heartbeat: Optional[float] = None,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    ערוץ Server-Sent Events להתראות - השרת דוחף התראות כשהן מגיעות.
+    חידוש אחרי ניתוק: Last-Event-ID (או cursor) ממשיך מהאירוע האחרון שהתקבל.
+    heartbeat: שניות בין הודעות keep-alive (5-300)
+    """
+    user_id = current_user["user_id"]
+    
+    last_event_id = request.headers.get("Last-Event-ID")
+    if last_event_id:
+        try:
+            cursor = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Last-Event-ID לא תקין")
+    if cursor is None:
+        # New subscription: only events from now on
+        cursor = reminder_scheduler.get_latest_event_id(db, user_id)
+    heartbeat_seconds = max(5.0, min(heartbeat or REMINDER_STREAM_HEARTBEAT_SECONDS, 300.0))
+    # The stream can stay open for hours - don't hold a pooled connection for it
+    db.close()
+    
+    async def event_stream():
+        nonlocal cursor
+        subscription = reminder_broker.subscribe(user_id)
+        try:
+            yield f"retry: {REMINDER_STREAM_RETRY_MS}\n\n"
+            # Anything already due is delivered on connect
+            pending, materialize = True, True
+            while True:
+                if pending:
+                    events = await asyncio.to_thread(load_stream_events, user_id, cursor, materialize)
+                    materialize = False
+                    for event in events:
+                        cursor = event["event_id"]
+                        yield _sse_event("reminder", event, event_id=cursor)
+                    if len(events) == REMINDER_STREAM_BATCH:
+                        continue
+                pending = await subscription.wait(heartbeat_seconds)
+                if not pending:
+                    yield ": heartbeat\n\n"
+        finally:
+            reminder_broker.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable proxy buffering
+        }
+    )
 
 @app.get("/api/reminders", response_model=List[Reminder])
 async def get_reminders(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """קבלת רשימת כל ההתראות של המשתמש הנוכחי"""
+    """קבלת רשימת ההתראות של המשתמש הנוכחי, בעמודים (cursor מה-header X-Next-Cursor)"""
     user_id = current_user["user_id"]
-    db_reminders = get_reminders_from_db(db, user_id)
-    # Convert SQLAlchemy models to Pydantic models
-    result = []
-    for r in db_reminders:
-        # Parse weekdays from JSON string if exists
-        weekdays = None
-        if r.weekdays:
-            try:
-                weekdays = json.loads(r.weekdays)
-            except (json.JSONDecodeError, TypeError):
-                weekdays = None
-        
-        result.append(Reminder(
-            id=r.id,
-            user_id=r.user_id,
-            contact_id=r.contact_id,
-            reminder_type=r.reminder_type or 'recurring',
-            interval_type=r.interval_type,
-            interval_value=r.interval_value,
-            scheduled_datetime=r.scheduled_datetime,
-            weekdays=weekdays,
-            specific_time=r.specific_time,
-            one_time_triggered=r.one_time_triggered or False,
-            last_triggered=r.last_triggered,
-            next_trigger=r.next_trigger,
-            enabled=r.enabled,
-            created_at=r.created_at
-        ))
-    return result
+    include = parse_fields(fields, Reminder.model_fields)
+    
+    resource_etag = etag.make_etag('reminders', user_id, sync_service.get_current_version(db, user_id), cursor, limit, fields)
+    if etag.is_not_modified(request, 'reminders', resource_etag):
+        return etag.not_modified(resource_etag)
+    
+    db_reminders, next_cursor = paginate(
+        db.query(DBReminder).filter(DBReminder.user_id == user_id), DBReminder, cursor, limit
+    )
+    return etag.set_etag(
+        page_response([reminder_to_model(r) for r in db_reminders], next_cursor, include), resource_etag
+    )
 
 @app.get("/api/reminders/{reminder_id}", response_model=Reminder)
 async def get_reminder(
@@ -756,32 +714,7 @@ async def get_reminder(
     if not db_reminder:
         raise HTTPException(status_code=404, detail="התראה לא נמצאה")
     
-    # Parse weekdays from JSON string if exists
-    weekdays = None
-    if db_reminder.weekdays:
-        try:
-            weekdays = json.loads(db_reminder.weekdays)
-        except (json.JSONDecodeError, TypeError):
-            weekdays = None
-    
-    # Convert SQLAlchemy model to Pydantic model
-    return Reminder(
-        id=db_reminder.id,
-        user_id=db_reminder.user_id,
-        contact_id=db_reminder.contact_id,
-        reminder_type=db_reminder.reminder_type or 'recurring',
-        interval_type=db_reminder.interval_type,
-        interval_value=db_reminder.interval_value,
-        scheduled_datetime=db_reminder.scheduled_datetime,
-        weekdays=weekdays,
-        specific_time=db_reminder.specific_time,
-        timezone=db_reminder.timezone,
-        one_time_triggered=db_reminder.one_time_triggered or False,
-        last_triggered=db_reminder.last_triggered,
-        next_trigger=db_reminder.next_trigger,
-        enabled=db_reminder.enabled,
-        created_at=db_reminder.created_at
-    )
+    return reminder_to_model(db_reminder)
 
 @app.post("/api/reminders", response_model=Reminder)
 async def create_reminder(
@@ -799,7 +732,7 @@ async def create_reminder(
     
     # Calculate next trigger using advanced function
     now = datetime.now(timezone.utc)
-    user_timezone = reminder.timezone or 'Asia/Jerusalem'  # Default to Israel timezone
+    user_timezone = trigger_engine.normalize_timezone(reminder.timezone) or 'Asia/Jerusalem'  # Default to Israel timezone
     print(f"🔍 [CREATE] Calculating next_trigger: type={reminder.reminder_type}, specific_time={reminder.specific_time}, timezone={user_timezone}, now={now}")
     next_trigger = calculate_next_trigger_advanced(
         reminder_type=reminder.reminder_type or 'recurring',
@@ -813,11 +746,6 @@ async def create_reminder(
     )
     print(f"✅ [CREATE] Calculated next_trigger: {next_trigger}")
     
-    # Convert weekdays list to JSON string
-    weekdays_json = None
-    if reminder.weekdays:
-        weekdays_json = json.dumps(reminder.weekdays)
-    
     # Create new reminder in database
     db_reminder = DBReminder(
         user_id=user_id,
@@ -826,7 +754,9 @@ async def create_reminder(
         interval_type=reminder.interval_type,
         interval_value=reminder.interval_value,
         scheduled_datetime=reminder.scheduled_datetime,
-        weekdays=weekdays_json,
+        weekday_mask=trigger_engine.weekdays_to_mask(reminder.weekdays) or None,
+        time_minutes=trigger_engine.parse_time(reminder.specific_time),
+        weekdays=json.dumps(reminder.weekdays) if reminder.weekdays else None,  # legacy columns, for rollback
         specific_time=reminder.specific_time,
         timezone=user_timezone,  # שמירת ה-timezone של המשתמש
         one_time_triggered=False,
@@ -836,36 +766,13 @@ async def create_reminder(
         created_at=now
     )
     db.add(db_reminder)
+    sync_service.touch(db, user_id, db_reminder)
     db.commit()
     db.refresh(db_reminder)
     
     print(f"✅ [DATABASE] Created reminder {db_reminder.id} for user {user_id}")
     
-    # Parse weekdays for response
-    weekdays_parsed = None
-    if db_reminder.weekdays:
-        try:
-            weekdays_parsed = json.loads(db_reminder.weekdays)
-        except (json.JSONDecodeError, TypeError):
-            weekdays_parsed = None
-    
-    # Convert SQLAlchemy model to Pydantic model
-    return Reminder(
-        id=db_reminder.id,
-        user_id=db_reminder.user_id,
-        contact_id=db_reminder.contact_id,
-        reminder_type=db_reminder.reminder_type or 'recurring',
-        interval_type=db_reminder.interval_type,
-        interval_value=db_reminder.interval_value,
-        scheduled_datetime=db_reminder.scheduled_datetime,
-        weekdays=weekdays_parsed,
-        specific_time=db_reminder.specific_time,
-        one_time_triggered=db_reminder.one_time_triggered or False,
-        last_triggered=db_reminder.last_triggered,
-        next_trigger=db_reminder.next_trigger,
-        enabled=db_reminder.enabled,
-        created_at=db_reminder.created_at
-    )
+    return reminder_to_model(db_reminder)
 
 @app.put("/api/reminders/{reminder_id}", response_model=Reminder)
 async def update_reminder(
@@ -884,7 +791,7 @@ async def update_reminder(
     
     # Calculate next trigger using advanced function
     now = datetime.now(timezone.utc)
-    user_timezone = reminder.timezone or db_reminder.timezone or 'Asia/Jerusalem'
+    user_timezone = trigger_engine.normalize_timezone(reminder.timezone) or db_reminder.timezone or 'Asia/Jerusalem'
     print(f"🔍 [UPDATE] Calculating next_trigger for reminder {reminder_id}: type={reminder.reminder_type}, specific_time={reminder.specific_time}, timezone={user_timezone}, now={now}")
     next_trigger = calculate_next_trigger_advanced(
         reminder_type=reminder.reminder_type or 'recurring',
@@ -898,53 +805,27 @@ async def update_reminder(
     )
     print(f"✅ [UPDATE] Calculated next_trigger: {next_trigger}")
     
-    # Convert weekdays list to JSON string
-    weekdays_json = None
-    if reminder.weekdays:
-        weekdays_json = json.dumps(reminder.weekdays)
-    
     # Update reminder fields
     db_reminder.contact_id = reminder.contact_id
     db_reminder.reminder_type = reminder.reminder_type or 'recurring'
     db_reminder.interval_type = reminder.interval_type
     db_reminder.interval_value = reminder.interval_value
     db_reminder.scheduled_datetime = reminder.scheduled_datetime
-    db_reminder.weekdays = weekdays_json
+    db_reminder.weekday_mask = trigger_engine.weekdays_to_mask(reminder.weekdays) or None
+    db_reminder.time_minutes = trigger_engine.parse_time(reminder.specific_time)
+    db_reminder.weekdays = json.dumps(reminder.weekdays) if reminder.weekdays else None  # legacy columns, for rollback
     db_reminder.specific_time = reminder.specific_time
-    db_reminder.timezone = reminder.timezone
+    db_reminder.timezone = user_timezone
     db_reminder.next_trigger = next_trigger
     db_reminder.enabled = reminder.enabled if reminder.enabled is not None else True
+    sync_service.touch(db, user_id, db_reminder)
     
     db.commit()
     db.refresh(db_reminder)
     
     print(f"✅ [DATABASE] Updated reminder {reminder_id} for user {user_id}")
     
-    # Parse weekdays for response
-    weekdays_parsed = None
-    if db_reminder.weekdays:
-        try:
-            weekdays_parsed = json.loads(db_reminder.weekdays)
-        except (json.JSONDecodeError, TypeError):
-            weekdays_parsed = None
-    
-    # Convert SQLAlchemy model to Pydantic model
-    return Reminder(
-        id=db_reminder.id,
-        user_id=db_reminder.user_id,
-        contact_id=db_reminder.contact_id,
-        reminder_type=db_reminder.reminder_type or 'recurring',
-        interval_type=db_reminder.interval_type,
-        interval_value=db_reminder.interval_value,
-        scheduled_datetime=db_reminder.scheduled_datetime,
-        weekdays=weekdays_parsed,
-        specific_time=db_reminder.specific_time,
-        one_time_triggered=db_reminder.one_time_triggered or False,
-        last_triggered=db_reminder.last_triggered,
-        next_trigger=db_reminder.next_trigger,
-        enabled=db_reminder.enabled,
-        created_at=db_reminder.created_at
-    )
+    return reminder_to_model(db_reminder)
 
 @app.delete("/api/reminders/{reminder_id}")
 async def delete_reminder(
@@ -962,6 +843,7 @@ async def delete_reminder(
     
     # Delete reminder
     db.delete(db_reminder)
+    sync_service.record_deletes(db, user_id, 'reminder', [reminder_id])
     db.commit()
     
     print(f"✅ [DATABASE] Deleted reminder {reminder_id} for user {user_id}")
@@ -975,6 +857,39 @@ async def delete_reminder(
 #   - GET /api/notification-settings (get platform preference)
 #   - PUT /api/notification-settings (update platform preference)
 
+# ========== SYNC ENDPOINT ==========
+
+@app.get("/api/sync")
+async def sync_changes(
+    since: Optional[int] = None,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    סנכרון דלתא של אנשי קשר והתראות: רק מה שנוסף, השתנה או נמחק מאז הגרסה since.
+    ללא since (או full=true בתשובה) - תמונת מצב מלאה. שמרו את version לבקשה הבאה.
+    """
+    user_id = current_user["user_id"]
+    changes = sync_service.get_changes(db, user_id, since)
+    
+    # Decrypt only the contacts that changed
+    contacts = changes['contacts']
+    names = decrypt_many([c.name_encrypted for c in contacts])
+    return {
+        "version": changes['version'],
+        "full": changes['full'],
+        "contacts": [Contact(
+            id=c.id,
+            user_id=c.user_id,
+            name=name,
+            default_tone=c.default_tone,
+            created_at=c.created_at
+        ) for c, name in zip(contacts, names)],
+        "reminders": [reminder_to_model(r) for r in changes['reminders']],
+        "deleted_contacts": changes['deleted_contacts'],
+        "deleted_reminders": changes['deleted_reminders']
+    }
+
 # ========== REMINDERS CHECK ENDPOINT ==========
 # NOTE: This endpoint is now defined above, before /api/reminders/{reminder_id}
 # to prevent FastAPI from matching "check" as a reminder_id parameter
@@ -1203,22 +1118,36 @@ async def verify_subscription(
 
 @app.get("/api/subscription/status")
 async def get_subscription_status(
+    request: Request,
+    response: Response,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """קבלת סטטוס מנוי נוכחי"""
     user_id = current_user["user_id"]
     
-    from subscription_service import get_active_subscription, get_prices, is_launch_pricing_active
-    from usage_limiter import get_user_subscription_status, get_trial_days_remaining
+    from subscription_service import get_active_subscription, get_prices, is_launch_pricing_active, get_subscription_fingerprint
+    from usage_limiter import get_usage_snapshot
     
-    status = get_user_subscription_status(db, user_id)
+    # Validator: status/trial days (cached entitlement snapshot), subscription rows, and the settings content (prices)
+    snapshot = get_usage_snapshot(db, user_id)
+    resource_etag = etag.make_etag(
+        'subscription_status', user_id,
+        snapshot and (snapshot['status'], snapshot['trial_days_remaining']),
+        get_subscription_fingerprint(db, user_id),
+        settings_service.get_fingerprint(db)
+    )
+    if etag.is_not_modified(request, 'subscription_status', resource_etag):
+        return etag.not_modified(resource_etag)
+    etag.set_etag(response, resource_etag)
+    
+    status = snapshot['status'] if snapshot else 'free'
     subscription = get_active_subscription(db, user_id)
     prices = get_prices(db)
     
     return {
         "status": status,
-        "trial_days_remaining": get_trial_days_remaining(db, user_id) if status == 'trial' else 0,
+        "trial_days_remaining": snapshot['trial_days_remaining'] if status == 'trial' else 0,
         "subscription": {
             "id": subscription.id if subscription else None,
             "plan_type": subscription.plan_type if subscription else None,
@@ -1359,62 +1288,30 @@ async def get_admin_stats(
     if not is_admin(db, user_id):
         raise HTTPException(status_code=403, detail="אין הרשאת מנהל")
     
-    from sqlalchemy import func
-    from models import UsageStats, Subscription, AppSettings
-    from datetime import date, timedelta
+    from datetime import timedelta
     
-    today = date.today()
+    # One rollup row per day (see metrics_rollup) instead of aggregating the live tables
+    today = metrics_rollup.utc_today()
     first_day_of_month = today.replace(day=1)
     week_ago = today - timedelta(days=7)
+    thirty_days_ago = today - timedelta(days=30)
+    
+    days = metrics_rollup.get_days(db, min(first_day_of_month, thirty_days_ago))
+    latest = days[-1]
     
-    # Total users
-    total_users = db.query(func.count(User.id)).scalar() or 0
-    
-    # New users this month
-    new_users_month = db.query(func.count(User.id)).filter(
-        func.date(User.created_at) >= first_day_of_month
-    ).scalar() or 0
-    
-    # New users this week
-    new_users_week = db.query(func.count(User.id)).filter(
-        func.date(User.created_at) >= week_ago
-    ).scalar() or 0
-    
-    # Premium users
-    premium_users = db.query(func.count(User.id)).filter(
-        User.subscription_status == 'premium'
-    ).scalar() or 0
-    
-    # Trial users
-    trial_users = db.query(func.count(User.id)).filter(
-        User.subscription_status == 'trial'
-    ).scalar() or 0
-    
-    # Messages today
-    messages_today = db.query(func.sum(UsageStats.messages_generated)).filter(
-        UsageStats.date == today
-    ).scalar() or 0
-    
-    # Messages this month
-    messages_month = db.query(func.sum(UsageStats.messages_generated)).filter(
-        UsageStats.date >= first_day_of_month
-    ).scalar() or 0
-    
-    # Active subscriptions
-    active_subscriptions = db.query(func.count(Subscription.id)).filter(
-        Subscription.status == 'active'
-    ).scalar() or 0
-    
-    # Revenue estimate (active subscriptions * average price)
-    monthly_subs = db.query(func.count(Subscription.id)).filter(
-        Subscription.status == 'active',
-        Subscription.plan_type == 'monthly'
-    ).scalar() or 0
-    
-    yearly_subs = db.query(func.count(Subscription.id)).filter(
-        Subscription.status == 'active',
-        Subscription.plan_type == 'yearly'
-    ).scalar() or 0
+    # Snapshot counts from today's row
+    total_users = latest.users_total or 0
+    premium_users = latest.premium_users or 0
+    trial_users = latest.trial_users or 0
+    active_subscriptions = latest.active_subscriptions or 0
+    monthly_subs = latest.monthly_subscriptions or 0
+    yearly_subs = latest.yearly_subscriptions or 0
+    
+    # Event counters summed over the period
+    new_users_month = sum(day.signups for day in days if day.day >= first_day_of_month)
+    new_users_week = sum(day.signups for day in days if day.day >= week_ago)
+    messages_today = latest.messages
+    messages_month = sum(day.messages for day in days if day.day >= first_day_of_month)
     
     # Get prices from settings
     from usage_limiter import get_setting
@@ -1424,17 +1321,9 @@ async def get_admin_stats(
     monthly_revenue = (monthly_subs * monthly_price) + (yearly_subs * yearly_price / 12)
     
     # Daily messages for last 30 days (for chart)
-    thirty_days_ago = today - timedelta(days=30)
-    daily_stats = db.query(
-        UsageStats.date,
-        func.sum(UsageStats.messages_generated).label('total')
-    ).filter(
-        UsageStats.date >= thirty_days_ago
-    ).group_by(UsageStats.date).order_by(UsageStats.date).all()
-    
     daily_messages = [
-        {"date": str(stat.date), "messages": stat.total}
-        for stat in daily_stats
+        {"date": str(day.day), "messages": day.messages}
+        for day in days if day.day >= thirty_days_ago and day.messages
     ]
     
     return {
@@ -1464,6 +1353,35 @@ async def get_admin_stats(
         }
     }
 
+@app.get("/api/admin/metrics")
+async def get_admin_metrics(
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """מדדי ביצועים של ה-worker הנוכחי (Admin only)"""
+    user_id = current_user["user_id"]
+    
+    if not is_admin(db, user_id):
+        raise HTTPException(status_code=403, detail="אין הרשאת מנהל")
+    
+    return {
+        "llm": llm_client.get_metrics(),
+        "message_cache": message_cache.get_metrics(),
+        "message_pool": message_pool.get_metrics(),
+        "settings": settings_service.get_metrics(),
+        "usage_buffer": usage_buffer.get_metrics(),
+        "auth_principals": get_principal_cache_metrics(),
+        "password_hashing": get_password_pool_metrics(),
+        "decrypt_cache": get_decrypt_cache_metrics(),
+        "reminder_scheduler": reminder_scheduler.get_metrics(),
+        "reminder_stream": reminder_broker.get_metrics(),
+        "sync": sync_service.get_metrics(),
+        "etag": etag.get_metrics(),
+        "metrics_rollup": metrics_rollup.get_metrics(),
+        "expiry_sweeper": expiry_sweeper.get_metrics(),
+        "entitlements": entitlements.get_metrics()
+    }
+
 @app.get("/api/admin/settings")
 async def get_admin_settings(
     current_user: dict = Depends(get_current_user),
@@ -1493,6 +1411,7 @@ class SettingUpdate(BaseModel):
 @app.put("/api/admin/settings")
 async def update_admin_setting(
     setting: SettingUpdate,
+    background_tasks: BackgroundTasks,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -1504,6 +1423,10 @@ async def update_admin_setting(
 
     from models import AppSettings
 
+    # Trial length is baked into users.trial_ends_at - recompute it for everyone
+    if setting.key == 'trial_days' and settings_service.get(db, 'trial_days') != setting.value:
+        background_tasks.add_task(entitlements.run_recompute)
+
     db_setting = db.query(AppSettings).filter(AppSettings.key == setting.key).first()
 
     if not db_setting:
@@ -1516,12 +1439,14 @@ async def update_admin_setting(
         )
         db.add(db_setting)
         db.commit()
+        settings_service.publish_change(db)
         print(f"✅ [ADMIN] Setting '{setting.key}' created with value '{setting.value}' by user {user_id}")
         return {"message": "הגדרה נוצרה בהצלחה", "key": setting.key, "value": setting.value}
 
     # Setting exists - update it
     db_setting.value = setting.value
     db.commit()
+    settings_service.publish_change(db)
 
     print(f"✅ [ADMIN] Setting '{setting.key}' updated to '{setting.value}' by user {user_id}")
 
@@ -1558,23 +1483,33 @@ async def add_admin_email(
         if db_setting:
             db_setting.value = json.dumps(admin_emails)
             db.commit()
+            settings_service.publish_change(db)
             print(f"✅ [ADMIN] Added admin email: {email}")
     
     return {"message": "מייל מנהל נוסף", "admin_emails": admin_emails}
 
 @app.get("/api/admin/support/tickets", response_model=List[SupportTicketResponse])
 async def get_admin_support_tickets(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    """קבלת כל פניות התמיכה (Admin only)"""
+    """קבלת פניות התמיכה, החדשות קודם, בעמודים (Admin only)"""
     user_id = current_user["user_id"]
     
     if not is_admin(db, user_id):
         raise HTTPException(status_code=403, detail="אין הרשאת מנהל")
     
     from models import SupportTicket
-    return db.query(SupportTicket).order_by(SupportTicket.created_at.desc()).all()
+    include = parse_fields(fields, SupportTicketResponse.model_fields)
+    tickets, next_cursor = paginate(
+        db.query(SupportTicket), SupportTicket, cursor, limit, descending=True
+    )
+    return page_response(
+        [SupportTicketResponse.model_validate(t) for t in tickets], next_cursor, include
+    )
 
 @app.put("/api/admin/support/tickets/{ticket_id}/status")
 async def update_ticket_status(
@@ -1626,6 +1561,8 @@ async def delete_support_ticket(
 
 @app.get("/api/usage/status")
 async def get_usage_status(
+    request: Request,
+    response: Response,
     current_user: dict = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -1635,18 +1572,29 @@ async def get_usage_status(
     from usage_limiter import (
         check_can_generate_message, 
         check_can_add_contact,
-        get_user_subscription_status,
-        get_trial_days_remaining,
-        get_daily_usage,
-        get_monthly_usage,
-        get_setting_int,
+        get_usage_snapshot,
         start_trial
     )
     
+    # The cached entitlement snapshot serves every check below
+    snapshot = get_usage_snapshot(db, user_id)
+    
     # התחל trial אם זו הפעם הראשונה
-    start_trial(db, user_id)
+    if snapshot and snapshot['trial_ends_at'] is None and start_trial(db, user_id):
+        snapshot = get_usage_snapshot(db, user_id)
+    
+    # Validator: the entitlement snapshot (status, counters), the contact list version and the settings content
+    resource_etag = etag.make_etag(
+        'usage_status', user_id,
+        dict(snapshot) if snapshot else None,
+        sync_service.get_current_version(db, user_id),
+        settings_service.get_fingerprint(db)
+    )
+    if etag.is_not_modified(request, 'usage_status', resource_etag):
+        return etag.not_modified(resource_etag)
+    etag.set_etag(response, resource_etag)
     
-    status = get_user_subscription_status(db, user_id)
+    status = snapshot['status'] if snapshot else 'free'
     _, message_info = check_can_generate_message(db, user_id)
     _, contact_info = check_can_add_contact(db, user_id)
     
@@ -1659,7 +1607,7 @@ async def get_usage_status(
         "subscription_status": status,
         "ads_enabled": ads_enabled,
         "donation_enabled": donation_enabled,
-        "trial_days_remaining": get_trial_days_remaining(db, user_id) if status == 'trial' else 0,
+        "trial_days_remaining": snapshot['trial_days_remaining'] if status == 'trial' else 0,
         "messages": {
             "daily_used": message_info.get('daily_used', 0),
             "daily_limit": message_info.get('daily_limit'),
@@ -1708,22 +1656,100 @@ async def redeem_rewarded_video(
 
 # ========== MESSAGES ENDPOINTS ==========
 
-@app.post("/api/messages/generate")
-async def generate_message(
-    request: MessageRequest,
-    current_user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """יצירת הודעה מותאמת אישית באמצעות AI"""
-    user_id = current_user["user_id"]
+MESSAGE_SYSTEM_PROMPT = "אתה עוזר אישי ליצירת הודעות חמות ואישיות בעברית."
+
+# Translate message type to Hebrew for better AI understanding
+MESSAGE_TYPES_HEBREW = {
+    'custom': 'מותאם אישית',
+    'checkin': 'בודק איך אתה',
+    'birthday': 'יום הולדת',
+    'holiday': 'חג',
+    'congratulations': 'ברכות',
+    'thank_you': 'תודה',
+    'apology': 'התנצלות',
+    'support': 'תמיכה ועידוד',
+    'invitation': 'הזמנה',
+    'thinking_of_you': 'חושב עליך',
+    'anniversary': 'יום נישואים/יום שנה',
+    'get_well': 'החלמה מהירה',
+    'new_job': 'ברכות על עבודה חדשה',
+    'graduation': 'סיום לימודים',
+    'achievement': 'ברכה על הישג',
+    'encouragement': 'עידוד',
+    'condolences': 'ניחומים',
+    'farewell': 'פרידה',
+    'new_beginning': 'התחלה חדשה',
+    'special_thanks': 'תודה מיוחדת',
+    'moving': 'ברכה על מעבר דירה',
+    'wedding': 'ברכה על נישואים',
+    'pregnancy': 'ברכה על היריון',
+    'birth': 'ברכה על לידה',
+    'promotion': 'ברכה על קידום',
+    'retirement': 'ברכה על פרישה',
+    'reunion': 'ברכה על מפגש',
+    'appreciation': 'הערכה',
+    'miss_you': 'מתגעגע',
+    'good_luck': 'מזל טוב',
+    'celebration': 'ברכה על חגיגה'
+}
+
+# Translate language to Hebrew name for the prompt
+LANGUAGE_NAMES_HEBREW = {
+    'he': 'עברית',
+    'en': 'אנגלית',
+    'ru': 'רוסית',
+    'ar': 'ערבית',
+    'fr': 'צרפתית',
+    'es': 'ספרדית'
+}
+
+def build_message_prompt(request: MessageRequest, contact_name: str, tone: str) -> str:
+    """
+    בונה את ה-prompt ליצירת הודעה
     
-    # בדיקת הגבלות שימוש (Paywall)
-    from usage_limiter import check_can_generate_message, record_message_usage, start_trial
+    When contact_name is the cache placeholder, the model is asked to keep it
+    verbatim so the result can be reused for any contact.
+    """
+    message_type_hebrew = MESSAGE_TYPES_HEBREW.get(request.message_type, request.message_type)
+    language_name = LANGUAGE_NAMES_HEBREW.get(request.language, 'עברית')
+    
+    prompt = f"""צור הודעה ב{language_name} מסוג {message_type_hebrew} עבור {contact_name}.
+טון: {tone}
+"""
+    if request.additional_context:
+        prompt += f"הקשר נוסף: {request.additional_context}\n"
+    
+    prompt += "\nהודעה קצרה, חמה ואישית."
+    if contact_name == message_cache.NAME_PLACEHOLDER:
+        prompt += f"\nכתוב {message_cache.NAME_PLACEHOLDER} בדיוק כך בכל מקום שבו מופיע שם הנמען."
+    return prompt
+
+def build_pool_messages(message_type: str, tone: str, language: str) -> list:
+    """בונה את ההודעות ל-API עבור מועמד ב-pool (עם placeholder לשם)"""
+    request = MessageRequest(contact_id=0, message_type=message_type, tone=tone, language=language)
+    return [
+        {
+            "role": "system",
+            "content": MESSAGE_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": build_message_prompt(request, message_cache.NAME_PLACEHOLDER, tone)
+        }
+    ]
+
+def prepare_message_generation(request: MessageRequest, user_id: str, db: Session) -> dict:
+    """
+    בדיקות Paywall, טעינת איש הקשר ובניית ה-prompt ליצירת הודעה
+    
+    ההודעה נספרת כבר כאן (בדיקת מכסה + ספירה אטומית). אם היצירה נכשלת יש לקרוא ל-release_message_usage.
+    """
+    from usage_limiter import reserve_message_usage, release_message_usage, start_trial
     
     # התחל trial אם זו הפעם הראשונה
     start_trial(db, user_id)
     
-    can_generate, usage_info = check_can_generate_message(db, user_id)
+    can_generate, usage_info = reserve_message_usage(db, user_id)
     if not can_generate:
         # Return 402 Payment Required with usage info
         raise HTTPException(
@@ -1742,120 +1768,98 @@ async def generate_message(
     # בדיקה שאיש הקשר קיים ושייך למשתמש
     contact = get_contact_by_id(db, request.contact_id, user_id)
     if not contact:
+        release_message_usage(db, user_id)
         raise HTTPException(status_code=404, detail="איש קשר לא נמצא")
     
     # Decrypt contact name for display
     contact_name = decrypt(contact.name_encrypted)
     
-    # קבלת מפתח API
-    api_key = os.getenv("XAI_API_KEY") or os.getenv("GROQ_API_KEY")
-    if not api_key:
-        raise HTTPException(status_code=500, detail="מפתח API לא מוגדר. אנא הגדר XAI_API_KEY או GROQ_API_KEY בקובץ .env")
-    
     # בניית ה-prompt
     # Use contact's default tone if no tone specified in request
     tone = request.tone or contact.default_tone or 'friendly'
     
-    # Translate message type to Hebrew for better AI understanding
-    message_type_hebrew = {
-        'custom': 'מותאם אישית',
-        'checkin': 'בודק איך אתה',
-        'birthday': 'יום הולדת',
-        'holiday': 'חג',
-        'congratulations': 'ברכות',
-        'thank_you': 'תודה',
-        'apology': 'התנצלות',
-        'support': 'תמיכה ועידוד',
-        'invitation': 'הזמנה',
-        'thinking_of_you': 'חושב עליך',
-        'anniversary': 'יום נישואים/יום שנה',
-        'get_well': 'החלמה מהירה',
-        'new_job': 'ברכות על עבודה חדשה',
-        'graduation': 'סיום לימודים',
-        'achievement': 'ברכה על הישג',
-        'encouragement': 'עידוד',
-        'condolences': 'ניחומים',
-        'farewell': 'פרידה',
-        'new_beginning': 'התחלה חדשה',
-        'special_thanks': 'תודה מיוחדת',
-        'moving': 'ברכה על מעבר דירה',
-        'wedding': 'ברכה על נישואים',
-        'pregnancy': 'ברכה על היריון',
-        'birth': 'ברכה על לידה',
-        'promotion': 'ברכה על קידום',
-        'retirement': 'ברכה על פרישה',
-        'reunion': 'ברכה על מפגש',
-        'appreciation': 'הערכה',
-        'miss_you': 'מתגעגע',
-        'good_luck': 'מזל טוב',
-        'celebration': 'ברכה על חגיגה'
-    }.get(request.message_type, request.message_type)
-    
-    # Translate language to Hebrew name for the prompt
-    language_name = {
-        'he': 'עברית',
-        'en': 'אנגלית',
-        'ru': 'רוסית',
-        'ar': 'ערבית',
-        'fr': 'צרפתית',
-        'es': 'ספרדית'
-    }.get(request.language, 'עברית')
+    # Cache / pool: generate with a name placeholder so the result serves every contact
+    use_cache = message_cache.is_enabled(db)
+    # Pre-generated candidates exist only for requests without additional context
+    use_pool = not request.additional_context and message_pool.is_enabled(db)
+    if use_pool:
+        message_pool.record_request(request.message_type, tone, request.language)
+    
+    cache_key = None
+    if use_cache or use_pool:
+        cache_key = message_cache.make_cache_key(
+            request.message_type, tone, request.language, request.additional_context
+        )
+    # The placeholder is asked for only when a live result is stored for reuse (message cache);
+    # otherwise it goes to this user alone, so the prompt carries the real name
+    use_placeholder = use_cache
+    prompt_name = message_cache.NAME_PLACEHOLDER if use_placeholder else contact_name
     
-    prompt = f"""צור הודעה ב{language_name} מסוג {message_type_hebrew} עבור {contact_name}.
-טון: {tone}
-"""
-    if request.additional_context:
-        prompt += f"הקשר נוסף: {request.additional_context}\n"
+    return {
+        "contact_name": contact_name,
+        "tone": tone,
+        "usage_info": usage_info,
+        "cache_key": cache_key,
+        "use_cache": use_cache,
+        "use_pool": use_pool,
+        "use_placeholder": use_placeholder,
+        "messages": [
+            {
+                "role": "system",
+                "content": MESSAGE_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": build_message_prompt(request, prompt_name, tone)
+            }
+        ]
+    }
+
+def take_prepared_template(generation: dict, user_id: str, db: Session) -> Optional[str]:
+    """מחזיר הודעה שנוצרה מראש (pool) או מה-cache, אם יש"""
+    if generation["use_pool"]:
+        template = message_pool.pop(generation["cache_key"])
+        if template is not None:
+            return template
+    if generation["use_cache"]:
+        return message_cache.lookup(db, user_id, generation["cache_key"])
+    return None
+
+async def generate_message_text(request: MessageRequest, generation: dict, user_id: str, db: Session) -> str:
+    """מחזיר הודעה מה-cache אם יש, אחרת יוצר אותה ב-API"""
+    cache_key = generation["cache_key"]
+    if not cache_key:
+        return await llm_client.chat_completion(generation["messages"])
+    
+    template = take_prepared_template(generation, user_id, db)
+    if template is None:
+        generated = await llm_client.chat_completion(generation["messages"])
+        if not generation["use_placeholder"]:
+            return generated
+        template = generated
+        message_cache.store(db, cache_key, template, request.message_type, generation["tone"], request.language)
+    message_cache.remember(db, user_id, template)
+    return message_cache.render(template, generation["contact_name"])
+
+@app.post("/api/messages/generate")
+async def generate_message(
+    request: MessageRequest,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """יצירת הודעה מותאמת אישית באמצעות AI"""
+    user_id = current_user["user_id"]
     
-    prompt += "\nהודעה קצרה, חמה ואישית."
+    from usage_limiter import release_message_usage
+    
+    # השימוש נספר כבר ב-prepare_message_generation
+    generation = prepare_message_generation(request, user_id, db)
+    contact_name = generation["contact_name"]
+    usage_info = generation["usage_info"]
     
     try:
-        # קריאה ל-xAI API
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "grok-4-1-fast-reasoning",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "אתה עוזר אישי ליצירת הודעות חמות ואישיות בעברית."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            "temperature": 0.7,
-            "max_tokens": 500
-        }
-        
-        response = requests.post(
-            "https://api.x.ai/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            error_data = response.text
-            try:
-                error_json = response.json()
-                if isinstance(error_json, dict) and error_json.get("error"):
-                    error_data = str(error_json["error"])
-            except:
-                pass
-            
-            print(f"❌ xAI API error: {error_data}")
-            raise HTTPException(status_code=500, detail=f"שגיאה ביצירת הודעה: {error_data}")
-        
-        result = response.json()
-        message = result["choices"][0]["message"]["content"]
-        
-        # רישום שימוש (לאחר יצירה מוצלחת)
-        record_message_usage(db, user_id)
+        # קריאה ל-xAI API (async - לא חוסם את ה-event loop)
+        message = await generate_message_text(request, generation, user_id, db)
         
         return {
             "message": message,
@@ -1865,15 +1869,117 @@ async def generate_message(
             "usage": usage_info  # Include usage info in response
         }
         
-    except requests.exceptions.RequestException as e:
-        print(f"❌ שגיאת רשת: {e}")
-        raise HTTPException(status_code=500, detail=f"שגיאה בחיבור ל-API: {str(e)}")
+    except llm_client.LLMError as e:
+        print(f"❌ xAI API error: {e.detail}")
+        release_message_usage(db, user_id)
+        raise HTTPException(status_code=500, detail=f"שגיאה ביצירת הודעה: {e.detail}")
     except Exception as e:
+        release_message_usage(db, user_id)
         import traceback
         print(f"❌ שגיאה כללית: {e}")
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"שגיאה ביצירת הודעה: {str(e)}")
 
+def _sse_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    """מקודד אירוע Server-Sent Events"""
+    id_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{id_line}event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@app.post("/api/messages/generate/stream")
+async def generate_message_stream(
+    request: MessageRequest,
+    current_user: dict = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    יצירת הודעה עם הזרמת טוקנים (Server-Sent Events)
+    
+    Events: start -> token (repeated) -> done, or error
+    """
+    user_id = current_user["user_id"]
+    
+    from usage_limiter import release_message_usage
+    
+    # השימוש נספר כבר ב-prepare_message_generation, ומוחזר אם ההזרמה לא הושלמה
+    generation = prepare_message_generation(request, user_id, db)
+    contact_name = generation["contact_name"]
+    usage_info = generation["usage_info"]
+    
+    cache_key = generation["cache_key"]
+    cached_template = take_prepared_template(generation, user_id, db) if cache_key else None
+    
+    async def event_stream():
+        completed = False
+        try:
+            # שליחה מיידית כדי שהלקוח יקבל בייט ראשון בלי לחכות ל-API
+            yield _sse_event("start", {
+                "contact_name": contact_name,
+                "message_type": request.message_type,
+                "tone": request.tone
+            })
+            
+            template = cached_template
+            parts = []
+            if template is not None:
+                # Cache hit - the whole message as a single token
+                parts.append(message_cache.render(template, contact_name))
+                yield _sse_event("token", {"text": parts[0]})
+            else:
+                raw_parts = []
+                
+                async def upstream():
+                    async for delta in llm_client.stream_chat_completion(generation["messages"]):
+                        raw_parts.append(delta)
+                        yield delta
+                
+                source = upstream()
+                if generation["use_placeholder"]:
+                    source = message_cache.render_stream(source, contact_name)
+                try:
+                    async for text in source:
+                        parts.append(text)
+                        yield _sse_event("token", {"text": text})
+                except llm_client.LLMError as e:
+                    print(f"❌ xAI API stream error: {e.detail}")
+                    yield _sse_event("error", {"detail": f"שגיאה ביצירת הודעה: {e.detail}"})
+                    return
+                template = "".join(raw_parts)
+            
+            completed = True
+            if cached_template is not None or generation["use_placeholder"]:
+                stream_db = SessionLocal()
+                try:
+                    if cached_template is None:
+                        message_cache.store(stream_db, cache_key, template, request.message_type, generation["tone"], request.language)
+                    message_cache.remember(stream_db, user_id, template)
+                finally:
+                    stream_db.close()
+            
+            yield _sse_event("done", {
+                "message": "".join(parts),
+                "contact_name": contact_name,
+                "message_type": request.message_type,
+                "tone": request.tone,
+                "usage": usage_info
+            })
+        finally:
+            # ההודעה נספרה מראש - מחזירים אותה אם ההזרמה נכשלה או שהלקוח התנתק
+            if not completed:
+                release_db = SessionLocal()
+                try:
+                    release_message_usage(release_db, user_id)
+                finally:
+                    release_db.close()
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Disable proxy buffering
+        }
+    )
+
 # ========== ACCOUNT ENDPOINTS ==========
 
 @app.delete("/api/account")
@@ -1891,11 +1997,10 @@ async def delete_account(
         if not user:
             raise HTTPException(status_code=404, detail="משתמש לא נמצא")
         
-        # מחיקת push tokens
-        db.query(PushToken).filter(PushToken.user_id == user_id).delete()
-        
-        # מחיקת המשתמש (CASCADE ימחק contacts, reminders, subscriptions, usage_stats)
+        # מחיקת המשתמש (CASCADE ימחק contacts, reminders, subscriptions, usage_stats, push_tokens)
         db.delete(user)
+        # ה-tokens של המשתמש לא יאומתו יותר מה-cache (בכל ה-workers, עם ה-commit)
+        invalidate_user_principals(user_id, db)
         db.commit()
         
         print(f"✅ [ACCOUNT] User {user_id} account deleted successfully")
@@ -1914,7 +2019,7 @@ async def register(user_data: UserRegister, db: Session = Depends(get_db)):
     """רישום משתמש חדש"""
     print(f"🔵 [BACKEND] Registration request received: username={user_data.username}, email={user_data.email}")
     try:
-        user = register_user(user_data.username, user_data.email, user_data.password, db)
+        user = await register_user(user_data.username, user_data.email, user_data.password, db)
         print(f"✅ [BACKEND] User registered successfully: user_id={user['user_id']}")
         access_token = create_access_token(data={"sub": user["user_id"], "email": user["email"]})
         print(f"✅ [BACKEND] Access token created: token_length={len(access_token)}")
@@ -1937,7 +2042,7 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
     """התחברות עם שם משתמש וסיסמה"""
     print(f"🔵 [BACKEND] Login request received: username={user_data.username}")
     try:
-        user = authenticate_user(user_data.username, user_data.password, db)
+        user = await authenticate_user(user_data.username, user_data.password, db)
         if not user:
             print(f"❌ [BACKEND] Login failed: Invalid credentials for username={user_data.username}")
             raise HTTPException(status_code=400, detail="שם משתמש או סיסמה שגויים")
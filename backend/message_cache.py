@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Message Cache - Reuses generated messages for identical prompts
+
+Messages are generated with a name placeholder instead of the contact name,
+so one generated template can serve every contact. Templates are pooled per
+normalized (message_type, tone, language, additional_context) key. Only
+templates that address the recipient through the placeholder are reused; a
+completion that dropped or mangled it is served once and not cached.
+"""
+
+import re
+import random
+import hashlib
+from collections import deque
+from datetime import timedelta
+from typing import Optional, List, Dict, Any
+from sqlalchemy.orm import Session
+
+from models import MessageTemplate
+from ttl_cache import TTLCache
+from usage_limiter import get_setting_bool, get_setting_int, utc_now
+
+
+NAME_PLACEHOLDER = "{{NAME}}"
+# Leftover braces after removing the exact placeholder: "{{Name}}", "{NAME}", "{{ NAME }}", ...
+_MANGLED_PLACEHOLDER = re.compile(r"[{}]")
+
+# Per-worker in-memory pools: cache_key -> list of templates
+_pools = TTLCache(maxsize=2000, ttl=24 * 3600)
+
+# Recently served templates per user (for the "don't repeat" rule)
+_recent = TTLCache(maxsize=10000, ttl=7 * 24 * 3600)
+
+_metrics = {
+    'hits': 0,
+    'misses': 0,
+    'stored': 0,
+    'rejected': 0,
+}
+
+
+def is_enabled(db: Session) -> bool:
+    """Admin switch (app_settings: message_cache_enabled)"""
+    return get_setting_bool(db, 'message_cache_enabled', False)
+
+
+def _normalize(value: Optional[str]) -> str:
+    return re.sub(r"\s+", " ", (value or "").strip().lower())
+
+
+def make_cache_key(message_type: str, tone: str, language: str, additional_context: Optional[str] = None) -> str:
+    """Build the cache key from the normalized prompt parameters"""
+    normalized = "|".join([
+        _normalize(message_type),
+        _normalize(tone),
+        _normalize(language),
+        _normalize(additional_context),
+    ])
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def _template_id(template: str) -> str:
+    return hashlib.sha256(template.encode('utf-8')).hexdigest()[:16]
+
+
+def is_reusable(template: str) -> bool:
+    """True if the template names the recipient only through the exact placeholder"""
+    if NAME_PLACEHOLDER not in template:
+        return False
+    return not _MANGLED_PLACEHOLDER.search(template.replace(NAME_PLACEHOLDER, ""))
+
+
+def render(template: str, contact_name: str) -> str:
+    """Slot the contact name into a cached template"""
+    return template.replace(NAME_PLACEHOLDER, contact_name)
+
+
+def _load_shared_pool(db: Session, cache_key: str, pool_size: int, ttl_hours: int) -> List[str]:
+    """Load the newest templates for a key from the shared table"""
+    rows = db.query(MessageTemplate.template).filter(
+        MessageTemplate.cache_key == cache_key,
+        MessageTemplate.created_at >= utc_now() - timedelta(hours=ttl_hours)
+    ).order_by(MessageTemplate.created_at.desc()).limit(pool_size).all()
+    return [row.template for row in rows if is_reusable(row.template)]
+
+
+def _get_pool(db: Session, cache_key: str) -> List[str]:
+    pool = _pools.get(cache_key)
+    if pool is None:
+        pool = []
+        if get_setting_bool(db, 'message_cache_shared', False):
+            pool = _load_shared_pool(
+                db,
+                cache_key,
+                get_setting_int(db, 'message_cache_pool_size', 5),
+                get_setting_int(db, 'message_cache_ttl_hours', 24)
+            )
+        _pools.set(cache_key, pool, ttl=get_setting_int(db, 'message_cache_ttl_hours', 24) * 3600)
+    return pool
+
+
+def lookup(db: Session, user_id: str, cache_key: str) -> Optional[str]:
+    """
+    Return a cached template for the key, or None on a miss.
+
+    The pool is filled up to `message_cache_pool_size` candidates before it
+    starts serving, so users get varied messages. Templates among the user's
+    last `message_cache_no_repeat` messages are skipped.
+    """
+    pool = _get_pool(db, cache_key)
+    pool_size = get_setting_int(db, 'message_cache_pool_size', 5)
+
+    if len(pool) >= pool_size:
+        recent = _recent.get(user_id) or ()
+        candidates = [t for t in pool if _template_id(t) not in recent]
+        if candidates:
+            _metrics['hits'] += 1
+            return random.choice(candidates)
+
+    _metrics['misses'] += 1
+    return None
+
+
+def store(db: Session, cache_key: str, template: str, message_type: str, tone: str, language: str) -> None:
+    """
+    Add a freshly generated template to the pool (and the shared table if
+    enabled). Templates without the name placeholder are not cached.
+    """
+    if not is_reusable(template):
+        _metrics['rejected'] += 1
+        print("⚠️ [MSG CACHE] Generated template has no usable name placeholder, not caching")
+        return
+    pool_size = get_setting_int(db, 'message_cache_pool_size', 5)
+    pool = _get_pool(db, cache_key)
+    pool.append(template)
+    if len(pool) > pool_size:
+        del pool[:len(pool) - pool_size]
+    _metrics['stored'] += 1
+
+    if get_setting_bool(db, 'message_cache_shared', False):
+        try:
+            db.add(MessageTemplate(
+                cache_key=cache_key,
+                message_type=message_type,
+                tone=tone,
+                language=language,
+                template=template
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ [MSG CACHE] Error storing shared template: {e}")
+
+
+def remember(db: Session, user_id: str, template: str) -> None:
+    """Record a template served to a user (for the don't-repeat rule)"""
+    no_repeat = get_setting_int(db, 'message_cache_no_repeat', 5)
+    recent = _recent.get(user_id)
+    if recent is None or recent.maxlen != no_repeat:
+        recent = deque(recent or (), maxlen=no_repeat)
+        _recent.set(user_id, recent)
+    recent.append(_template_id(template))
+
+
+def clear() -> None:
+    """Drop all in-memory pools"""
+    _pools.clear()
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Return hit/miss counters"""
+    lookups = _metrics['hits'] + _metrics['misses']
+    return {
+        **_metrics,
+        'hit_rate': round(_metrics['hits'] / lookups, 3) if lookups else None,
+        'pools': len(_pools),
+    }
+
+
+async def render_stream(deltas, contact_name: str):
+    """
+    Slot the contact name into a streamed template.
+
+    A trailing fragment that may be the start of a placeholder split across
+    chunks is held back until the next chunk arrives.
+    """
+    pending = ""
+    async for delta in deltas:
+        pending = (pending + delta).replace(NAME_PLACEHOLDER, contact_name)
+        hold = 0
+        for i in range(1, len(NAME_PLACEHOLDER)):
+            if pending.endswith(NAME_PLACEHOLDER[:i]):
+                hold = i
+        if len(pending) > hold:
+            yield pending[:len(pending) - hold]
+            pending = pending[len(pending) - hold:]
+    if pending:
+        yield pending
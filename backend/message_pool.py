@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Message Pool - Pre-generated message candidates for popular combinations
+
+A background worker keeps up to `message_pool_size` single-use templates
+ready for the most requested (message_type, tone, language) combinations,
+so common generations are served without waiting for the API. Request
+counts are kept in memory and written in one upsert at the start of each
+refill round (and on shutdown), so the request path does not write.
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from datetime import date, timedelta
+from typing import Optional, Dict, Any, List, Callable, Tuple
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+import llm_client
+from database import SessionLocal
+from models import MessageComboStats, MessagePoolBudget
+from message_cache import make_cache_key, is_reusable
+from usage_limiter import get_setting_bool, get_setting_int
+
+
+# Worker timing (per worker) and upstream budget (shared by all workers, see try_acquire_budget)
+POOL_REFILL_INTERVAL_SECONDS = float(os.getenv("MESSAGE_POOL_REFILL_INTERVAL_SECONDS", "60"))
+POOL_RATE_PER_MINUTE = float(os.getenv("MESSAGE_POOL_RATE_PER_MINUTE", "30"))
+POOL_TEMPLATE_TTL_SECONDS = float(os.getenv("MESSAGE_POOL_TEMPLATE_TTL_SECONDS", str(6 * 3600)))
+# Refill only while live generations in flight are at or below this number
+POOL_QUIET_IN_FLIGHT = int(os.getenv("MESSAGE_POOL_QUIET_IN_FLIGHT", "2"))
+POOL_STATS_DAYS = 7
+
+# cache_key -> deque of (created_at monotonic, template)
+_pools: Dict[str, deque] = {}
+# (date, message_type, tone, language) -> requests not yet written to message_combo_stats
+_pending_requests: Dict[Tuple[date, str, str, str], int] = {}
+_requests_lock = threading.Lock()
+_worker_task: Optional[asyncio.Task] = None
+
+_metrics = {
+    'hits': 0,
+    'misses': 0,
+    'generated': 0,
+    'expired': 0,
+    'skipped_busy': 0,
+    'skipped_budget': 0,
+    'rejected': 0,
+}
+
+
+def try_acquire_budget() -> bool:
+    """
+    Take one upstream call from the budget shared by all workers (a token
+    bucket row refilled at POOL_RATE_PER_MINUTE). False when it is used up.
+    """
+    capacity = max(1.0, POOL_RATE_PER_MINUTE)
+    rate = POOL_RATE_PER_MINUTE / 60.0
+    budget = MessagePoolBudget.__table__
+    stmt = insert(budget).values(id=1, tokens=capacity - 1, updated_at=func.now())
+    # Tokens after refilling for the time since the last call (row-locked, so concurrent workers serialize)
+    available = func.least(
+        capacity,
+        budget.c.tokens + func.extract('epoch', func.now() - budget.c.updated_at) * rate
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[budget.c.id],
+        set_={'tokens': available - 1, 'updated_at': func.now()},
+        where=available >= 1
+    ).returning(budget.c.tokens)
+
+    db = SessionLocal()
+    try:
+        acquired = db.execute(stmt).first() is not None
+        db.commit()
+        return acquired
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ [MSG POOL] Error reading the rate budget: {e}")
+        return False
+    finally:
+        db.close()
+
+
+def is_enabled(db: Session) -> bool:
+    """Admin switch (app_settings: message_pool_enabled)"""
+    return get_setting_bool(db, 'message_pool_enabled', False)
+
+
+def record_request(message_type: str, tone: str, language: str) -> None:
+    """Count a generation request for its combination (feeds the worker's popularity ranking)"""
+    key = (date.today(), message_type, tone, language)
+    with _requests_lock:
+        _pending_requests[key] = _pending_requests.get(key, 0) + 1
+
+
+def flush_requests() -> int:
+    """Write the buffered request counts in one upsert. Returns the number of requests written."""
+    global _pending_requests
+    with _requests_lock:
+        batch, _pending_requests = _pending_requests, {}
+    if not batch:
+        return 0
+
+    stmt = insert(MessageComboStats).values([
+        {'date': day, 'message_type': message_type, 'tone': tone, 'language': language, 'requests': requests}
+        for (day, message_type, tone, language), requests in batch.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        constraint='uq_message_combo_stats',
+        set_={'requests': MessageComboStats.requests + stmt.excluded.requests}
+    )
+    db = SessionLocal()
+    try:
+        db.execute(stmt)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        # Keep the counts for the next round
+        with _requests_lock:
+            for key, requests in batch.items():
+                _pending_requests[key] = _pending_requests.get(key, 0) + requests
+        print(f"⚠️ [MSG POOL] Error recording combo requests, will retry: {e}")
+        return 0
+    finally:
+        db.close()
+    return sum(batch.values())
+
+
+def pop(cache_key: str) -> Optional[str]:
+    """Take a pre-generated template for the key, or None on a miss"""
+    pool = _pools.get(cache_key)
+    now = time.monotonic()
+    while pool:
+        created_at, template = pool.popleft()
+        if now - created_at <= POOL_TEMPLATE_TTL_SECONDS:
+            _metrics['hits'] += 1
+            return template
+        _metrics['expired'] += 1
+    _metrics['misses'] += 1
+    return None
+
+
+def _drain_expired() -> None:
+    now = time.monotonic()
+    for pool in _pools.values():
+        while pool and now - pool[0][0] > POOL_TEMPLATE_TTL_SECONDS:
+            pool.popleft()
+            _metrics['expired'] += 1
+
+
+def _load_plan() -> Tuple[bool, int, List[Tuple[str, str, str]]]:
+    """Read the switch, pool size and the most popular combinations"""
+    # This worker's counts go in first; other workers' arrive with their own refill rounds
+    flush_requests()
+    db = SessionLocal()
+    try:
+        if not is_enabled(db):
+            return False, 0, []
+        pool_size = get_setting_int(db, 'message_pool_size', 5)
+        max_combos = get_setting_int(db, 'message_pool_combos', 20)
+        since = date.today() - timedelta(days=POOL_STATS_DAYS)
+        rows = db.query(
+            MessageComboStats.message_type,
+            MessageComboStats.tone,
+            MessageComboStats.language
+        ).filter(
+            MessageComboStats.date >= since
+        ).group_by(
+            MessageComboStats.message_type,
+            MessageComboStats.tone,
+            MessageComboStats.language
+        ).order_by(func.sum(MessageComboStats.requests).desc()).limit(max_combos).all()
+        return True, pool_size, [(r.message_type, r.tone, r.language) for r in rows]
+    finally:
+        db.close()
+
+
+async def refill_once(build_messages: Callable[[str, str, str], List[Dict[str, str]]]) -> int:
+    """
+    Run one refill round. Returns the number of templates generated.
+
+    Stops early when the upstream budget is used up or live traffic picks up.
+    """
+    _drain_expired()
+    enabled, pool_size, combos = await asyncio.to_thread(_load_plan)
+    if not enabled:
+        _pools.clear()
+        return 0
+
+    generated = 0
+    for message_type, tone, language in combos:
+        cache_key = make_cache_key(message_type, tone, language)
+        pool = _pools.setdefault(cache_key, deque())
+        while len(pool) < pool_size:
+            if llm_client.get_metrics()['in_flight'] > POOL_QUIET_IN_FLIGHT:
+                _metrics['skipped_busy'] += 1
+                return generated
+            if not await asyncio.to_thread(try_acquire_budget):
+                _metrics['skipped_budget'] += 1
+                return generated
+            try:
+                template = await llm_client.chat_completion(build_messages(message_type, tone, language))
+            except llm_client.LLMError as e:
+                print(f"⚠️ [MSG POOL] Generation failed for {message_type}/{tone}/{language}: {e.detail}")
+                return generated
+            if not is_reusable(template):
+                # Served to whichever contact pops it - must carry the placeholder
+                _metrics['rejected'] += 1
+                continue
+            pool.append((time.monotonic(), template))
+            generated += 1
+            _metrics['generated'] += 1
+    return generated
+
+
+async def _worker_loop(build_messages: Callable[[str, str, str], List[Dict[str, str]]]) -> None:
+    while True:
+        try:
+            generated = await refill_once(build_messages)
+            if generated:
+                print(f"✅ [MSG POOL] Generated {generated} pooled messages")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ [MSG POOL] Refill error: {e}")
+        await asyncio.sleep(POOL_REFILL_INTERVAL_SECONDS)
+
+
+def start_worker(build_messages: Callable[[str, str, str], List[Dict[str, str]]]) -> None:
+    """Start the background refill worker (call from the startup event)"""
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop(build_messages))
+
+
+async def stop_worker() -> None:
+    """Stop the background refill worker (call from the shutdown event)"""
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+    await asyncio.to_thread(flush_requests)
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Return pool counters and current pool sizes"""
+    lookups = _metrics['hits'] + _metrics['misses']
+    return {
+        **_metrics,
+        'hit_rate': round(_metrics['hits'] / lookups, 3) if lookups else None,
+        'pooled': sum(len(pool) for pool in _pools.values()),
+        'pending_requests': sum(_pending_requests.values()),
+        'combos': len(_pools),
+    }
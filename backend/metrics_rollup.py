@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics Rollup - Daily admin metrics kept in daily_metrics
+
+A periodic job re-rolls today and yesterday: the day's events (signups,
+trials started, subscriptions started/cancelled/expired, messages) are
+counted with index range scans over that day only, and today's row also
+takes a snapshot of the user and subscription counts. Yesterday is redone
+so that late writes (e.g. usage counters flushed after midnight) land in
+the right day; its snapshot is kept from its last run. The admin dashboard
+then reads one row per day instead of aggregating the live tables; days in
+the range it reads that have no row yet (before the first deploy, or while
+the job was down) are rolled up on that read.
+
+Days are UTC days. Every rollup is an idempotent upsert, so the job can run
+in several workers and backfill can be re-run over any range.
+"""
+
+import os
+import asyncio
+from datetime import datetime, date, time, timedelta, timezone
+from typing import Optional, Dict, Any, List, Tuple
+from sqlalchemy import func, select, and_, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import User, Subscription, UsageStats, DailyMetrics
+from stats_queries import get_status_counts
+
+
+METRICS_ROLLUP_INTERVAL_SECONDS = float(os.getenv("METRICS_ROLLUP_INTERVAL_SECONDS", "300"))
+
+EVENT_FIELDS = (
+    'signups',
+    'trials_started',
+    'subscriptions_started',
+    'subscriptions_cancelled',
+    'subscriptions_expired',
+    'messages',
+)
+SNAPSHOT_FIELDS = (
+    'users_total',
+    'premium_users',
+    'trial_users',
+    'active_subscriptions',
+    'monthly_subscriptions',
+    'yearly_subscriptions',
+)
+
+_worker_task: Optional[asyncio.Task] = None
+
+_metrics = {
+    'passes': 0,
+    'rows_written': 0,
+    'read_refreshes': 0,
+    'days_filled': 0,
+    'errors': 0,
+    'last_pass_seconds': 0.0,
+}
+
+
+def utc_today(now: Optional[datetime] = None) -> date:
+    return (now or datetime.now(timezone.utc)).astimezone(timezone.utc).date()
+
+
+def day_bounds(day: date) -> Tuple[datetime, datetime]:
+    """[start, end) of a UTC day"""
+    start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+    return start, start + timedelta(days=1)
+
+
+def _count_in(column, start: datetime, end: datetime, *criteria):
+    return select(func.count()).where(column >= start, column < end, *criteria).scalar_subquery()
+
+
+def compute_events(db: Session, day: date) -> Dict[str, int]:
+    """The day's event counters, in one round trip"""
+    start, end = day_bounds(day)
+    row = db.execute(select(
+        _count_in(User.created_at, start, end).label('signups'),
+        _count_in(User.trial_started_at, start, end).label('trials_started'),
+        _count_in(Subscription.started_at, start, end).label('subscriptions_started'),
+        _count_in(Subscription.cancelled_at, start, end).label('subscriptions_cancelled'),
+        _count_in(Subscription.expires_at, start, end, Subscription.status == 'expired').label('subscriptions_expired'),
+        select(func.coalesce(func.sum(UsageStats.messages_generated), 0))
+        .where(UsageStats.date == day).scalar_subquery().label('messages'),
+    )).one()
+    return {field: int(getattr(row, field)) for field in EVENT_FIELDS}
+
+
+def compute_snapshot(db: Session) -> Dict[str, int]:
+    """Current user and subscription counts"""
+    return get_status_counts(db)
+
+
+def reconstruct_snapshot(db: Session, day: date) -> Dict[str, Optional[int]]:
+    """
+    Best-effort snapshot at the end of a past day, for backfills. User statuses
+    are not historized, so premium/trial counts stay unknown (None).
+    """
+    _, end = day_bounds(day)
+    users_total = db.query(func.count(User.id)).filter(User.created_at < end).scalar() or 0
+    by_plan = dict(
+        db.query(Subscription.plan_type, func.count())
+        .filter(
+            Subscription.started_at < end,
+            Subscription.expires_at >= end,
+            or_(Subscription.cancelled_at.is_(None), Subscription.cancelled_at >= end)
+        )
+        .group_by(Subscription.plan_type).all()
+    )
+    return {
+        'users_total': users_total,
+        'premium_users': None,
+        'trial_users': None,
+        'active_subscriptions': sum(by_plan.values()),
+        'monthly_subscriptions': by_plan.get('monthly', 0),
+        'yearly_subscriptions': by_plan.get('yearly', 0),
+    }
+
+
+def rollup_day(db: Session, day: date, now: Optional[datetime] = None) -> None:
+    """
+    Recompute one day's row (commits). Today's snapshot is overwritten with the
+    live counts; a past day keeps the snapshot taken on that day and only fills
+    in what is missing.
+    """
+    now = now or datetime.now(timezone.utc)
+    live = day >= utc_today(now)
+    values = {'day': day, **compute_events(db, day)}
+    values.update(compute_snapshot(db) if live else reconstruct_snapshot(db, day))
+    values['updated_at'] = now
+
+    stmt = insert(DailyMetrics).values(**values)
+    updates = {field: stmt.excluded[field] for field in EVENT_FIELDS + ('updated_at',)}
+    for field in SNAPSHOT_FIELDS:
+        column = getattr(DailyMetrics, field)
+        updates[field] = stmt.excluded[field] if live else func.coalesce(column, stmt.excluded[field])
+    db.execute(stmt.on_conflict_do_update(index_elements=['day'], set_=updates))
+    db.commit()
+    _metrics['rows_written'] += 1
+
+
+def refresh(db: Session, now: Optional[datetime] = None) -> None:
+    """Re-roll yesterday and today"""
+    now = now or datetime.now(timezone.utc)
+    today = utc_today(now)
+    rollup_day(db, today - timedelta(days=1), now)
+    rollup_day(db, today, now)
+
+
+def backfill(db: Session, start: date, end: date, now: Optional[datetime] = None) -> int:
+    """Roll up every day in [start, end]. Returns the number of days written."""
+    days = 0
+    day = start
+    while day <= end:
+        rollup_day(db, day, now)
+        days += 1
+        day += timedelta(days=1)
+    return days
+
+
+def get_days(db: Session, since: date, now: Optional[datetime] = None) -> List[DailyMetrics]:
+    """
+    Rows from `since` through today, oldest first, one per day. Past days
+    without a row (e.g. before the first deploy, or while the job was down)
+    are rolled up first, so sums over the range match the live tables without
+    a manual backfill. Today (and yesterday) are re-rolled when today's row is
+    missing or older than two job intervals (e.g. the job is not running).
+    """
+    now = now or datetime.now(timezone.utc)
+    today = utc_today(now)
+    stored = dict(db.query(DailyMetrics.day, DailyMetrics.updated_at).filter(
+        DailyMetrics.day >= since,
+        DailyMetrics.day <= today
+    ).all())
+
+    day = since
+    while day < today:
+        if day not in stored:
+            _metrics['days_filled'] += 1
+            rollup_day(db, day, now)
+        day += timedelta(days=1)
+
+    latest = stored.get(today)
+    if latest is None or latest < now - timedelta(seconds=2 * METRICS_ROLLUP_INTERVAL_SECONDS):
+        _metrics['read_refreshes'] += 1
+        refresh(db, now)
+    return db.query(DailyMetrics).filter(
+        DailyMetrics.day >= since,
+        DailyMetrics.day <= today
+    ).order_by(DailyMetrics.day).all()
+
+
+def _live_events(db: Session, start: date, end: date) -> Dict[date, Dict[str, int]]:
+    """Event counters per day straight from the live tables (GROUP BY, independent of compute_events)"""
+    start_at, _ = day_bounds(start)
+    _, end_at = day_bounds(end)
+    live: Dict[date, Dict[str, int]] = {}
+
+    def add(field, column, *criteria):
+        day_column = func.date(func.timezone('UTC', column))
+        rows = db.query(day_column, func.count()).filter(
+            column >= start_at, column < end_at, *criteria
+        ).group_by(day_column).all()
+        for day, count in rows:
+            live.setdefault(day, {})[field] = count
+
+    add('signups', User.created_at)
+    add('trials_started', User.trial_started_at)
+    add('subscriptions_started', Subscription.started_at)
+    add('subscriptions_cancelled', Subscription.cancelled_at)
+    add('subscriptions_expired', Subscription.expires_at, Subscription.status == 'expired')
+    messages = db.query(UsageStats.date, func.sum(UsageStats.messages_generated)).filter(
+        and_(UsageStats.date >= start, UsageStats.date <= end)
+    ).group_by(UsageStats.date).all()
+    for day, total in messages:
+        live.setdefault(day, {})['messages'] = int(total or 0)
+    return live
+
+
+def _live_snapshot(db: Session) -> Dict[str, int]:
+    """Current counts with one plain COUNT per figure (the dashboard's original queries)"""
+    def count_users(*criteria):
+        return db.query(func.count(User.id)).filter(*criteria).scalar() or 0
+
+    def count_active(*criteria):
+        return db.query(func.count(Subscription.id)).filter(Subscription.status == 'active', *criteria).scalar() or 0
+
+    return {
+        'users_total': count_users(),
+        'premium_users': count_users(User.subscription_status == 'premium'),
+        'trial_users': count_users(User.subscription_status == 'trial'),
+        'active_subscriptions': count_active(),
+        'monthly_subscriptions': count_active(Subscription.plan_type == 'monthly'),
+        'yearly_subscriptions': count_active(Subscription.plan_type == 'yearly'),
+    }
+
+
+def check_consistency(db: Session, days: int = 30, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    Compare the last `days` rows with the live aggregates. Returns the
+    mismatches as {day, field, stored, live}; a missing row is reported with
+    stored=None. Today's snapshot is compared with the current counts, so it
+    may lag by up to one job interval. Deleted accounts also make past days
+    differ, since the rollup keeps what happened on the day.
+    """
+    now = now or datetime.now(timezone.utc)
+    today = utc_today(now)
+    start = today - timedelta(days=days - 1)
+    stored = {row.day: row for row in db.query(DailyMetrics).filter(
+        DailyMetrics.day >= start, DailyMetrics.day <= today
+    ).all()}
+    live = _live_events(db, start, today)
+
+    mismatches = []
+    day = start
+    while day <= today:
+        row = stored.get(day)
+        for field in EVENT_FIELDS:
+            expected = live.get(day, {}).get(field, 0)
+            actual = getattr(row, field) if row else None
+            if actual != expected:
+                mismatches.append({'day': day, 'field': field, 'stored': actual, 'live': expected})
+        day += timedelta(days=1)
+
+    row = stored.get(today)
+    for field, expected in _live_snapshot(db).items():
+        actual = getattr(row, field) if row else None
+        if actual != expected:
+            mismatches.append({'day': today, 'field': field, 'stored': actual, 'live': expected})
+    return mismatches
+
+
+def _run_pass() -> None:
+    db = SessionLocal()
+    try:
+        refresh(db)
+    finally:
+        db.close()
+
+
+async def _worker_loop() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        try:
+            await asyncio.to_thread(_run_pass)
+            _metrics['passes'] += 1
+            _metrics['last_pass_seconds'] = round(loop.time() - started, 3)
+        except Exception as e:
+            _metrics['errors'] += 1
+            print(f"⚠️ [METRICS] Rollup failed: {e}")
+        await asyncio.sleep(METRICS_ROLLUP_INTERVAL_SECONDS)
+
+
+def start_worker() -> None:
+    """Start the rollup job (call from the startup event)"""
+    global _worker_task
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stop_worker() -> None:
+    """Stop the rollup job (call from the shutdown event)"""
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Return rollup counters"""
+    return {
+        **_metrics,
+        'running': _worker_task is not None and not _worker_task.done(),
+        'interval_seconds': METRICS_ROLLUP_INTERVAL_SECONDS,
+    }
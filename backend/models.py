@@ -3,15 +3,25 @@
 SQLAlchemy models for PostgreSQL database
 """
 
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Date, Float
+from sqlalchemy import Column, Integer, BigInteger, SmallInteger, String, Boolean, DateTime, Text, ForeignKey, Date, Float, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.sql import func
+from sqlalchemy.sql import func, text
 from datetime import datetime
 from database import Base
 
 class User(Base):
     """User model - stores user authentication and profile data"""
     __tablename__ = "users"
+    __table_args__ = (
+        # Day-range scans of the metrics rollup (see metrics_rollup)
+        Index('ix_users_created_at', 'created_at'),
+        Index('ix_users_trial_started_at', 'trial_started_at'),
+        # Index-only status breakdown (see stats_queries)
+        Index('ix_users_subscription_status', 'subscription_status'),
+        # Expiry sweeper candidates (see expiry_sweeper)
+        Index('ix_users_trial_ends_at', 'trial_ends_at'),
+        Index('ix_users_premium_until', 'premium_until'),
+    )
     
     id = Column(String, primary_key=True, index=True)  # user_id from auth
     
@@ -34,6 +44,12 @@ class User(Base):
     # Subscription fields
     trial_started_at = Column(DateTime(timezone=True), nullable=True)  # When trial started
     subscription_status = Column(String, nullable=False, default='trial')  # 'trial', 'free', 'premium'
+    # Precomputed from the trial, coupons and active subscriptions (see entitlements)
+    trial_ends_at = Column(DateTime(timezone=True), nullable=True)
+    premium_until = Column(DateTime(timezone=True), nullable=True)
+    
+    # Delta sync: bumped on every change to the user's contacts/reminders (see sync_service)
+    sync_version = Column(BigInteger, nullable=False, default=0, server_default='0')
     
     # Relationships
     contacts = relationship("Contact", back_populates="user", cascade="all, delete-orphan")
@@ -50,6 +66,14 @@ class Contact(Base):
     name_encrypted = Column(String, nullable=False)  # AES encrypted contact name
     default_tone = Column(String, nullable=True, default='friendly')  # Default tone for messages: 'friendly', 'warm', 'casual', 'formal'
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    sync_version = Column(BigInteger, nullable=False, default=0, server_default='0')  # users.sync_version of the last change
+    
+    # Keyset pagination: WHERE user_id = ? AND (created_at, id) > (?, ?) ORDER BY created_at, id
+    # Delta sync: WHERE user_id = ? AND sync_version > ?
+    __table_args__ = (
+        Index('ix_contacts_user_created_id', 'user_id', 'created_at', 'id'),
+        Index('ix_contacts_user_sync_version', 'user_id', 'sync_version'),
+    )
     
     # Relationships
     user = relationship("User", back_populates="contacts")
@@ -73,10 +97,21 @@ class Reminder(Base):
     # שדות חדשים - מערכת התראות משופרת
     reminder_type = Column(String, nullable=False, default='recurring')  # 'one_time', 'recurring', 'weekly', 'daily'
     scheduled_datetime = Column(DateTime(timezone=True), nullable=True)  # להתראה חד-פעמית
-    weekdays = Column(Text, nullable=True)  # JSON array: "[0,2,4]" - ימים בשבוע
-    specific_time = Column(String, nullable=True)  # "14:30" - שעה ספציפית
-    timezone = Column(String, nullable=True)  # "Asia/Jerusalem" - timezone של המשתמש
+    weekday_mask = Column(SmallInteger, nullable=True)  # ביט לכל יום בשבוע (bit 0 = ראשון): [0,2,4] -> 21
+    time_minutes = Column(SmallInteger, nullable=True)  # דקות מחצות: "14:30" -> 870
+    timezone = Column(String, nullable=True)  # "Asia/Jerusalem" - מזהה IANA מנורמל
+    # Legacy text schedule (pre migration 21) - still written for rollback, dropped in a later release
+    weekdays = Column(Text, nullable=True)  # JSON array: "[0,2,4]"
+    specific_time = Column(String, nullable=True)  # "14:30"
     one_time_triggered = Column(Boolean, default=False, nullable=False)  # האם התראה חד-פעמית הופעלה
+    sync_version = Column(BigInteger, nullable=False, default=0, server_default='0')  # users.sync_version of the last change
+    
+    # Due-index for the reminder scheduler (WHERE enabled AND next_trigger <= now), keyset pagination, delta sync
+    __table_args__ = (
+        Index('ix_reminders_enabled_next_trigger', 'enabled', 'next_trigger'),
+        Index('ix_reminders_user_created_id', 'user_id', 'created_at', 'id'),
+        Index('ix_reminders_user_sync_version', 'user_id', 'sync_version'),
+    )
     
     # Relationships
     user = relationship("User", back_populates="reminders")
@@ -102,6 +137,16 @@ class Reminder(Base):
 class Subscription(Base):
     """Subscription model - stores user subscription data"""
     __tablename__ = "subscriptions"
+    __table_args__ = (
+        # Day-range scans of the metrics rollup (see metrics_rollup)
+        Index('ix_subscriptions_started_at', 'started_at'),
+        Index('ix_subscriptions_cancelled_at', 'cancelled_at'),
+        Index('ix_subscriptions_expires_at', 'expires_at'),
+        # Active subscriptions only, for the per-plan breakdown (see stats_queries)
+        Index('ix_subscriptions_active_plan', 'plan_type', postgresql_where=text("status = 'active'")),
+        # Active subscriptions by expiry, for the expiry sweep (see expiry_sweeper)
+        Index('ix_subscriptions_active_expires_at', 'expires_at', postgresql_where=text("status = 'active'")),
+    )
     
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
@@ -157,6 +202,10 @@ class UsageStats(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
+    __table_args__ = (
+        UniqueConstraint('user_id', 'date', name='uq_usage_stats_user_date'),
+    )
+
     # Relationships
     user = relationship("User", back_populates="usage_stats")
 
@@ -234,6 +283,106 @@ class SupportTicket(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
     
+    # Admin list, newest first (keyset pagination)
+    __table_args__ = (
+        Index('ix_support_tickets_created_id', 'created_at', 'id'),
+    )
+    
     # Relationship
     user = relationship("User")
 
+
+
+class MessageTemplate(Base):
+    """Message Template model - shared cache of generated messages (contact name as placeholder)"""
+    __tablename__ = "message_templates"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    cache_key = Column(String, nullable=False, index=True)  # SHA256 of normalized (type, tone, language, context)
+    message_type = Column(String, nullable=False)
+    tone = Column(String, nullable=False)
+    language = Column(String, nullable=False)
+    template = Column(Text, nullable=False)  # Generated message with {{NAME}} placeholder
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+
+
+class MessageComboStats(Base):
+    """Message Combo Stats model - daily request counts per (message_type, tone, language)"""
+    __tablename__ = "message_combo_stats"
+    __table_args__ = (
+        UniqueConstraint('date', 'message_type', 'tone', 'language', name='uq_message_combo_stats'),
+    )
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    date = Column(Date, nullable=False, index=True)
+    message_type = Column(String, nullable=False)
+    tone = Column(String, nullable=False)
+    language = Column(String, nullable=False)
+    requests = Column(Integer, nullable=False, default=0)
+
+
+class MessagePoolBudget(Base):
+    """Message Pool Budget model - one token bucket row shared by every worker's pool refills"""
+    __tablename__ = "message_pool_budget"
+
+    id = Column(Integer, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class ReminderEvent(Base):
+    """Reminder Event model - a due reminder materialized by the scheduler (id is the client cursor)"""
+    __tablename__ = "reminder_events"
+    __table_args__ = (
+        Index('ix_reminder_events_user_id_id', 'user_id', 'id'),
+        # Events not yet returned by /api/reminders/check
+        Index('ix_reminder_events_unchecked', 'user_id', 'id', postgresql_where=text('checked_at IS NULL')),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    reminder_id = Column(Integer, ForeignKey("reminders.id", ondelete="CASCADE"), nullable=False, index=True)
+    contact_id = Column(Integer, nullable=False)
+    due_at = Column(DateTime(timezone=True), nullable=False)  # The next_trigger that came due
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+    checked_at = Column(DateTime(timezone=True), nullable=True)  # Returned by /api/reminders/check
+
+
+class SyncTombstone(Base):
+    """Sync Tombstone model - a deleted contact/reminder, kept so delta sync can report the delete"""
+    __tablename__ = "sync_tombstones"
+    __table_args__ = (
+        Index('ix_sync_tombstones_user_sync_version', 'user_id', 'sync_version'),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(String, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    entity = Column(String, nullable=False)  # 'contact' or 'reminder'
+    entity_id = Column(Integer, nullable=False)
+    sync_version = Column(BigInteger, nullable=False)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class DailyMetrics(Base):
+    """Daily Metrics model - one rollup row per UTC day for the admin dashboard (see metrics_rollup)"""
+    __tablename__ = "daily_metrics"
+
+    day = Column(Date, primary_key=True)
+
+    # Events during the day
+    signups = Column(Integer, nullable=False, default=0)
+    trials_started = Column(Integer, nullable=False, default=0)
+    subscriptions_started = Column(Integer, nullable=False, default=0)
+    subscriptions_cancelled = Column(Integer, nullable=False, default=0)
+    subscriptions_expired = Column(Integer, nullable=False, default=0)
+    messages = Column(Integer, nullable=False, default=0)
+
+    # Snapshot at the last rollup of the day (NULL when it could not be reconstructed by a backfill)
+    users_total = Column(Integer, nullable=True)
+    premium_users = Column(Integer, nullable=True)
+    trial_users = Column(Integer, nullable=True)
+    active_subscriptions = Column(Integer, nullable=True)
+    monthly_subscriptions = Column(Integer, nullable=True)
+    yearly_subscriptions = Column(Integer, nullable=True)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Pagination - Keyset pages over (created_at, id) with opaque cursors
+
+List endpoints keep returning a plain JSON array; the cursor for the next
+page travels in the X-Next-Cursor response header and is absent on the last
+page. A page is one index range scan, however deep the client has paged.
+Requests without limit and cursor get the whole list in one response, as
+before pagination existed, since older clients never read the header.
+"""
+
+import os
+import json
+import base64
+from datetime import datetime
+from typing import Optional, Tuple, List, Any, Set, Iterable
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query
+
+
+PAGE_DEFAULT_LIMIT = int(os.getenv("PAGE_DEFAULT_LIMIT", "200"))
+PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", "500"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """(created_at, id) of the last row on a page -> opaque cursor"""
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Opaque cursor -> (created_at, id). Raises 400 on anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="cursor לא תקין")
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    """Requested page size, bounded to 1..PAGE_MAX_LIMIT (PAGE_DEFAULT_LIMIT if only a cursor was given)"""
+    if limit is None:
+        return PAGE_DEFAULT_LIMIT
+    return max(1, min(limit, PAGE_MAX_LIMIT))
+
+
+def paginate(
+    query: Query,
+    model,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    descending: bool = False
+) -> Tuple[List[Any], Optional[str]]:
+    """
+    One page of `query` ordered by (created_at, id). Returns (rows, next_cursor);
+    next_cursor is None on the last page. Without cursor and limit: every row.
+    """
+    key = tuple_(model.created_at, model.id)
+    if cursor:
+        after = decode_cursor(cursor)
+        query = query.filter(key < after if descending else key > after)
+    if descending:
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+    else:
+        query = query.order_by(model.created_at, model.id)
+
+    if not cursor and limit is None:
+        return query.all(), None
+
+    limit = clamp_limit(limit)
+    # One extra row tells whether there is a next page
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[Set[str]]:
+    """"id,name" -> {"id", "name"} for field projection (None = all fields). Raises 400 on unknown fields."""
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(',') if field.strip()}
+    unknown = requested - set(allowed)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"שדות לא מוכרים: {', '.join(sorted(unknown))}")
+    return requested
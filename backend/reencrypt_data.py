@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy re-encryption of stored values into the current encryption format
+Run this from the backend directory (safe to run while the app is serving):
+    python3 reencrypt_data.py [--batch-size 500] [--pause 0.2] [--dry-run]
+
+Rows are walked in primary-key order in small batches, and only values that
+are not yet in the current format (see encryption.needs_reencryption) are
+rewritten. Each rewrite is a compare-and-set (UPDATE ... WHERE id = :id AND
+column = :old): a value the app changed since the batch was read is left
+alone, since the app writes the current format anyway. Each batch is its
+own transaction, so the script can be stopped and re-run at any time.
+Lookup hashes do not change.
+"""
+
+import sys
+import time
+import argparse
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import User, Contact
+from encryption import init_encryption, reencrypt, ENCRYPTION_FORMAT
+
+# model -> encrypted columns
+ENCRYPTED_FIELDS = [
+    (User, ['username_encrypted', 'email_encrypted']),
+    (Contact, ['name_encrypted']),
+]
+
+
+def reencrypt_model(db: Session, model, fields, batch_size: int, pause: float, dry_run: bool) -> int:
+    """Re-encrypt one table in keyset-paginated batches. Returns the number of values rewritten."""
+    print(f"🔵 [REENCRYPT] {model.__tablename__}: {', '.join(fields)}")
+    columns = [getattr(model, field) for field in fields]
+    last_id = None
+    rewritten = 0
+    skipped = 0
+    scanned = 0
+    while True:
+        query = db.query(model.id, *columns).order_by(model.id)
+        if last_id is not None:
+            query = query.filter(model.id > last_id)
+        rows = query.limit(batch_size).all()
+        if not rows:
+            break
+
+        for row in rows:
+            for field, column in zip(fields, columns):
+                old_value = getattr(row, field)
+                new_value = reencrypt(old_value)
+                if new_value is None:
+                    continue
+                if dry_run:
+                    rewritten += 1
+                    continue
+                # Only if nobody rewrote the value since it was read
+                result = db.execute(
+                    update(model.__table__)
+                    .where(model.id == row.id, column == old_value)
+                    .values({field: new_value})
+                )
+                if result.rowcount:
+                    rewritten += 1
+                else:
+                    skipped += 1
+        scanned += len(rows)
+        last_id = rows[-1].id
+
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+        print(f"   ... {scanned} rows scanned, {rewritten} values {'to rewrite' if dry_run else 'rewritten'}"
+              + (f", {skipped} changed concurrently and skipped" if skipped else ""))
+        if pause:
+            time.sleep(pause)
+
+    return rewritten
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-encrypt stored values into the current format")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.2, help="Seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="Only count values that need re-encryption")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"🔐 Re-encrypting stored values into format '{ENCRYPTION_FORMAT}'")
+    print("=" * 60)
+
+    init_encryption()
+    db = SessionLocal()
+    try:
+        total = 0
+        for model, fields in ENCRYPTED_FIELDS:
+            total += reencrypt_model(db, model, fields, args.batch_size, args.pause, args.dry_run)
+        print(f"✅ [REENCRYPT] Done: {total} values {'need re-encryption' if args.dry_run else 're-encrypted'}")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ [REENCRYPT] Failed: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
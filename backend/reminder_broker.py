@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Reminder Broker - Wakes reminder streams when new reminder events exist
+
+The broker only carries "user X has new events"; the events themselves are
+read from reminder_events by cursor, so a stream that reconnects with its
+Last-Event-ID gets exactly what it missed.
+
+With REMINDER_BROKER=postgres (default) a wake-up is also sent with
+PostgreSQL NOTIFY, and every worker's LISTEN thread (database.start_notify_listener) fans it out to the
+streams connected there. REMINDER_BROKER=local keeps everything in process
+(single worker, tests).
+"""
+
+import os
+import asyncio
+import threading
+from typing import Dict, Any, Optional, Set, Iterable
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import register_notify_handler, notify_listener_alive
+
+
+REMINDER_BROKER = os.getenv("REMINDER_BROKER", "postgres").lower()
+REMINDER_CHANNEL = "reminder_events"
+
+
+class Subscription:
+    """One connected stream: an event set from any thread, awaited on its loop"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+
+    def wake(self) -> None:
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait for a wake-up. Returns False on timeout."""
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self.event.clear()
+        return True
+
+
+# user_id -> connected streams on this worker
+_subscriptions: Dict[str, Set[Subscription]] = {}
+_lock = threading.Lock()
+
+_metrics = {
+    'connects': 0,
+    'published': 0,
+    'notifications': 0,
+    'wakeups': 0,
+    'publish_errors': 0,
+}
+
+
+def _uses_postgres(engine) -> bool:
+    return REMINDER_BROKER == 'postgres' and engine.dialect.name == 'postgresql'
+
+
+def subscribe(user_id: str) -> Subscription:
+    """Register a stream for a user (call from the event loop)"""
+    subscription = Subscription(user_id)
+    with _lock:
+        _subscriptions.setdefault(user_id, set()).add(subscription)
+    _metrics['connects'] += 1
+    return subscription
+
+
+def unsubscribe(subscription: Subscription) -> None:
+    with _lock:
+        streams = _subscriptions.get(subscription.user_id)
+        if streams is not None:
+            streams.discard(subscription)
+            if not streams:
+                del _subscriptions[subscription.user_id]
+
+
+def subscribed_users() -> Set[str]:
+    """Users with at least one stream connected to this worker"""
+    with _lock:
+        return set(_subscriptions)
+
+
+def wake_local(user_ids: Iterable[str]) -> None:
+    """Wake this worker's streams of the given users (thread-safe)"""
+    with _lock:
+        targets = [s for user_id in set(user_ids) for s in _subscriptions.get(user_id, ())]
+    for subscription in targets:
+        subscription.wake()
+    _metrics['wakeups'] += len(targets)
+
+
+def publish(db: Session, user_ids: Iterable[str]) -> None:
+    """Announce new reminder events for users. Call after committing them."""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    _metrics['published'] += len(user_ids)
+    if not _uses_postgres(db.get_bind()):
+        wake_local(user_ids)
+        return
+    # This worker's streams are woken through its own listener as well
+    try:
+        for user_id in user_ids:
+            db.execute(text("SELECT pg_notify(:channel, :user_id)"),
+                       {"channel": REMINDER_CHANNEL, "user_id": user_id})
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        _metrics['publish_errors'] += 1
+        print(f"⚠️ [REMINDER BROKER] Error sending notification: {e}")
+        wake_local(user_ids)
+
+
+def _on_notify(user_ids) -> None:
+    _metrics['notifications'] += len(user_ids)
+    wake_local(user_ids)
+
+
+def _on_reset() -> None:
+    # Streams re-read from their cursor, so wake everyone after a reconnect
+    wake_local(subscribed_users())
+
+
+if REMINDER_BROKER == 'postgres':
+    register_notify_handler(REMINDER_CHANNEL, _on_notify, _on_reset)
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Return connected streams and fan-out counters"""
+    with _lock:
+        streams = sum(len(s) for s in _subscriptions.values())
+        users = len(_subscriptions)
+    return {
+        **_metrics,
+        'broker': REMINDER_BROKER,
+        'streams': streams,
+        'users': users,
+        'listener_alive': notify_listener_alive(),
+    }
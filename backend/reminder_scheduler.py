@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Reminder Scheduler - Materializes due reminders into reminder_events
+
+Due reminders are found through the (enabled, next_trigger) index, so each
+pass costs O(due) rather than O(all reminders). Every due reminder gets one
+row in reminder_events (its id is the client cursor) and is advanced to its
+next trigger in the same transaction. A reminder that came due while no
+client was polling stays due until a pass picks it up, so nothing is missed.
+
+The background worker leaves a grace period (REMINDER_SCHEDULER_GRACE_SECONDS)
+so that clients polling /api/reminders/check still materialize their own
+reminders first; the worker only catches what nobody polled for. Users with
+a stream connected to this worker (see reminder_broker) get no grace period,
+and every new event is announced through the broker.
+
+/api/reminders/check returns every event it has not returned before
+(checked_at), whoever materialized it, so polling less often than the grace
+period loses nothing.
+"""
+
+import os
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, List, Callable, Iterable
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+import reminder_broker
+import sync_service
+from database import SessionLocal
+from models import Reminder, ReminderEvent
+
+
+REMINDER_SCHEDULER_INTERVAL_SECONDS = float(os.getenv("REMINDER_SCHEDULER_INTERVAL_SECONDS", "15"))
+REMINDER_SCHEDULER_GRACE_SECONDS = float(os.getenv("REMINDER_SCHEDULER_GRACE_SECONDS", "120"))
+REMINDER_EVENTS_RETENTION_DAYS = int(os.getenv("REMINDER_EVENTS_RETENTION_DAYS", "7"))
+# Rows locked and advanced per transaction
+REMINDER_SCHEDULER_BATCH_SIZE = 500
+
+# (fired reminders, now) -> their next triggers, None where there is no next occurrence
+NextTriggerFn = Callable[[List[Reminder], datetime], List[Optional[datetime]]]
+
+_worker_task: Optional[asyncio.Task] = None
+_next_trigger_fn: Optional[NextTriggerFn] = None
+
+_metrics = {
+    'passes': 0,
+    'materialized': 0,
+    'materialized_by_worker': 0,
+    'pruned': 0,
+    'errors': 0,
+    'last_pass_lag_seconds': 0.0,
+}
+
+
+def materialize_due(
+    db: Session,
+    next_trigger_fn: NextTriggerFn,
+    now: Optional[datetime] = None,
+    user_id: Optional[str] = None,
+    user_ids: Optional[Iterable[str]] = None,
+    grace_seconds: float = 0,
+    limit: int = REMINDER_SCHEDULER_BATCH_SIZE
+) -> List[ReminderEvent]:
+    """
+    Turn due reminders into events and advance them. Returns the created events.
+    Rows locked by a concurrent pass are skipped, so workers never double-fire.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(seconds=grace_seconds)
+
+    query = db.query(Reminder).filter(
+        Reminder.enabled == True,
+        Reminder.next_trigger <= cutoff
+    )
+    if user_id is not None:
+        query = query.filter(Reminder.user_id == user_id)
+    if user_ids is not None:
+        query = query.filter(Reminder.user_id.in_(list(user_ids)))
+    due = query.order_by(Reminder.next_trigger).limit(limit).with_for_update(skip_locked=True).all()
+    if not due:
+        db.commit()  # release the (empty) lock transaction
+        return []
+
+    events = []
+    repeating = []
+    for reminder in due:
+        event = ReminderEvent(
+            user_id=reminder.user_id,
+            reminder_id=reminder.id,
+            contact_id=reminder.contact_id,
+            due_at=reminder.next_trigger
+        )
+        db.add(event)
+        events.append(event)
+
+        if (reminder.reminder_type or 'recurring') == 'one_time':
+            reminder.one_time_triggered = True
+            reminder.next_trigger = None
+        else:
+            repeating.append(reminder)
+
+    # Next triggers for the whole batch at once
+    for reminder, next_trigger in zip(repeating, next_trigger_fn(repeating, now) if repeating else []):
+        reminder.last_triggered = now
+        reminder.next_trigger = next_trigger
+
+    # The advanced reminders are changes for delta sync (user rows locked in a stable order)
+    by_user: Dict[str, List[Reminder]] = {}
+    for reminder in due:
+        by_user.setdefault(reminder.user_id, []).append(reminder)
+    for reminder_user_id in sorted(by_user):
+        sync_service.touch(db, reminder_user_id, *by_user[reminder_user_id])
+
+    db.commit()
+    for event in events:
+        db.refresh(event)
+    reminder_broker.publish(db, {event.user_id for event in events})
+
+    oldest_due = min(event.due_at for event in events)
+    _metrics['last_pass_lag_seconds'] = round((now - oldest_due).total_seconds(), 1)
+    _metrics['materialized'] += len(events)
+    return events
+
+
+def get_due_events(
+    db: Session,
+    user_id: str,
+    cursor: Optional[int] = None,
+    limit: int = 100
+) -> List[ReminderEvent]:
+    """Events after the cursor, oldest first. Without a cursor: the last day of events."""
+    query = db.query(ReminderEvent).filter(ReminderEvent.user_id == user_id)
+    if cursor is not None:
+        query = query.filter(ReminderEvent.id > cursor)
+    else:
+        query = query.filter(ReminderEvent.created_at >= datetime.now(timezone.utc) - timedelta(days=1))
+    return query.order_by(ReminderEvent.id).limit(limit).all()
+
+
+def take_unchecked_events(db: Session, user_id: str, now: Optional[datetime] = None) -> List[ReminderEvent]:
+    """
+    Events of the user not yet returned by /api/reminders/check, oldest first,
+    marked as returned in the same statement (commits). Concurrent polls get
+    disjoint events.
+    """
+    now = now or datetime.now(timezone.utc)
+    event_ids = db.execute(
+        update(ReminderEvent)
+        .where(ReminderEvent.user_id == user_id, ReminderEvent.checked_at.is_(None))
+        .values(checked_at=now)
+        .returning(ReminderEvent.id)
+    ).scalars().all()
+    db.commit()
+    if not event_ids:
+        return []
+    return db.query(ReminderEvent).filter(ReminderEvent.id.in_(event_ids)).order_by(ReminderEvent.id).all()
+
+
+def get_latest_event_id(db: Session, user_id: str) -> int:
+    """Cursor positioned after the user's newest event (0 if there are none)"""
+    latest = db.query(func.max(ReminderEvent.id)).filter(ReminderEvent.user_id == user_id).scalar()
+    return latest or 0
+
+
+def prune_events(db: Session) -> int:
+    """Delete events older than the retention window. Returns the number deleted."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=REMINDER_EVENTS_RETENTION_DAYS)
+    deleted = db.query(ReminderEvent).filter(
+        ReminderEvent.created_at < cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    _metrics['pruned'] += deleted
+    return deleted
+
+
+def run_pass() -> int:
+    """One worker pass over all users (runs in a thread). Returns the number of events created."""
+    db = SessionLocal()
+    try:
+        created = 0
+        streaming = reminder_broker.subscribed_users()
+        if streaming:
+            created += len(materialize_due(db, _next_trigger_fn, user_ids=streaming))
+        while True:
+            events = materialize_due(db, _next_trigger_fn, grace_seconds=REMINDER_SCHEDULER_GRACE_SECONDS)
+            created += len(events)
+            if len(events) < REMINDER_SCHEDULER_BATCH_SIZE:
+                break
+        _metrics['passes'] += 1
+        _metrics['materialized_by_worker'] += created
+        return created
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def _worker_loop() -> None:
+    last_prune = 0.0
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            created = await asyncio.to_thread(run_pass)
+            if created:
+                print(f"🔔 [SCHEDULER] Materialized {created} due reminders")
+            if loop.time() - last_prune > 3600:
+                db = SessionLocal()
+                try:
+                    await asyncio.to_thread(prune_events, db)
+                finally:
+                    db.close()
+                last_prune = loop.time()
+        except Exception as e:
+            _metrics['errors'] += 1
+            print(f"⚠️ [SCHEDULER] Pass failed: {e}")
+        await asyncio.sleep(REMINDER_SCHEDULER_INTERVAL_SECONDS)
+
+
+def start_worker(next_trigger_fn: NextTriggerFn) -> None:
+    """Start the scheduler (call from the startup event)"""
+    global _worker_task, _next_trigger_fn
+    _next_trigger_fn = next_trigger_fn
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stop_worker() -> None:
+    """Stop the scheduler (call from the shutdown event)"""
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Return scheduler counters"""
+    return {
+        **_metrics,
+        'running': _worker_task is not None and not _worker_task.done(),
+        'interval_seconds': REMINDER_SCHEDULER_INTERVAL_SECONDS,
+        'grace_seconds': REMINDER_SCHEDULER_GRACE_SECONDS,
+    }
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Settings Service - In-process snapshot of the app_settings table
+
+The whole table is loaded in one query and kept in memory with a version
+stamp. The snapshot is reloaded when it is invalidated (admin update, or a
+PostgreSQL NOTIFY from another worker) or after SETTINGS_TTL_SECONDS as a
+fallback, so hot-path reads do not touch the database.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Tuple
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import register_notify_handler, notify_listener_alive
+from models import AppSettings
+
+
+SETTINGS_TTL_SECONDS = float(os.getenv("SETTINGS_TTL_SECONDS", "30"))
+SETTINGS_CHANNEL = "app_settings_changed"
+
+_values: Dict[str, str] = {}
+_version = 0
+_fingerprint = ''
+_loaded_at: Optional[float] = None
+_dirty = True
+_lock = threading.Lock()
+
+_metrics = {
+    'reloads': 0,
+    'invalidations': 0,
+    'notifications': 0,
+}
+
+
+def _load(db: Session) -> None:
+    global _values, _version, _fingerprint, _loaded_at, _dirty
+    # Cleared before the query: an invalidation that arrives while it runs marks the result stale again
+    _dirty = False
+    try:
+        rows = db.query(AppSettings.key, AppSettings.value).all()
+    except Exception:
+        _dirty = True
+        raise
+    _values = {row.key: row.value for row in rows}
+    _fingerprint = hashlib.sha256(json.dumps(_values, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    _version += 1
+    _loaded_at = time.monotonic()
+    _metrics['reloads'] += 1
+
+
+def get_snapshot(db: Session) -> Tuple[Dict[str, str], int]:
+    """Return (settings dict, version), reloading the table if stale"""
+    if _dirty or _loaded_at is None or time.monotonic() - _loaded_at > SETTINGS_TTL_SECONDS:
+        with _lock:
+            if _dirty or _loaded_at is None or time.monotonic() - _loaded_at > SETTINGS_TTL_SECONDS:
+                _load(db)
+    return _values, _version
+
+
+def get_version(db: Session) -> int:
+    """Version stamp of the current snapshot (changes on every reload)"""
+    return get_snapshot(db)[1]
+
+
+def get_fingerprint(db: Session) -> str:
+    """Hash of the settings content - equal across workers and reloads while nothing changed"""
+    get_snapshot(db)
+    return _fingerprint
+
+
+def get(db: Session, key: str, default: Optional[str] = None) -> Optional[str]:
+    """Get a setting value as string"""
+    return get_snapshot(db)[0].get(key, default)
+
+
+def get_int(db: Session, key: str, default: int = 0) -> int:
+    """Get a setting value as integer"""
+    try:
+        return int(get(db, key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def get_float(db: Session, key: str, default: float = 0.0) -> float:
+    """Get a setting value as float"""
+    try:
+        return float(get(db, key, str(default)))
+    except (ValueError, TypeError):
+        return default
+
+
+def get_bool(db: Session, key: str, default: bool = False) -> bool:
+    """Get a setting value as boolean"""
+    value = get(db, key)
+    if value is None:
+        return default
+    return value.lower() in ('true', '1', 'yes')
+
+
+def get_json(db: Session, key: str, default: Any = None) -> Any:
+    """Get a setting value parsed as JSON"""
+    value = get(db, key)
+    if value is None:
+        return default
+    try:
+        return json.loads(value)
+    except (ValueError, TypeError):
+        return default
+
+
+def invalidate() -> None:
+    """Force a reload on the next read in this worker"""
+    global _dirty
+    _dirty = True
+    _metrics['invalidations'] += 1
+
+
+def publish_change(db: Session) -> None:
+    """
+    Invalidate this worker's snapshot and notify the other workers.
+    Call after committing a change to app_settings.
+    """
+    invalidate()
+    if db.get_bind().dialect.name != 'postgresql':
+        return
+    try:
+        db.execute(text("SELECT pg_notify(:channel, '')"), {"channel": SETTINGS_CHANNEL})
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ [SETTINGS] Error sending change notification: {e}")
+
+
+def _on_notify(payloads) -> None:
+    _metrics['notifications'] += 1
+    invalidate()
+
+
+# Changes missed while the listener was down are picked up by reloading
+register_notify_handler(SETTINGS_CHANNEL, _on_notify, invalidate)
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Return reload counters and snapshot age"""
+    return {
+        **_metrics,
+        'version': _version,
+        'keys': len(_values),
+        'age_seconds': round(time.monotonic() - _loaded_at, 1) if _loaded_at else None,
+        'listener_alive': notify_listener_alive(),
+    }
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Stats Queries - User and subscription breakdowns in one round trip
+
+Each table is read once with conditional aggregates (COUNT(*) FILTER)
+instead of one COUNT per figure. Both scans are index-only:
+ix_users_subscription_status covers the users breakdown, and the partial
+index ix_subscriptions_active_plan holds only active subscriptions, so the
+subscription side reads just those.
+"""
+
+from typing import Dict
+from sqlalchemy import func, select, true
+from sqlalchemy.orm import Session
+
+from models import User, Subscription
+
+
+def get_status_counts(db: Session) -> Dict[str, int]:
+    """
+    users_total, premium_users, trial_users (free = the rest) and
+    active/monthly/yearly subscriptions
+    """
+    users = select(
+        func.count().label('users_total'),
+        func.count().filter(User.subscription_status == 'premium').label('premium_users'),
+        func.count().filter(User.subscription_status == 'trial').label('trial_users'),
+    ).subquery()
+    subscriptions = select(
+        func.count().label('active_subscriptions'),
+        func.count().filter(Subscription.plan_type == 'monthly').label('monthly_subscriptions'),
+        func.count().filter(Subscription.plan_type == 'yearly').label('yearly_subscriptions'),
+    ).where(Subscription.status == 'active').subquery()
+
+    row = db.execute(
+        select(users, subscriptions).select_from(users.join(subscriptions, true()))
+    ).one()
+    return {key: int(value) for key, value in row._mapping.items()}
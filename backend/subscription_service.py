@@ -5,11 +5,14 @@ Subscription Service - Manages subscriptions and Google Play Billing
 
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 import os
 import json
 
-from models import User, Subscription, AppSettings
+from models import User, Subscription
+import entitlements
+import settings_service
 
 
 def utc_now():
@@ -18,9 +21,8 @@ def utc_now():
 
 
 def get_setting(db: Session, key: str, default: str = None) -> str:
-    """Get a setting value from app_settings table"""
-    setting = db.query(AppSettings).filter(AppSettings.key == key).first()
-    return setting.value if setting else default
+    """Get a setting value (from the cached app_settings snapshot)"""
+    return settings_service.get(db, key, default)
 
 
 def is_launch_pricing_active(db: Session) -> bool:
@@ -64,6 +66,14 @@ def get_active_subscription(db: Session, user_id: str) -> Optional[Subscription]
     ).first()
 
 
+def get_subscription_fingerprint(db: Session, user_id: str) -> tuple:
+    """(count, last change) of the user's subscriptions - changes whenever one is added or updated"""
+    row = db.query(func.count(Subscription.id), func.max(Subscription.updated_at)).filter(
+        Subscription.user_id == user_id
+    ).first()
+    return tuple(row)
+
+
 def create_subscription(
     db: Session,
     user_id: str,
@@ -100,6 +110,7 @@ def create_subscription(
     user = db.query(User).filter(User.id == user_id).first()
     if user:
         user.subscription_status = 'premium'
+    entitlements.refresh_user(db, user_id)
     
     db.commit()
     db.refresh(subscription)
@@ -120,6 +131,7 @@ def cancel_subscription(db: Session, user_id: str) -> bool:
     
     # User keeps premium until expiry
     # (Don't change user.subscription_status here - it will change when subscription expires)
+    entitlements.refresh_user(db, user_id)
     
     db.commit()
     
@@ -263,49 +275,10 @@ def create_allpay_subscription(
     user = db.query(User).filter(User.id == user_id).first()
     if user:
         user.subscription_status = 'premium'
+    entitlements.refresh_user(db, user_id)
     
     db.commit()
     db.refresh(subscription)
     
     print(f"✅ [ALLPAY] Created {plan_type} subscription for user {user_id}")
     return subscription
-
-
-def check_expired_subscriptions(db: Session) -> int:
-    """
-    Check for expired subscriptions and update user status.
-    Should be called periodically (e.g., in background job).
-    Returns the number of subscriptions marked as expired.
-    """
-    
-    # Find expired subscriptions
-    expired = db.query(Subscription).filter(
-        Subscription.status == 'active',
-        Subscription.expires_at < utc_now()
-    ).all()
-    
-    count = 0
-    for subscription in expired:
-        subscription.status = 'expired'
-        
-        # Update user status
-        user = db.query(User).filter(User.id == subscription.user_id).first()
-        if user:
-            # Check if user has another active subscription
-            other_active = db.query(Subscription).filter(
-                Subscription.user_id == user.id,
-                Subscription.status == 'active',
-                Subscription.expires_at > utc_now(),
-                Subscription.id != subscription.id
-            ).first()
-            
-            if not other_active:
-                user.subscription_status = 'free'
-        
-        count += 1
-    
-    if count > 0:
-        db.commit()
-        print(f"✅ [SUBSCRIPTION] Marked {count} subscriptions as expired")
-    
-    return count
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+auth: cached principals of a deleted account are dropped in every worker
+"""
+
+import time
+
+import auth
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def _invalidate_from_other_worker(db, user_id, monkeypatch):
+    """Send the NOTIFY only; this worker's cache is left to the listener"""
+    with monkeypatch.context() as patch:
+        patch.setattr(auth, "_drop_user_principals", lambda user_id: None)
+        auth.invalidate_user_principals(user_id, db)
+
+
+def test_invalidation_reaches_other_workers_on_commit(pg_db, notify_listener, monkeypatch):
+    principal = {"user_id": "deleted-user", "email": "d@example.com", "username": "d"}
+    auth._cache_principal("token-a", principal, None)
+    auth._cache_principal("token-b", principal, None)
+    auth._cache_principal("token-other", {**principal, "user_id": "other-user"}, None)
+
+    sender = type(pg_db)(bind=pg_db.get_bind())
+    _invalidate_from_other_worker(sender, "deleted-user", monkeypatch)
+
+    # Nothing is delivered before the commit
+    time.sleep(0.3)
+    assert auth._principals.get("token-a") is not None
+
+    sender.commit()
+    sender.close()
+    assert _wait_for(lambda: auth._principals.get("token-a") is None)
+    assert auth._principals.get("token-b") is None
+    assert auth._principals.get("token-other") is not None
+
+
+def test_rolled_back_invalidation_is_not_sent(pg_db, notify_listener, monkeypatch):
+    principal = {"user_id": "kept-user", "email": "k@example.com", "username": "k"}
+    auth._cache_principal("token-k", principal, None)
+
+    sender = type(pg_db)(bind=pg_db.get_bind())
+    _invalidate_from_other_worker(sender, "kept-user", monkeypatch)
+    sender.rollback()
+    sender.close()
+
+    time.sleep(0.3)
+    assert auth._principals.get("token-k") is not None
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Load test for llm_client: generations in flight must not stall the event loop
+
+A local fake completion server (uvicorn on a free port, in a thread) answers
+every completion after FAKE_COMPLETION_DELAY_SECONDS. While 200 generations
+are in flight through llm_client, /api/health is polled on the same event
+loop and its p99 must stay under HEALTH_P99_BOUND_MS (a blocking call would
+add a whole completion delay).
+
+Streaming runs against an httpx MockTransport stub provider: the SSE
+endpoint's "start" event must arrive within TTFB_BOUND_SECONDS even when the
+provider takes longer to send its first token.
+"""
+
+import io
+import os
+import json
+import time
+import socket
+import asyncio
+import threading
+import contextlib
+from types import SimpleNamespace
+from typing import Optional
+
+import httpx
+import pytest
+import uvicorn
+
+os.environ.setdefault("XAI_API_KEY", "test-key")
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+    import llm_client
+
+
+GENERATIONS = 200
+FAKE_COMPLETION_DELAY_SECONDS = 0.5
+HEALTH_P99_BOUND_MS = 50.0
+
+
+class FakeCompletionServer:
+    """Minimal chat completions endpoint that answers after a fixed delay"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.completed = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        while (await receive()).get("more_body"):
+            pass
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+        self.completed += 1
+        body = b'{"choices":[{"message":{"content":"hello"}}]}'
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def fake_server(monkeypatch):
+    app = FakeCompletionServer(FAKE_COMPLETION_DELAY_SECONDS)
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        assert time.monotonic() < deadline, "fake completion server did not start"
+        time.sleep(0.01)
+
+    monkeypatch.setattr(llm_client, "XAI_API_URL", f"http://127.0.0.1:{port}/v1/chat/completions")
+    # Fresh client and semaphore for this test's event loop
+    monkeypatch.setattr(llm_client, "_client", None)
+    monkeypatch.setattr(llm_client, "_semaphore", None)
+    yield app
+    server.should_exit = True
+    thread.join(timeout=10)
+
+
+async def _health_latencies(client: httpx.AsyncClient, until: Optional[asyncio.Future] = None, count: int = 0) -> list:
+    """Poll /api/health back to back (until the future is done, or count times); latencies in ms"""
+    latencies = []
+    while (until is not None and not until.done()) or len(latencies) < count:
+        started = time.perf_counter()
+        response = await client.get("/api/health")
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200
+        await asyncio.sleep(0.005)
+    return latencies
+
+
+def test_health_p99_stays_flat_with_generations_in_flight(fake_server):
+    async def scenario():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            idle = await _health_latencies(client, count=100)
+
+            messages = [{"role": "user", "content": "hi"}]
+            generations = asyncio.gather(*(llm_client.chat_completion(messages) for _ in range(GENERATIONS)))
+            # Wait until the first wave is actually at the fake server
+            while fake_server.in_flight == 0 and not generations.done():
+                await asyncio.sleep(0.01)
+            loaded = await _health_latencies(client, until=generations)
+            results = await generations
+        await llm_client.close_client()
+        return idle, loaded, results
+
+    idle, loaded, results = asyncio.run(scenario())
+
+    assert results == ["hello"] * GENERATIONS
+    assert fake_server.completed == GENERATIONS
+    assert fake_server.max_in_flight <= llm_client.LLM_MAX_CONCURRENCY
+    # Generations waited on the pool for several waves, with health polled throughout
+    assert len(loaded) >= 20
+
+    idle_p99 = llm_client._percentile(idle, 99)
+    loaded_p99 = llm_client._percentile(loaded, 99)
+    # A blocking completion would put a whole FAKE_COMPLETION_DELAY_SECONDS into p99
+    assert loaded_p99 < HEALTH_P99_BOUND_MS, (idle_p99, loaded_p99)
+    assert loaded_p99 < idle_p99 + HEALTH_P99_BOUND_MS, (idle_p99, loaded_p99)
+
+
+# ---- Streaming: time to first byte, and the deadline only covers upstream reads ----
+
+STUB_FIRST_TOKEN_DELAY_SECONDS = 1.5
+TTFB_BOUND_SECONDS = 1.0
+
+
+def _sse_chunks(deltas, first_delay: float = 0.0, gap: float = 0.0):
+    async def body():
+        await asyncio.sleep(first_delay)
+        for delta in deltas:
+            chunk = {"choices": [{"delta": {"content": delta}}]}
+            yield f"data: {json.dumps(chunk)}\n\n".encode()
+            await asyncio.sleep(gap)
+        yield b"data: [DONE]\n\n"
+    return body()
+
+
+@pytest.fixture
+def stub_provider(monkeypatch):
+    """Route llm_client to an in-process stub; set .deltas / .first_delay / .gap per test"""
+    stub = SimpleNamespace(deltas=["hello"], first_delay=0.0, gap=0.0)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/event-stream"},
+            content=_sse_chunks(stub.deltas, stub.first_delay, stub.gap),
+        )
+
+    monkeypatch.setattr(llm_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(llm_client, "_semaphore", None)
+    return stub
+
+
+async def _asgi_stream(app, method: str, path: str, body: bytes, headers: dict) -> list:
+    """Call the ASGI app directly and return (seconds since the request, body chunk) as sent"""
+    started = time.perf_counter()
+    chunks = []
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks.append((time.perf_counter() - started, message["body"].decode()))
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(key.lower().encode(), value.encode()) for key, value in headers.items()],
+        "client": ("127.0.0.1", 1), "server": ("test", 80),
+    }
+    await app(scope, receive, send)
+    return chunks
+
+
+def test_stream_start_event_arrives_before_the_first_token(pg_db, stub_provider):
+    from auth import create_access_token
+    from encryption import encrypt
+    from models import User, Contact
+
+    pg_db.add(User(
+        id="streamer", username_hash="streamer", username_encrypted=encrypt("streamer"),
+        email_hash="streamer@example.com", email_encrypted=encrypt("streamer@example.com"),
+        subscription_status="free",
+    ))
+    contact = Contact(user_id="streamer", name_encrypted=encrypt("Dana"))
+    pg_db.add(contact)
+    pg_db.commit()
+    stub_provider.deltas = ["Hi ", "Dana"]
+    stub_provider.first_delay = STUB_FIRST_TOKEN_DELAY_SECONDS
+
+    body = json.dumps({"contact_id": contact.id, "message_type": "checkin", "tone": "friendly"}).encode()
+    headers = {
+        "content-type": "application/json",
+        "authorization": f"Bearer {create_access_token({'sub': 'streamer'})}",
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        chunks = asyncio.run(_asgi_stream(main.app, "POST", "/api/messages/generate/stream", body, headers))
+
+    events = [(elapsed, text.split("\n", 1)[0]) for elapsed, text in chunks]
+    assert events[0][1] == "event: start"
+    assert events[0][0] < TTFB_BOUND_SECONDS, events
+    first_token = next(elapsed for elapsed, event in events if event == "event: token")
+    assert first_token >= STUB_FIRST_TOKEN_DELAY_SECONDS
+    assert events[-1][1] == "event: done"
+    assert '"message": "Hi Dana"' in chunks[-1][1]
+
+
+def test_slow_consumer_does_not_hit_the_upstream_deadline(stub_provider):
+    stub_provider.deltas = ["a", "b", "c"]
+
+    async def consume():
+        received = []
+        async for delta in llm_client.stream_chat_completion([{"role": "user", "content": "hi"}], deadline=0.5):
+            received.append(delta)
+            await asyncio.sleep(0.3)  # The client is slow to take each token
+        return received
+
+    assert asyncio.run(consume()) == ["a", "b", "c"]
+
+
+def test_stalled_upstream_raises_llm_error(stub_provider):
+    stub_provider.deltas = ["a", "b"]
+    stub_provider.gap = 2.0
+
+    async def consume():
+        received = []
+        with pytest.raises(llm_client.LLMError):
+            async for delta in llm_client.stream_chat_completion([{"role": "user", "content": "hi"}], deadline=0.5):
+                received.append(delta)
+        return received
+
+    assert asyncio.run(consume()) == ["a"]
+    assert llm_client._get_semaphore()._value == llm_client.LLM_MAX_CONCURRENCY
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+message_cache: only templates that carry the name placeholder are reused
+"""
+
+import io
+import contextlib
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import message_cache
+
+
+def test_is_reusable_requires_exact_placeholder():
+    assert message_cache.is_reusable("היי {{NAME}}, מזל טוב!")
+    assert message_cache.is_reusable("{{NAME}}! שמעתי עליך, {{NAME}}")
+
+    assert not message_cache.is_reusable("היי דנה, מזל טוב!")
+    assert not message_cache.is_reusable("היי {{Name}}, מזל טוב!")
+    assert not message_cache.is_reusable("היי {NAME}, מזל טוב!")
+    assert not message_cache.is_reusable("היי {{ NAME }}, מזל טוב!")
+    assert not message_cache.is_reusable("היי {{NAME}} ו-{{NAME2}}")
+
+
+def test_store_skips_template_without_placeholder():
+    cache_key = message_cache.make_cache_key("birthday", "friendly", "he")
+    rejected = message_cache.get_metrics()['rejected']
+
+    # Rejected before any setting or pool is read, so no session is needed
+    message_cache.store(None, cache_key, "היי דנה, מזל טוב!", "birthday", "friendly", "he")
+
+    assert message_cache.get_metrics()['rejected'] == rejected + 1
+    assert message_cache._pools.get(cache_key) is None
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+message_pool: live misses use the real name; pooled templates the placeholder;
+request counts are buffered; the upstream budget is shared by all workers
+"""
+
+import io
+import time
+import asyncio
+import contextlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import text
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+import llm_client
+import message_cache
+import message_pool
+from encryption import encrypt
+from models import User, Contact, MessageComboStats
+
+
+@pytest.fixture
+def contact_id(pg_db):
+    pg_db.add(User(
+        id="writer", username_hash="writer", username_encrypted=encrypt("writer"),
+        email_hash="writer@example.com", email_encrypted=encrypt("writer@example.com"),
+        subscription_status="free",
+    ))
+    contact = Contact(user_id="writer", name_encrypted=encrypt("Dana"))
+    pg_db.add(contact)
+    pg_db.commit()
+    return contact.id
+
+
+@pytest.fixture
+def pool_only(monkeypatch):
+    monkeypatch.setattr(message_pool, "is_enabled", lambda db: True)
+    monkeypatch.setattr(message_cache, "is_enabled", lambda db: False)
+    monkeypatch.setattr(message_pool, "_pools", {})
+
+
+def _request(contact_id):
+    return main.MessageRequest(contact_id=contact_id, message_type="birthday", tone="friendly")
+
+
+def test_live_miss_without_cache_prompts_with_the_real_name(pg_db, contact_id, pool_only, monkeypatch):
+    prompts = []
+
+    async def completion(messages):
+        prompts.append(messages[-1]["content"])
+        return "מזל טוב Dana!"
+
+    monkeypatch.setattr(llm_client, "chat_completion", completion)
+    generation = main.prepare_message_generation(_request(contact_id), "writer", pg_db)
+
+    text = asyncio.run(main.generate_message_text(_request(contact_id), generation, "writer", pg_db))
+
+    assert text == "מזל טוב Dana!"
+    assert "Dana" in prompts[0]
+    assert message_cache.NAME_PLACEHOLDER not in prompts[0]
+
+
+def test_pool_hit_is_rendered_for_the_contact(pg_db, contact_id, pool_only, monkeypatch):
+    generation = main.prepare_message_generation(_request(contact_id), "writer", pg_db)
+    message_pool._pools[generation["cache_key"]] = deque([(time.monotonic(), "מזל טוב {{NAME}}!")])
+
+    async def completion(messages):
+        raise AssertionError("pool hit must not call the API")
+
+    monkeypatch.setattr(llm_client, "chat_completion", completion)
+    text = asyncio.run(main.generate_message_text(_request(contact_id), generation, "writer", pg_db))
+
+    assert text == "מזל טוב Dana!"
+
+
+def test_request_counts_are_buffered_until_flush(pg_db, contact_id, pool_only, monkeypatch):
+    monkeypatch.setattr(message_pool, "_pending_requests", {})
+    for _ in range(3):
+        main.prepare_message_generation(_request(contact_id), "writer", pg_db)
+    message_pool.record_request("birthday", "warm", "en")
+
+    assert pg_db.query(MessageComboStats).count() == 0
+
+    assert message_pool.flush_requests() == 4
+    message_pool.record_request("birthday", "friendly", "he")
+    assert message_pool.flush_requests() == 1
+
+    counts = {(row.tone, row.language): row.requests for row in pg_db.query(MessageComboStats).all()}
+    assert counts == {("friendly", "he"): 4, ("warm", "en"): 1}
+    assert message_pool.flush_requests() == 0
+
+
+def test_rate_budget_is_shared_across_workers(pg_db, monkeypatch):
+    monkeypatch.setattr(message_pool, "POOL_RATE_PER_MINUTE", 6.0)
+
+    # Workers racing for the same budget row
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        granted = list(executor.map(lambda _: message_pool.try_acquire_budget(), range(40)))
+
+    assert granted.count(True) == 6
+    assert not message_pool.try_acquire_budget()
+    # Refills at the configured rate
+    pg_db.execute(text("UPDATE message_pool_budget SET updated_at = updated_at - interval '20 seconds'"))
+    pg_db.commit()
+    assert message_pool.try_acquire_budget()
+    assert message_pool.try_acquire_budget()
+    assert not message_pool.try_acquire_budget()
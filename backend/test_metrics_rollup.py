@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+metrics_rollup: the dashboard's day range is complete without a manual backfill
+"""
+
+import io
+import contextlib
+from datetime import datetime, timedelta, timezone
+
+import metrics_rollup
+from models import User, UsageStats, DailyMetrics
+
+
+def _user(index: int, created_at: datetime) -> User:
+    return User(
+        id=f"user-{index}", username_hash=f"user-{index}", username_encrypted="x",
+        email_hash=f"user-{index}@example.com", email_encrypted="x",
+        subscription_status="free", created_at=created_at,
+    )
+
+
+def test_get_days_rolls_up_days_missing_before_deploy(pg_db):
+    now = datetime.now(timezone.utc)
+    today = metrics_rollup.utc_today(now)
+    since = today - timedelta(days=30)
+    # History from before the rollup existed: a signup and some messages every other day
+    for offset in range(0, 40, 2):
+        pg_db.add(_user(offset, now - timedelta(days=offset)))
+    pg_db.flush()
+    for offset in range(0, 40, 2):
+        pg_db.add(UsageStats(user_id=f"user-{offset}", date=today - timedelta(days=offset), messages_generated=offset + 1))
+    pg_db.commit()
+    assert pg_db.query(DailyMetrics).count() == 0
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        days = metrics_rollup.get_days(pg_db, since, now)
+
+    assert [row.day for row in days] == [since + timedelta(days=i) for i in range(31)]
+    live_signups = pg_db.query(User).filter(User.created_at >= datetime.combine(since, datetime.min.time(), tzinfo=timezone.utc)).count()
+    assert sum(row.signups for row in days) == live_signups
+    assert sum(row.messages for row in days) == sum(offset + 1 for offset in range(0, 31, 2))
+    assert not [m for m in metrics_rollup.check_consistency(pg_db, 31, now) if m['field'] in metrics_rollup.EVENT_FIELDS]
+
+
+def test_get_days_only_fills_what_is_missing(pg_db):
+    now = datetime.now(timezone.utc)
+    today = metrics_rollup.utc_today(now)
+    since = today - timedelta(days=5)
+    with contextlib.redirect_stdout(io.StringIO()):
+        metrics_rollup.get_days(pg_db, since, now)
+        filled = metrics_rollup.get_metrics()['days_filled']
+        metrics_rollup.get_days(pg_db, since, now)
+
+    assert metrics_rollup.get_metrics()['days_filled'] == filled
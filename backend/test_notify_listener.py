@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+database notify listener: one connection carries every channel to its handler
+"""
+
+import time
+
+import pytest
+from sqlalchemy import text
+
+import database
+# Importing the modules registers their channels
+import auth  # noqa: F401
+import entitlements  # noqa: F401
+import reminder_broker  # noqa: F401
+import settings_service  # noqa: F401
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+@pytest.fixture
+def test_channels(monkeypatch):
+    received = {"test_channel_a": [], "test_channel_b": []}
+
+    def failing(payloads):
+        raise RuntimeError("handler bug")
+
+    monkeypatch.setitem(database._notify_handlers, "test_channel_a", (received["test_channel_a"].extend, None))
+    monkeypatch.setitem(database._notify_handlers, "test_channel_b", (received["test_channel_b"].extend, None))
+    monkeypatch.setitem(database._notify_handlers, "test_channel_failing", (failing, None))
+    return received
+
+
+def test_channels_share_one_connection(pg_db, test_channels, notify_listener):
+    for channel, payload in [("test_channel_failing", "x"), ("test_channel_a", "1"),
+                             ("test_channel_b", "2"), ("test_channel_a", "3")]:
+        pg_db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+    pg_db.commit()
+
+    # A failing handler does not stop delivery to the others
+    assert _wait_for(lambda: test_channels == {"test_channel_a": ["1", "3"], "test_channel_b": ["2"]})
+    assert database.notify_listener_alive()
+
+    listening = pg_db.execute(text("SELECT pg_listening_channels()")).fetchall()
+    assert listening == []  # Not this session's LISTENs
+    listeners = pg_db.execute(text(
+        "SELECT count(*) FROM pg_stat_activity WHERE pid <> pg_backend_pid() AND query LIKE 'LISTEN %'"
+    )).scalar()
+    assert listeners == 1
+    assert {
+        auth.PRINCIPALS_CHANNEL, entitlements.ENTITLEMENTS_CHANNEL,
+        reminder_broker.REMINDER_CHANNEL, settings_service.SETTINGS_CHANNEL,
+    } <= set(database._notify_handlers)
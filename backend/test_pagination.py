@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+List endpoints: full list without pagination params, keyset pages with them
+"""
+
+import io
+import contextlib
+
+import pytest
+from fastapi.testclient import TestClient
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+from auth import create_access_token
+from encryption import encrypt
+from models import User, Contact
+from pagination import NEXT_CURSOR_HEADER, PAGE_DEFAULT_LIMIT
+
+CONTACTS = PAGE_DEFAULT_LIMIT + 50
+
+
+@pytest.fixture
+def owner(pg_db):
+    pg_db.add(User(
+        id="owner", username_hash="owner", username_encrypted=encrypt("owner"),
+        email_hash="owner@example.com", email_encrypted=encrypt("owner@example.com"),
+        subscription_status="free",
+    ))
+    pg_db.add_all([Contact(user_id="owner", name_encrypted=encrypt(f"contact {i}")) for i in range(CONTACTS)])
+    pg_db.commit()
+    return {"Authorization": f"Bearer {create_access_token({'sub': 'owner'})}"}
+
+
+def test_unpaginated_request_returns_everything(owner):
+    response = TestClient(main.app).get("/api/contacts", headers=owner)
+
+    assert response.status_code == 200
+    assert len(response.json()) == CONTACTS
+    assert NEXT_CURSOR_HEADER not in response.headers
+
+
+def test_pages_follow_the_cursor(owner):
+    client = TestClient(main.app)
+    names = []
+    params = {"limit": 100}
+    while True:
+        response = client.get("/api/contacts", headers=owner, params=params)
+        assert response.status_code == 200
+        names += [contact["name"] for contact in response.json()]
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if not cursor:
+            break
+        params = {"limit": 100, "cursor": cursor}
+
+    assert names == [f"contact {i}" for i in range(CONTACTS)]
+
+
+def test_cursor_without_limit_uses_default_page_size(owner):
+    client = TestClient(main.app)
+    first = client.get("/api/contacts", headers=owner, params={"limit": 10})
+    response = client.get("/api/contacts", headers=owner, params={"cursor": first.headers[NEXT_CURSOR_HEADER]})
+
+    assert len(response.json()) == PAGE_DEFAULT_LIMIT
+    assert NEXT_CURSOR_HEADER in response.headers
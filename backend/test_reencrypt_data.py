@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+reencrypt_data: rewriting legacy values never overwrites a concurrent edit
+"""
+
+import io
+import contextlib
+
+import encryption
+import reencrypt_data
+from models import User, Contact
+
+
+def _legacy(plaintext: str) -> str:
+    return encryption._encrypt_bytes(plaintext.encode("utf-8"), "fernet")
+
+
+def test_concurrent_edit_between_read_and_write_is_kept(pg_db, monkeypatch):
+    monkeypatch.setattr(encryption, "ENCRYPTION_FORMAT", "aesgcm")
+    pg_db.add(User(
+        id="owner", username_hash="owner", username_encrypted="x",
+        email_hash="owner@example.com", email_encrypted="x", subscription_status="free",
+    ))
+    contacts = [Contact(user_id="owner", name_encrypted=_legacy(f"contact {i}")) for i in range(5)]
+    pg_db.add_all(contacts)
+    pg_db.commit()
+    edited_id = contacts[2].id
+    edited_value = contacts[2].name_encrypted
+
+    # The app renames contact 2 after the script read its batch, before it writes
+    Session = type(pg_db)
+    reencrypt = reencrypt_data.reencrypt
+
+    def reencrypt_racing_an_edit(ciphertext):
+        if ciphertext == edited_value:
+            app_db = Session(bind=pg_db.get_bind())
+            app_db.query(Contact).filter(Contact.id == edited_id).update(
+                {Contact.name_encrypted: encryption.encrypt("renamed")}
+            )
+            app_db.commit()
+            app_db.close()
+        return reencrypt(ciphertext)
+
+    monkeypatch.setattr(reencrypt_data, "reencrypt", reencrypt_racing_an_edit)
+
+    script_db = Session(bind=pg_db.get_bind())
+    with contextlib.redirect_stdout(io.StringIO()):
+        rewritten = reencrypt_data.reencrypt_model(script_db, Contact, ["name_encrypted"], 2, 0, False)
+    script_db.close()
+
+    assert rewritten == 4
+    pg_db.expire_all()
+    names = {c.id: c.name_encrypted for c in pg_db.query(Contact).all()}
+    assert encryption.decrypt(names[edited_id]) == "renamed"
+    for index, contact in enumerate(contacts):
+        assert not encryption.needs_reencryption(names[contact.id])
+        if contact.id != edited_id:
+            assert encryption.decrypt(names[contact.id]) == f"contact {index}"
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Migration 21: typed reminder schedules keep the legacy text and unknown time zones
+"""
+
+import io
+import contextlib
+
+from sqlalchemy import text
+
+import database
+from models import User, Contact
+
+
+def _legacy_reminders(db, rows):
+    """Back to the pre-migration schema, with reminders carrying the given (weekdays, specific_time, timezone)"""
+    db.add(User(
+        id="owner", username_hash="owner", username_encrypted="x",
+        email_hash="owner@example.com", email_encrypted="x", subscription_status="free",
+    ))
+    contact = Contact(user_id="owner", name_encrypted="x")
+    db.add(contact)
+    db.flush()
+    db.execute(text("ALTER TABLE reminders DROP COLUMN weekday_mask, DROP COLUMN time_minutes;"))
+    ids = []
+    for weekdays, specific_time, zone in rows:
+        ids.append(db.execute(text("""
+            INSERT INTO reminders (user_id, contact_id, reminder_type, weekdays, specific_time, timezone, enabled,
+                                   one_time_triggered, created_at)
+            VALUES ('owner', :contact_id, 'weekly', :weekdays, :specific_time, :timezone, TRUE, FALSE, now())
+            RETURNING id;
+        """), {"contact_id": contact.id, "weekdays": weekdays, "specific_time": specific_time, "timezone": zone}).scalar())
+    db.commit()
+    return ids
+
+
+def _migrate() -> str:
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        database._run_migrations()
+    return output.getvalue()
+
+
+def _schedule(db, reminder_id):
+    return db.execute(text(
+        "SELECT weekday_mask, time_minutes, weekdays, specific_time, timezone FROM reminders WHERE id = :id;"
+    ), {"id": reminder_id}).one()
+
+
+def test_conversion_keeps_text_and_reports_unconverted_rows(pg_db):
+    good, bad_weekdays, bad_time = _legacy_reminders(pg_db, [
+        ("[0,2,4]", "14:30", "Asia/Jerusalem"),
+        ("[1,,2]", "08:00", "Asia/Jerusalem"),
+        ("[3]", "25:00", "Asia/Jerusalem"),
+    ])
+
+    output = _migrate()
+
+    assert tuple(_schedule(pg_db, good)) == (21, 870, "[0,2,4]", "14:30", "Asia/Jerusalem")
+    # Misses stay NULL, but the source text survives for a manual fix
+    assert tuple(_schedule(pg_db, bad_weekdays))[:3] == (None, 480, "[1,,2]")
+    assert tuple(_schedule(pg_db, bad_time))[1:4] == (None, "[3]", "25:00")
+    assert "2 reminders" in output
+    unconverted = pg_db.execute(text(database.UNCONVERTED_REMINDER_SCHEDULES_SQL)).fetchall()
+    assert [row.id for row in unconverted] == [bad_weekdays, bad_time]
+
+
+def test_unknown_timezones_are_left_as_stored(pg_db):
+    lowercase, unknown, missing = _legacy_reminders(pg_db, [
+        ("[1]", "09:00", " asia/jerusalem "),
+        ("[1]", "09:00", "Mars/Olympus_Mons"),
+        ("[1]", "09:00", None),
+    ])
+
+    output = _migrate()
+
+    assert _schedule(pg_db, lowercase).timezone == "Asia/Jerusalem"
+    assert _schedule(pg_db, unknown).timezone == "Mars/Olympus_Mons"
+    assert _schedule(pg_db, missing).timezone is None
+    assert "Mars/Olympus_Mons" in output
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+/api/reminders/check returns due reminders whoever materialized them, once
+"""
+
+import io
+import contextlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+import reminder_scheduler
+from auth import create_access_token
+from encryption import encrypt
+from models import User, Contact, Reminder
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+@pytest.fixture
+def owner(pg_db):
+    pg_db.add(User(
+        id="owner", username_hash="owner", username_encrypted=encrypt("owner"),
+        email_hash="owner@example.com", email_encrypted=encrypt("owner@example.com"),
+        subscription_status="free",
+    ))
+    pg_db.commit()
+    return {"Authorization": f"Bearer {create_access_token({'sub': 'owner'})}"}
+
+
+def _due_reminder(db, minutes_ago: int) -> int:
+    contact = Contact(user_id="owner", name_encrypted=encrypt("Dana"))
+    db.add(contact)
+    db.flush()
+    reminder = Reminder(
+        user_id="owner", contact_id=contact.id, reminder_type="recurring",
+        interval_type="days", interval_value=1,
+        next_trigger=datetime.now(timezone.utc) - timedelta(minutes=minutes_ago),
+    )
+    db.add(reminder)
+    db.commit()
+    return reminder.id
+
+
+def test_check_returns_events_materialized_by_the_worker(pg_db, client, owner):
+    reminder_id = _due_reminder(pg_db, minutes_ago=10)
+    # The client polls less often than the grace period: the worker got there first
+    with contextlib.redirect_stdout(io.StringIO()):
+        worker_events = reminder_scheduler.materialize_due(
+            pg_db, main.next_triggers_for_reminders,
+            grace_seconds=reminder_scheduler.REMINDER_SCHEDULER_GRACE_SECONDS
+        )
+    assert [event.reminder_id for event in worker_events] == [reminder_id]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        first = client.get("/api/reminders/check", headers=owner)
+        second = client.get("/api/reminders/check", headers=owner)
+
+    assert first.status_code == 200
+    assert [r["id"] for r in first.json()] == [reminder_id]
+    # Delivered once
+    assert second.json() == []
+
+
+def test_check_materializes_and_returns_its_own_due_reminders(pg_db, client, owner):
+    reminder_id = _due_reminder(pg_db, minutes_ago=1)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = client.get("/api/reminders/check", headers=owner)
+
+    assert [r["id"] for r in response.json()] == [reminder_id]
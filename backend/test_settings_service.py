@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+settings_service: an invalidation that arrives during a reload is not lost
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import settings_service
+
+
+class FakeSettingsDB:
+    """Answers the snapshot query from a dict; on_query runs while the query is 'in flight'"""
+
+    def __init__(self, values):
+        self.values = values
+        self.queries = 0
+        self.on_query = None
+
+    def query(self, *columns):
+        return self
+
+    def all(self):
+        self.queries += 1
+        rows = [SimpleNamespace(key=key, value=value) for key, value in self.values.items()]
+        if self.on_query is not None:
+            on_query, self.on_query = self.on_query, None
+            on_query()
+        return rows
+
+
+@pytest.fixture(autouse=True)
+def fresh_snapshot(monkeypatch):
+    monkeypatch.setattr(settings_service, "_values", {})
+    monkeypatch.setattr(settings_service, "_loaded_at", None)
+    monkeypatch.setattr(settings_service, "_dirty", True)
+
+
+def test_invalidation_during_reload_triggers_another_reload():
+    db = FakeSettingsDB({"trial_days": "7"})
+    assert settings_service.get(db, "trial_days") == "7"
+
+    # An admin change commits (and its NOTIFY lands) after the reload read the old rows
+    def change_committed_during_load():
+        db.values = {"trial_days": "14"}
+        settings_service.invalidate()
+
+    settings_service.invalidate()
+    db.on_query = change_committed_during_load
+    assert settings_service.get(db, "trial_days") == "7"
+
+    assert settings_service.get(db, "trial_days") == "14"
+    assert db.queries == 3
+
+
+def test_failed_reload_stays_dirty():
+    db = FakeSettingsDB({"trial_days": "7"})
+    settings_service.get(db, "trial_days")
+    settings_service.invalidate()
+
+    def fail():
+        raise RuntimeError("connection lost")
+
+    db.on_query = fail
+    with pytest.raises(RuntimeError):
+        settings_service.get(db, "trial_days")
+
+    assert settings_service.get(db, "trial_days") == "7"
+    assert db.queries == 3
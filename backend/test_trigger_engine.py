@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+trigger_engine: randomized equivalence with a reference implementation
+
+trigger_engine.next_triggers is compared with an independent per-reminder
+implementation on pytz, for random schedules and "now" values spread around
+the DST transitions of several time zones. Cases are drawn from a seeded
+generator, so a failure reproduces with the same seed.
+"""
+
+import random
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytz
+
+import trigger_engine
+from trigger_engine import ReminderSchedule
+
+
+# (zone, local DST transition dates in 2026)
+DST_ZONES = [
+    ("Asia/Jerusalem", ["2026-03-27", "2026-10-25"]),
+    ("America/New_York", ["2026-03-08", "2026-11-01"]),
+    ("Europe/London", ["2026-03-29", "2026-10-25"]),
+    ("Australia/Sydney", ["2026-04-05", "2026-10-04"]),
+    ("UTC", ["2026-06-01"]),
+    (None, ["2026-06-01"]),
+]
+# Near the transitions most of the interesting times are in the small hours
+TIMES = [0, 60, 90, 120, 150, 180, 210, 1439] + list(range(0, 1440, 15))
+BATCHES_PER_ZONE = 300
+
+
+def reference_next_trigger(schedule: ReminderSchedule, now: datetime):
+    """Straightforward per-reminder calculation on pytz (fold=0 semantics: the pre-transition offset)"""
+    if schedule.reminder_type == 'one_time':
+        return schedule.scheduled_datetime if schedule.scheduled_datetime and schedule.scheduled_datetime > now else None
+    if schedule.reminder_type == 'recurring':
+        if not schedule.interval_type or not schedule.interval_value:
+            return None
+        unit = 'hours' if schedule.interval_type == 'hours' else 'days'
+        return (schedule.last_triggered or now) + timedelta(**{unit: schedule.interval_value})
+
+    mask = trigger_engine.ALL_WEEKDAYS_MASK if schedule.reminder_type == 'daily' else schedule.weekday_mask
+    if schedule.time_minutes is None or not mask:
+        return None
+    tz = pytz.timezone(schedule.timezone) if schedule.timezone else pytz.UTC
+    hour, minute = divmod(schedule.time_minutes, 60)
+    local_today = now.astimezone(tz).date()
+    for offset in range(8):
+        day = local_today + timedelta(days=offset)
+        if not mask & (1 << day.isoweekday() % 7):
+            continue
+        naive = datetime(day.year, day.month, day.day, hour, minute)
+        try:
+            local = tz.localize(naive, is_dst=None)
+        except pytz.NonExistentTimeError:
+            local = tz.localize(naive, is_dst=False)  # still on the pre-transition (standard) offset
+        except pytz.AmbiguousTimeError:
+            local = tz.localize(naive, is_dst=True)  # first occurrence
+        candidate = local.astimezone(timezone.utc)
+        if candidate > now:
+            return candidate
+    return None
+
+
+def random_schedule(rng: random.Random, zone) -> ReminderSchedule:
+    reminder_type = rng.choice(['daily', 'weekly', 'weekly', 'recurring', 'one_time'])
+    return ReminderSchedule(
+        reminder_type=reminder_type,
+        interval_type=rng.choice(['hours', 'days']),
+        interval_value=rng.randint(1, 30),
+        scheduled_datetime=datetime(2026, 6, 1, tzinfo=timezone.utc) + timedelta(minutes=rng.randint(-10**6, 10**6)),
+        weekday_mask=rng.randint(0, trigger_engine.ALL_WEEKDAYS_MASK),
+        time_minutes=rng.choice(TIMES),
+        timezone=zone,
+        last_triggered=rng.choice([None, datetime(2026, 6, 1, tzinfo=timezone.utc)])
+    )
+
+
+def random_now(rng: random.Random, transitions) -> datetime:
+    transition = datetime.fromisoformat(rng.choice(transitions)).replace(tzinfo=timezone.utc)
+    return transition + timedelta(minutes=rng.randint(-3 * 1440, 3 * 1440), seconds=rng.randint(0, 59))
+
+
+@pytest.mark.parametrize("zone,transitions", DST_ZONES, ids=[zone or "none" for zone, _ in DST_ZONES])
+def test_batch_matches_reference_around_dst(zone, transitions):
+    rng = random.Random(f"2026-{zone}")
+    mismatches = []
+    for _ in range(BATCHES_PER_ZONE):
+        now = random_now(rng, transitions)
+        schedules = [random_schedule(rng, zone) for _ in range(rng.randint(1, 40))]
+        for schedule, got in zip(schedules, trigger_engine.next_triggers(schedules, now)):
+            expected = reference_next_trigger(schedule, now)
+            if got != expected:
+                mismatches.append((now, schedule, got, expected))
+    assert not mismatches, mismatches[:5]
+
+
+def test_mixed_zone_batch_matches_single_calls():
+    rng = random.Random(7)
+    now = datetime(2026, 10, 25, 0, 30, tzinfo=timezone.utc)
+    schedules = [random_schedule(rng, rng.choice(DST_ZONES)[0]) for _ in range(2000)]
+
+    assert trigger_engine.next_triggers(schedules, now) == [
+        trigger_engine.next_trigger(schedule, now) for schedule in schedules
+    ]
+
+
+def test_weekly_with_timezone_honours_weekdays():
+    # Wednesday 2026-03-25; Friday 09:00 in Jerusalem is already on summer time (+03:00)
+    now = datetime(2026, 3, 25, 12, 0, tzinfo=timezone.utc)
+    friday_only = trigger_engine.weekdays_to_mask([5])
+    schedule = ReminderSchedule(
+        reminder_type='weekly', weekday_mask=friday_only, time_minutes=9 * 60, timezone="Asia/Jerusalem"
+    )
+
+    assert trigger_engine.next_trigger(schedule, now) == datetime(2026, 3, 27, 6, 0, tzinfo=timezone.utc)
+
+
+def test_time_in_dst_gap_uses_pre_transition_offset():
+    # Jerusalem skips 02:00-03:00 on 2026-03-27; 02:30 resolves with the old +02:00 offset
+    now = datetime(2026, 3, 26, 12, 0, tzinfo=timezone.utc)
+    schedule = ReminderSchedule(reminder_type='daily', time_minutes=150, timezone="Asia/Jerusalem")
+
+    assert trigger_engine.next_trigger(schedule, now) == datetime(2026, 3, 27, 0, 30, tzinfo=timezone.utc)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+usage_limiter: counters stay exact and limits hold under parallel writes
+
+The parallel tests fire PARALLEL statements at once from PARALLEL threads,
+each on its own connection, all against the same user's usage_stats row.
+The usage gate's statement count is pinned against the per-figure path it
+replaced (see bench_usage_gate.py).
+"""
+
+import threading
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import bench_usage_gate
+import settings_service
+import usage_limiter
+from models import User, UsageStats
+
+
+PARALLEL = 100
+
+
+@pytest.fixture
+def user_id(pg_db):
+    user = User(
+        id="usage-user",
+        username_hash="usage-user",
+        username_encrypted="x",
+        email_hash="usage-user@example.com",
+        email_encrypted="x",
+        subscription_status="free",
+    )
+    pg_db.add(user)
+    pg_db.commit()
+    return user.id
+
+
+@pytest.fixture
+def run_parallel(pg_engine):
+    """Run fn(db) PARALLEL times at once, each call on its own session and connection"""
+    engine = create_engine(pg_engine.url, pool_size=PARALLEL, max_overflow=0)
+    Session = sessionmaker(bind=engine)
+
+    def run(fn):
+        barrier = threading.Barrier(PARALLEL)
+
+        def call(_):
+            db = Session()
+            try:
+                db.connection()  # Check out the connection before the start line
+                barrier.wait()
+                return fn(db)
+            finally:
+                db.close()
+
+        with ThreadPoolExecutor(max_workers=PARALLEL) as executor:
+            return list(executor.map(call, range(PARALLEL)))
+
+    yield run
+    engine.dispose()
+
+
+def _today_rows(db, user_id):
+    db.expire_all()
+    return db.query(UsageStats).filter(UsageStats.user_id == user_id, UsageStats.date == date.today()).all()
+
+
+def test_parallel_increments_are_exact(pg_db, user_id, run_parallel):
+    results = run_parallel(lambda db: usage_limiter.increment_usage(db, user_id))
+
+    assert all(result is not None for result in results)
+    # Every statement saw a distinct counter value: no lost or merged increments
+    assert sorted(r['messages_generated'] for r in results) == list(range(1, PARALLEL + 1))
+    rows = _today_rows(pg_db, user_id)
+    assert len(rows) == 1
+    assert rows[0].messages_generated == PARALLEL
+
+
+def test_parallel_reservations_stop_at_daily_limit(pg_db, user_id, run_parallel):
+    usage_limiter.increment_usage(pg_db, user_id, messages=0, bonus=3)
+
+    results = run_parallel(lambda db: usage_limiter._reserve_within_limits(db, user_id, 10, 1000))
+
+    granted = [r for r in results if r is not None]
+    assert len(granted) == 13  # daily limit plus today's rewarded bonus
+    assert sorted(r['messages_generated'] for r in granted) == list(range(1, 14))
+    rows = _today_rows(pg_db, user_id)
+    assert len(rows) == 1
+    assert rows[0].messages_generated == 13
+
+
+def test_parallel_reservations_stop_at_monthly_limit(pg_db, user_id, run_parallel):
+    results = run_parallel(lambda db: usage_limiter._reserve_within_limits(db, user_id, 50, 7))
+
+    granted = [r for r in results if r is not None]
+    assert len(granted) == 7
+    rows = _today_rows(pg_db, user_id)
+    assert len(rows) == 1
+    assert rows[0].messages_generated == 7
+
+
+def test_parallel_reservations_count_earlier_days_toward_monthly_limit(pg_db, user_id, run_parallel):
+    first_of_month = date.today().replace(day=1)
+    if first_of_month == date.today():
+        pytest.skip("no earlier day this month")
+    pg_db.add(UsageStats(user_id=user_id, date=first_of_month, messages_generated=5, rewarded_video_bonus=0))
+    pg_db.commit()
+
+    results = run_parallel(lambda db: usage_limiter._reserve_within_limits(db, user_id, 50, 8))
+
+    assert len([r for r in results if r is not None]) == 3
+    assert _today_rows(pg_db, user_id)[0].messages_generated == 3
+
+
+def test_usage_gate_statement_counts(pg_db):
+    users = bench_usage_gate.create_users(pg_db)
+    settings_service.invalidate()
+    usage_limiter.check_can_generate_message(pg_db, users['free'])  # settings snapshot loaded
+
+    for status, user_id in users.items():
+        before, legacy = bench_usage_gate.count_statements(
+            bench_usage_gate.legacy_check_can_generate_message, pg_db, user_id
+        )
+        miss, result = bench_usage_gate.count_statements(bench_usage_gate.snapshot_miss, pg_db, user_id)
+        hit, _ = bench_usage_gate.count_statements(usage_limiter.check_can_generate_message, pg_db, user_id)
+
+        assert result[1]['status'] == legacy[1]['status'] == status
+        assert result[0] == legacy[0]
+        assert (miss, hit) == (1, 0), status
+    assert before == 2  # premium: user and subscription
+    assert bench_usage_gate.count_statements(
+        bench_usage_gate.legacy_check_can_generate_message, pg_db, users['free']
+    )[0] == 10
+
+
+def test_missing_user_is_refused(pg_db):
+    allowed, info = usage_limiter.check_can_generate_message(pg_db, "no-such-user")
+
+    assert not allowed
+    assert info['reason'] == 'user_not_found'
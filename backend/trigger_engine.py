@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Trigger Engine - Next-trigger calculation for reminders, one or many at a time
+
+Schedules are plain tuples: the weekdays are a 7-bit mask (bit 0 = Sunday,
+matching the client's Date.getDay()) and the time of day is minutes after
+local midnight. Time zones are cached zoneinfo objects. The batch entry
+point groups reminders by time zone and computes each distinct
+(type, time, weekdays) slot once per zone, so the cost of a batch grows
+with the number of distinct schedules rather than the number of reminders.
+
+Local times that fall in a DST gap or overlap resolve with the offset in
+effect before the transition (zoneinfo fold=0).
+"""
+
+from datetime import datetime, date, timedelta, timezone
+from functools import lru_cache
+from typing import Optional, List, Iterable, NamedTuple, Dict, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError, available_timezones
+
+ALL_WEEKDAYS_MASK = 0b1111111
+
+
+class ReminderSchedule(NamedTuple):
+    reminder_type: str = 'recurring'
+    interval_type: Optional[str] = None
+    interval_value: Optional[int] = None
+    scheduled_datetime: Optional[datetime] = None
+    weekday_mask: int = 0
+    time_minutes: Optional[int] = None
+    timezone: Optional[str] = None
+    last_triggered: Optional[datetime] = None
+
+
+@lru_cache(maxsize=512)
+def get_zone(name: Optional[str]):
+    """Cached zoneinfo lookup; unknown or missing names fall back to UTC"""
+    if not name:
+        return timezone.utc
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        print(f"⚠️ [TRIGGERS] Unknown timezone {name!r}, using UTC")
+        return timezone.utc
+
+
+@lru_cache(maxsize=1)
+def _zone_names() -> Dict[str, str]:
+    """lowercase -> canonical spelling of every known IANA name"""
+    names = available_timezones()
+    if not names:
+        print("⚠️ [TRIGGERS] No time zone database found (install tzdata); every zone falls back to UTC")
+    return {name.lower(): name for name in names}
+
+
+@lru_cache(maxsize=512)
+def normalize_timezone(name: Optional[str]) -> Optional[str]:
+    """Canonical IANA id for a client-supplied name (" asia/jerusalem " -> "Asia/Jerusalem"), None if unknown"""
+    if not name or not name.strip():
+        return None
+    return _zone_names().get(name.strip().lower())
+
+
+@lru_cache(maxsize=2048)
+def parse_time(specific_time: Optional[str]) -> Optional[int]:
+    """"14:30" -> minutes after midnight (None if missing or invalid)"""
+    if not specific_time:
+        return None
+    try:
+        hour, minute = map(int, specific_time.split(':'))
+    except (ValueError, AttributeError):
+        return None
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        return None
+    return hour * 60 + minute
+
+
+def format_time(time_minutes: Optional[int]) -> Optional[str]:
+    """Minutes after midnight -> "14:30" """
+    if time_minutes is None:
+        return None
+    return f"{time_minutes // 60:02d}:{time_minutes % 60:02d}"
+
+
+def weekdays_to_mask(weekdays: Optional[Iterable[int]]) -> int:
+    """[0, 2, 4] -> bitmask (bit 0 = Sunday)"""
+    mask = 0
+    for weekday in weekdays or ():
+        if 0 <= weekday <= 6:
+            mask |= 1 << weekday
+    return mask
+
+
+def mask_to_weekdays(mask: Optional[int]) -> List[int]:
+    """Bitmask -> sorted weekday list"""
+    return [weekday for weekday in range(7) if mask and mask >> weekday & 1]
+
+
+def make_schedule(
+    reminder_type: Optional[str],
+    interval_type: Optional[str] = None,
+    interval_value: Optional[int] = None,
+    scheduled_datetime: Optional[datetime] = None,
+    weekdays: Optional[Iterable[int]] = None,
+    specific_time: Optional[str] = None,
+    last_triggered: Optional[datetime] = None,
+    user_timezone: Optional[str] = None
+) -> ReminderSchedule:
+    """Build a schedule from the API's field representation"""
+    return ReminderSchedule(
+        reminder_type=reminder_type or 'recurring',
+        interval_type=interval_type,
+        interval_value=interval_value,
+        scheduled_datetime=scheduled_datetime,
+        weekday_mask=weekdays_to_mask(weekdays),
+        time_minutes=parse_time(specific_time),
+        timezone=user_timezone,
+        last_triggered=last_triggered
+    )
+
+
+def _next_local_slot(zone, local_today: date, now: datetime, time_minutes: int, weekday_mask: int) -> Optional[datetime]:
+    """First wall-clock slot at time_minutes on an allowed weekday that is after now (UTC result)"""
+    hour, minute = divmod(time_minutes, 60)
+    # Sunday = 0
+    weekday = (local_today.weekday() + 1) % 7
+    # 8 days: today's slot may already have passed when only today's weekday is allowed
+    for offset in range(8):
+        if weekday_mask >> ((weekday + offset) % 7) & 1:
+            day = local_today + timedelta(days=offset)
+            candidate = datetime(day.year, day.month, day.day, hour, minute, tzinfo=zone).astimezone(timezone.utc)
+            if candidate > now:
+                return candidate
+    return None
+
+
+def _next_interval(schedule: ReminderSchedule, now: datetime) -> Optional[datetime]:
+    if not schedule.interval_type or not schedule.interval_value:
+        return None
+    if schedule.interval_type == 'hours':
+        delta = timedelta(hours=schedule.interval_value)
+    else:  # days
+        delta = timedelta(days=schedule.interval_value)
+    return (schedule.last_triggered or now) + delta
+
+
+def _slot_key(schedule: ReminderSchedule) -> Optional[Tuple[int, int]]:
+    """(time_minutes, weekday_mask) for daily/weekly schedules, None if incomplete"""
+    if schedule.time_minutes is None:
+        return None
+    if schedule.reminder_type == 'daily':
+        return schedule.time_minutes, ALL_WEEKDAYS_MASK
+    if not schedule.weekday_mask:
+        return None
+    return schedule.time_minutes, schedule.weekday_mask
+
+
+def next_triggers(schedules: List[ReminderSchedule], now: Optional[datetime] = None) -> List[Optional[datetime]]:
+    """Next trigger (UTC) for each schedule, in input order. None when there is no next occurrence."""
+    now = now or datetime.now(timezone.utc)
+    results: List[Optional[datetime]] = [None] * len(schedules)
+
+    # time zone -> [(index, slot key)] for the wall-clock types
+    by_zone: Dict[Optional[str], List[Tuple[int, Tuple[int, int]]]] = {}
+    for index, schedule in enumerate(schedules):
+        reminder_type = schedule.reminder_type
+        if reminder_type == 'one_time':
+            scheduled = schedule.scheduled_datetime
+            results[index] = scheduled if scheduled and scheduled > now else None
+        elif reminder_type == 'recurring':
+            results[index] = _next_interval(schedule, now)
+        elif reminder_type in ('daily', 'weekly'):
+            key = _slot_key(schedule)
+            if key is not None:
+                by_zone.setdefault(schedule.timezone, []).append((index, key))
+
+    for zone_name, members in by_zone.items():
+        zone = get_zone(zone_name)
+        local_today = now.astimezone(zone).date()
+        slots: Dict[Tuple[int, int], Optional[datetime]] = {}
+        for index, key in members:
+            if key not in slots:
+                slots[key] = _next_local_slot(zone, local_today, now, *key)
+            results[index] = slots[key]
+
+    return results
+
+
+def next_trigger(schedule: ReminderSchedule, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Next trigger (UTC) for a single schedule"""
+    return next_triggers([schedule], now)[0]
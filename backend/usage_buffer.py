@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Usage Buffer - Write-behind message counters for premium and trial users
+
+For users without a quota the daily counter only feeds analytics, so their
+increments are aggregated in memory per (user_id, date) and written in one
+batched upsert every USAGE_BUFFER_FLUSH_SECONDS, and once more on shutdown.
+Free users always go through the strict path in usage_limiter.
+"""
+
+import os
+import time
+import asyncio
+import threading
+from datetime import date
+from typing import Optional, Dict, Any, Tuple
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+
+from database import SessionLocal
+from models import UsageStats
+
+
+USAGE_BUFFER_ENABLED = os.getenv("USAGE_BUFFER_ENABLED", "false").lower() in ('true', '1', 'yes')
+USAGE_BUFFER_FLUSH_SECONDS = float(os.getenv("USAGE_BUFFER_FLUSH_SECONDS", "5"))
+
+# (user_id, date) -> messages not yet written
+_pending: Dict[Tuple[str, date], int] = {}
+_oldest_pending: Optional[float] = None
+_lock = threading.Lock()
+_worker_task: Optional[asyncio.Task] = None
+
+_metrics = {
+    'buffered': 0,
+    'flushes': 0,
+    'flushed_messages': 0,
+    'flush_errors': 0,
+}
+
+
+def is_enabled() -> bool:
+    """Buffering is switched on per deployment (USAGE_BUFFER_ENABLED)"""
+    return USAGE_BUFFER_ENABLED
+
+
+def add(user_id: str, messages: int = 1) -> None:
+    """Count messages for today without touching the database"""
+    global _oldest_pending
+    key = (user_id, date.today())
+    with _lock:
+        _pending[key] = _pending.get(key, 0) + messages
+        if _oldest_pending is None:
+            _oldest_pending = time.monotonic()
+        _metrics['buffered'] += messages
+
+
+def release(user_id: str) -> bool:
+    """Take back one buffered message for today. Returns False if none is pending."""
+    key = (user_id, date.today())
+    with _lock:
+        if _pending.get(key, 0) <= 0:
+            return False
+        _pending[key] -= 1
+        if not _pending[key]:
+            del _pending[key]
+        return True
+
+
+def flush() -> int:
+    """Write all pending counters in one upsert. Returns the number of messages written."""
+    global _pending, _oldest_pending
+    with _lock:
+        batch, oldest = _pending, _oldest_pending
+        _pending, _oldest_pending = {}, None
+    if not batch:
+        return 0
+
+    stmt = insert(UsageStats).values([
+        {
+            'user_id': user_id,
+            'date': day,
+            'messages_generated': messages,
+            'rewarded_video_bonus': 0
+        }
+        for (user_id, day), messages in batch.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        constraint='uq_usage_stats_user_date',
+        set_={
+            'messages_generated': UsageStats.messages_generated + stmt.excluded.messages_generated,
+            'updated_at': func.now()
+        }
+    )
+
+    db = SessionLocal()
+    try:
+        db.execute(stmt)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        # Keep the counts for the next round
+        with _lock:
+            for key, messages in batch.items():
+                _pending[key] = _pending.get(key, 0) + messages
+            if oldest is not None and (_oldest_pending is None or oldest < _oldest_pending):
+                _oldest_pending = oldest
+        _metrics['flush_errors'] += 1
+        print(f"⚠️ [USAGE BUFFER] Flush failed, will retry: {e}")
+        return 0
+    finally:
+        db.close()
+
+    written = sum(batch.values())
+    _metrics['flushes'] += 1
+    _metrics['flushed_messages'] += written
+    return written
+
+
+async def _worker_loop() -> None:
+    while True:
+        await asyncio.sleep(USAGE_BUFFER_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(flush)
+        except Exception as e:
+            print(f"⚠️ [USAGE BUFFER] Flush error: {e}")
+
+
+def start_worker() -> None:
+    """Start the periodic flush (call from the startup event)"""
+    global _worker_task
+    if not is_enabled():
+        return
+    if _worker_task is None or _worker_task.done():
+        _worker_task = asyncio.create_task(_worker_loop())
+
+
+async def stop_worker() -> None:
+    """Stop the periodic flush and write what is left (call from the shutdown event)"""
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+    written = await asyncio.to_thread(flush)
+    if written:
+        print(f"✅ [USAGE BUFFER] Flushed {written} buffered messages on shutdown")
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Return buffer counters and flush lag (age of the oldest unwritten increment)"""
+    with _lock:
+        pending_messages = sum(_pending.values())
+        pending_keys = len(_pending)
+        oldest = _oldest_pending
+    return {
+        **_metrics,
+        'enabled': is_enabled(),
+        'pending_messages': pending_messages,
+        'pending_keys': pending_keys,
+        'flush_lag_seconds': round(time.monotonic() - oldest, 1) if oldest is not None else 0,
+    }
@@ -3,13 +3,17 @@
 Usage Limiter - Manages usage limits for free users
 """
 
-from datetime import datetime, date, timedelta, timezone
-from typing import Tuple, Optional
+from datetime import datetime, date, timezone
+from typing import Tuple, Optional, Mapping, Any
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, select, literal, and_
+from sqlalchemy.dialects.postgresql import insert
 import json
 
-from models import User, UsageStats, AppSettings, Subscription
+from models import User, UsageStats
+import entitlements
+import settings_service
+import usage_buffer
 
 
 def utc_now():
@@ -18,75 +22,102 @@ def utc_now():
 
 
 def get_setting(db: Session, key: str, default: str = None) -> str:
-    """Get a setting value from app_settings table"""
-    setting = db.query(AppSettings).filter(AppSettings.key == key).first()
-    return setting.value if setting else default
+    """Get a setting value (from the cached app_settings snapshot)"""
+    return settings_service.get(db, key, default)
 
 
 def get_setting_int(db: Session, key: str, default: int = 0) -> int:
     """Get a setting value as integer"""
-    value = get_setting(db, key, str(default))
-    try:
-        return int(value)
-    except (ValueError, TypeError):
-        return default
+    return settings_service.get_int(db, key, default)
 
 
 def get_setting_bool(db: Session, key: str, default: bool = False) -> bool:
     """Get a setting value as boolean"""
-    value = get_setting(db, key, str(default).lower())
-    return value.lower() in ('true', '1', 'yes')
+    return settings_service.get_bool(db, key, default)
+
+
+def get_usage_snapshot(db: Session, user_id: str) -> Optional[Mapping[str, Any]]:
+    """
+    The user's entitlement snapshot (status, trial/premium end, usage
+    counters, limits) as an immutable mapping, served from the per-user
+    cache in entitlements and loaded in one query on a miss.
+    Returns None if the user does not exist.
+    """
+    settings_fingerprint = settings_service.get_fingerprint(db)
+    snapshot = entitlements.lookup(user_id, settings_fingerprint)
+    if snapshot is None:
+        loaded = _load_usage_snapshot(db, user_id)
+        if loaded is None:
+            return None
+        snapshot = entitlements.store(user_id, settings_fingerprint, loaded)
+    return snapshot
+
+
+def _load_usage_snapshot(db: Session, user_id: str) -> Optional[dict]:
+    """
+    Load everything the quota checks need in a single query:
+    the user row (with its precomputed trial/premium end dates, see
+    entitlements), today's and this month's usage. Settings come from the
+    cached snapshot.
+    Returns None if the user does not exist.
+    """
+    today = date.today()
+    first_day_of_month = today.replace(day=1)
+
+    daily_used = select(func.coalesce(func.sum(UsageStats.messages_generated), 0)).where(
+        UsageStats.user_id == User.id,
+        UsageStats.date == today
+    ).scalar_subquery()
+    rewarded_bonus = select(func.coalesce(func.sum(UsageStats.rewarded_video_bonus), 0)).where(
+        UsageStats.user_id == User.id,
+        UsageStats.date == today
+    ).scalar_subquery()
+    monthly_used = select(func.coalesce(func.sum(UsageStats.messages_generated), 0)).where(
+        UsageStats.user_id == User.id,
+        UsageStats.date >= first_day_of_month
+    ).scalar_subquery()
+
+    row = db.execute(
+        select(
+            User.trial_ends_at,
+            User.premium_until,
+            daily_used.label('daily_used'),
+            rewarded_bonus.label('rewarded_bonus'),
+            monthly_used.label('monthly_used'),
+        ).where(User.id == user_id)
+    ).first()
+
+    if row is None:
+        return None
+
+    now = utc_now()
+    trial_end = row.trial_ends_at
+
+    return {
+        'status': entitlements.effective_status(trial_end, row.premium_until, now),
+        'trial_days_remaining': max(0, (trial_end - now).days) if trial_end else 0,
+        'trial_ends_at': trial_end,
+        'premium_until': row.premium_until,
+        'daily_used': int(row.daily_used or 0),
+        'rewarded_bonus': int(row.rewarded_bonus or 0),
+        'monthly_used': int(row.monthly_used or 0),
+        'freemium_enabled': get_setting_bool(db, 'freemium_enabled', True),
+        'free_messages_per_day': get_setting_int(db, 'free_messages_per_day', 10),
+        'free_messages_per_month': get_setting_int(db, 'free_messages_per_month', 300),
+    }
 
 
 def get_user_subscription_status(db: Session, user_id: str) -> str:
     """
     Get the current subscription status of a user.
     Returns: 'premium', 'trial', or 'free'
+    Read-only: the stored users.subscription_status is kept current by expiry_sweeper.
     """
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
+    snapshot = get_usage_snapshot(db, user_id)
+    if not snapshot:
         return 'free'
     
-    # Check for active subscription
-    active_subscription = db.query(Subscription).filter(
-        Subscription.user_id == user_id,
-        Subscription.status == 'active',
-        Subscription.expires_at > utc_now()
-    ).first()
-    
-    if active_subscription:
-        # Update user status if needed
-        if user.subscription_status != 'premium':
-            user.subscription_status = 'premium'
-            db.commit()
-        return 'premium'
-    
-    # Check trial status
-    if user.trial_started_at:
-        trial_days = get_setting_int(db, 'trial_days', 14)
-        
-        # Add coupon trial extensions
-        try:
-            from coupon_service import get_user_trial_extension
-            extra_days = get_user_trial_extension(db, user_id)
-            trial_days += extra_days
-        except Exception:
-            pass  # Ignore if coupon service not available
-        
-        trial_end = user.trial_started_at + timedelta(days=trial_days)
-        
-        if utc_now() < trial_end:
-            if user.subscription_status != 'trial':
-                user.subscription_status = 'trial'
-                db.commit()
-            return 'trial'
-    
-    # No active subscription and trial expired (or never started)
-    if user.subscription_status != 'free':
-        user.subscription_status = 'free'
-        db.commit()
-    
-    return 'free'
+    return snapshot['status']
 
 
 def start_trial(db: Session, user_id: str) -> bool:
@@ -103,29 +134,15 @@ def start_trial(db: Session, user_id: str) -> bool:
     
     user.trial_started_at = utc_now()
     user.subscription_status = 'trial'
+    entitlements.refresh_user(db, user_id)
     db.commit()
     return True
 
 
 def get_trial_days_remaining(db: Session, user_id: str) -> int:
     """Get the number of trial days remaining for a user (including coupon extensions)"""
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user or not user.trial_started_at:
-        return 0
-    
-    trial_days = get_setting_int(db, 'trial_days', 14)
-    
-    # Add coupon trial extensions
-    try:
-        from coupon_service import get_user_trial_extension
-        extra_days = get_user_trial_extension(db, user_id)
-        trial_days += extra_days
-    except Exception:
-        pass  # Ignore if coupon service not available
-    
-    trial_end = user.trial_started_at + timedelta(days=trial_days)
-    remaining = (trial_end - utc_now()).days
-    return max(0, remaining)
+    snapshot = get_usage_snapshot(db, user_id)
+    return snapshot['trial_days_remaining'] if snapshot else 0
 
 
 def get_daily_usage(db: Session, user_id: str) -> int:
@@ -150,39 +167,49 @@ def get_rewarded_video_bonus(db: Session, user_id: str) -> int:
     return usage.rewarded_video_bonus if usage else 0
 
 
-def add_rewarded_video_bonus(db: Session, user_id: str, bonus_messages: int = 25) -> bool:
+def _usage_upsert(user_id: str, messages: int = 0, bonus: int = 0):
+    """INSERT today's usage row, or add to it if it exists (one atomic statement)"""
+    stmt = insert(UsageStats).values(
+        user_id=user_id,
+        date=date.today(),
+        messages_generated=messages,
+        rewarded_video_bonus=bonus
+    )
+    return stmt.on_conflict_do_update(
+        constraint='uq_usage_stats_user_date',
+        set_={
+            'messages_generated': UsageStats.messages_generated + messages,
+            'rewarded_video_bonus': UsageStats.rewarded_video_bonus + bonus,
+            'updated_at': func.now()
+        }
+    ).returning(UsageStats.messages_generated, UsageStats.rewarded_video_bonus)
+
+
+def increment_usage(db: Session, user_id: str, messages: int = 1, bonus: int = 0) -> Optional[dict]:
     """
-    Add rewarded video bonus messages for today.
-    Returns True if successful.
+    Atomically add to today's counters.
+    Returns the new counters {'messages_generated', 'rewarded_video_bonus'}, or None on error.
     """
-    today = date.today()
-
-    # Try to find existing record for today
-    usage = db.query(UsageStats).filter(
-        UsageStats.user_id == user_id,
-        UsageStats.date == today
-    ).first()
-
-    if usage:
-        usage.rewarded_video_bonus += bonus_messages
-        usage.updated_at = utc_now()
-    else:
-        usage = UsageStats(
-            user_id=user_id,
-            date=today,
-            messages_generated=0,
-            rewarded_video_bonus=bonus_messages
-        )
-        db.add(usage)
-
     try:
+        row = db.execute(_usage_upsert(user_id, messages, bonus)).one()
+        entitlements.invalidate(db, [user_id])
         db.commit()
-        print(f"✅ [USAGE] Added {bonus_messages} rewarded video bonus messages for user {user_id}")
-        return True
     except Exception as e:
         db.rollback()
-        print(f"❌ [USAGE] Error adding rewarded video bonus: {e}")
+        print(f"❌ [USAGE] Error updating usage counters: {e}")
+        return None
+    return {'messages_generated': row.messages_generated, 'rewarded_video_bonus': row.rewarded_video_bonus}
+
+
+def add_rewarded_video_bonus(db: Session, user_id: str, bonus_messages: int = 25) -> bool:
+    """
+    Add rewarded video bonus messages for today.
+    Returns True if successful.
+    """
+    if increment_usage(db, user_id, messages=0, bonus=bonus_messages) is None:
         return False
+    print(f"✅ [USAGE] Added {bonus_messages} rewarded video bonus messages for user {user_id}")
+    return True
 
 
 def get_monthly_usage(db: Session, user_id: str) -> int:
@@ -201,12 +228,16 @@ def get_monthly_usage(db: Session, user_id: str) -> int:
 def check_can_generate_message(db: Session, user_id: str) -> Tuple[bool, dict]:
     """
     Check if a user can generate a message.
+    All inputs come from the (cached) get_usage_snapshot().
 
     Returns:
         Tuple[bool, dict]: (can_generate, info)
         info contains: status, daily_used, daily_limit, rewarded_bonus, monthly_used, monthly_limit, trial_days_remaining
     """
-    status = get_user_subscription_status(db, user_id)
+    snapshot = get_usage_snapshot(db, user_id)
+    status = 'free'
+    if snapshot:
+        status = snapshot['status']
 
     info = {
         'status': status,
@@ -227,23 +258,27 @@ def check_can_generate_message(db: Session, user_id: str) -> Tuple[bool, dict]:
 
     # Trial users have no limits (but show remaining days)
     if status == 'trial':
-        info['trial_days_remaining'] = get_trial_days_remaining(db, user_id)
+        info['trial_days_remaining'] = snapshot['trial_days_remaining']
         return True, info
 
+    if not snapshot:
+        info['can_generate'] = False
+        info['reason'] = 'user_not_found'
+        return False, info
+
     # Free users have limits
-    freemium_enabled = get_setting_bool(db, 'freemium_enabled', True)
-    if not freemium_enabled:
+    if not snapshot['freemium_enabled']:
         info['can_generate'] = False
         info['reason'] = 'freemium_disabled'
         return False, info
 
     # New model: 10 free messages + rewarded video bonuses
-    daily_limit = get_setting_int(db, 'free_messages_per_day', 10)
-    monthly_limit = get_setting_int(db, 'free_messages_per_month', 300)
+    daily_limit = snapshot['free_messages_per_day']
+    monthly_limit = snapshot['free_messages_per_month']
 
-    daily_used = get_daily_usage(db, user_id)
-    rewarded_bonus = get_rewarded_video_bonus(db, user_id)
-    monthly_used = get_monthly_usage(db, user_id)
+    daily_used = snapshot['daily_used']
+    rewarded_bonus = snapshot['rewarded_bonus']
+    monthly_used = snapshot['monthly_used']
 
     # Total available = base limit + rewarded bonus
     total_daily_limit = daily_limit + rewarded_bonus
@@ -276,32 +311,109 @@ def record_message_usage(db: Session, user_id: str) -> bool:
     Record that a user generated a message.
     Returns True if successful.
     """
+    return increment_usage(db, user_id) is not None
+
+
+def _reserve_within_limits(db: Session, user_id: str, daily_limit: int, monthly_limit: int) -> Optional[dict]:
+    """
+    Count one message only while the user is under the daily limit (plus
+    today's rewarded bonus) and the monthly limit, in a single statement.
+    Returns the new counters, or None if a limit was reached.
+    """
     today = date.today()
-    
-    # Try to find existing record for today
-    usage = db.query(UsageStats).filter(
+    # Earlier days of the month only: today's count is re-read from the locked
+    # row in the conflict branch, so concurrent reservations can't overshoot
+    earlier_this_month = select(func.coalesce(func.sum(UsageStats.messages_generated), 0)).where(
         UsageStats.user_id == user_id,
-        UsageStats.date == today
-    ).first()
-    
-    if usage:
-        usage.messages_generated += 1
-        usage.updated_at = utc_now()
-    else:
-        usage = UsageStats(
-            user_id=user_id,
-            date=today,
-            messages_generated=1
+        UsageStats.date >= today.replace(day=1),
+        UsageStats.date < today
+    ).scalar_subquery()
+
+    # Inserting today's first row still has to respect both limits
+    source = select(
+        literal(user_id), literal(today), literal(1), literal(0)
+    ).where(earlier_this_month < monthly_limit, literal(daily_limit) > 0)
+    stmt = insert(UsageStats).from_select(
+        ['user_id', 'date', 'messages_generated', 'rewarded_video_bonus'], source
+    )
+    stmt = stmt.on_conflict_do_update(
+        constraint='uq_usage_stats_user_date',
+        set_={
+            'messages_generated': UsageStats.messages_generated + 1,
+            'updated_at': func.now()
+        },
+        where=and_(
+            UsageStats.messages_generated < UsageStats.rewarded_video_bonus + daily_limit,
+            UsageStats.messages_generated + earlier_this_month < monthly_limit
         )
-        db.add(usage)
-    
+    ).returning(UsageStats.messages_generated, UsageStats.rewarded_video_bonus)
+
+    row = db.execute(stmt).first()
+    if row is not None:
+        entitlements.invalidate(db, [user_id])
+    db.commit()
+    if row is None:
+        return None
+    return {'messages_generated': row.messages_generated, 'rewarded_video_bonus': row.rewarded_video_bonus}
+
+
+def reserve_message_usage(db: Session, user_id: str) -> Tuple[bool, dict]:
+    """
+    Check the quota and count the message in one atomic step.
+    Call before generating; call release_message_usage() if generation fails.
+
+    Returns:
+        Tuple[bool, dict]: (reserved, info) - info as in check_can_generate_message,
+        with the counters after the reservation
+    """
+    can_generate, info = check_can_generate_message(db, user_id)
+    if not can_generate:
+        return False, info
+
+    if info['status'] in ('premium', 'trial'):
+        # No quota to enforce - the counter only feeds analytics
+        if usage_buffer.is_enabled():
+            usage_buffer.add(user_id)
+            return True, info
+        if increment_usage(db, user_id) is None:
+            info['can_generate'] = False
+            info['reason'] = 'usage_error'
+            return False, info
+        return True, info
+
+    counters = _reserve_within_limits(db, user_id, info['daily_limit'], info['monthly_limit'])
+    if counters is None:
+        # Lost a race for the last message - report the current counters
+        _, info = check_can_generate_message(db, user_id)
+        info['can_generate'] = False
+        info['reason'] = info['reason'] or 'daily_limit_reached'
+        return False, info
+
+    total_daily_limit = info['daily_limit'] + counters['rewarded_video_bonus']
+    info['monthly_used'] += counters['messages_generated'] - info['daily_used']
+    info['daily_used'] = counters['messages_generated']
+    info['rewarded_bonus'] = counters['rewarded_video_bonus']
+    info['messages_remaining'] = max(0, total_daily_limit - counters['messages_generated'])
+    return True, info
+
+
+def release_message_usage(db: Session, user_id: str) -> None:
+    """Give back a message reserved by reserve_message_usage() (generation failed)"""
+    if usage_buffer.is_enabled() and usage_buffer.release(user_id):
+        return
     try:
+        db.query(UsageStats).filter(
+            UsageStats.user_id == user_id,
+            UsageStats.date == date.today()
+        ).update(
+            {UsageStats.messages_generated: func.greatest(UsageStats.messages_generated - 1, 0)},
+            synchronize_session=False
+        )
+        entitlements.invalidate(db, [user_id])
         db.commit()
-        return True
     except Exception as e:
         db.rollback()
-        print(f"❌ [USAGE] Error recording usage: {e}")
-        return False
+        print(f"❌ [USAGE] Error releasing reserved usage: {e}")
 
 
 def get_user_contact_count(db: Session, user_id: str) -> int: